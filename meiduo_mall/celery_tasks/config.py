@@ -1,3 +1,27 @@
 # 在配置文件中添加 中间人的地址
 
 broker_url = 'redis://127.0.0.1:6379/3'
+
+# 定时任务: celery -A celery_tasks.main beat
+beat_schedule = {
+    # 秒杀库存同步到数据库
+    'reconcile-flash-stock': {
+        'task': 'reconcile_flash_stock',
+        'schedule': 10.0,
+    },
+    # 分类商品访问量写入数据库
+    'flush-goods-visit-counts': {
+        'task': 'flush_goods_visit_counts',
+        'schedule': 60.0,
+    },
+    # 补满图形验证码池
+    'refill-captcha-pool': {
+        'task': 'refill_captcha_pool',
+        'schedule': 30.0,
+    },
+    # 发送短信队列中滞留的短信
+    'dispatch-sms': {
+        'task': 'dispatch_sms',
+        'schedule': 30.0,
+    },
+}
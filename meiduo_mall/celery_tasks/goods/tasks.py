@@ -0,0 +1,20 @@
+import logging
+
+from celery_tasks.main import celery_app
+
+logger = logging.getLogger('django')
+
+
+@celery_app.task(name='flush_goods_visit_counts')
+def flush_goods_visit_counts():
+    """
+    把 Redis 中累加的分类商品访问量写入数据库, 由 celery beat 定时执行
+    :return: 写入的 (日期, 分类) 数量
+    """
+    from goods.visit_counts import flush
+
+    try:
+        return flush()
+    except Exception as e:
+        # 未写入的访问量已经放回 Redis, 下次定时任务会再次写入
+        logger.error(e)
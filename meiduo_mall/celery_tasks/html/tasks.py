@@ -0,0 +1,41 @@
+import logging
+
+from celery_tasks.main import celery_app
+
+logger = logging.getLogger('django')
+
+
+@celery_app.task(bind=True, name='generate_static_sku_detail_html', retry_backoff=3)
+def generate_static_sku_detail_html(self, sku_id):
+    """
+    生成商品详情页的静态文件
+    :param sku_id: 商品sku id
+    :return: None
+    """
+    from goods.utils import generate_static_sku_detail_html as generate_html
+
+    try:
+        generate_html(sku_id)
+    except Exception as e:
+        logger.error(e)
+        # 有异常自动重试三次
+        raise self.retry(exc=e, max_retries=3)
+
+
+@celery_app.task(bind=True, name='generate_static_index_html', retry_backoff=3)
+def generate_static_index_html(self):
+    """
+    生成首页静态文件
+    :return: None
+    """
+    from django.core.cache import cache
+    from contents.crons import INDEX_HTML_PENDING_KEY, generate_static_index_html as generate_html
+
+    # 先清除排队标记, 生成期间的新修改会再次安排生成
+    cache.delete(INDEX_HTML_PENDING_KEY)
+    try:
+        generate_html()
+    except Exception as e:
+        logger.error(e)
+        # 有异常自动重试三次
+        raise self.retry(exc=e, max_retries=3)
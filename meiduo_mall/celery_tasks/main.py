@@ -10,4 +10,6 @@ celery_app = Celery('meiduo')
 celery_app.config_from_object('celery_tasks.config')
 
 # 自动注册 celery 任务
-celery_app.autodiscover_tasks(['celery_tasks.sms', 'celery_tasks.email'])
+celery_app.autodiscover_tasks(['celery_tasks.sms', 'celery_tasks.email', 'celery_tasks.html', 'celery_tasks.stock',
+                                'celery_tasks.orders', 'celery_tasks.goods',
+                                'celery_tasks.verifications'])
@@ -0,0 +1,18 @@
+from celery_tasks.main import celery_app
+
+
+@celery_app.task(name='create_order')
+def create_order(order_id, user_id, address_id, pay_method, items, flash_sku_ids=None):
+    """
+    保存排队的订单, 结果写入 Redis 中的订单状态, 前端轮询查询
+    :param order_id: 订单号
+    :param user_id: 用户id
+    :param address_id: 收货地址id
+    :param pay_method: 支付方式
+    :param items: 勾选的商品 [(sku_id, count)]
+    :param flash_sku_ids: 提交订单时已扣减 Redis 库存的秒杀商品 id
+    :return: None
+    """
+    from orders.utils import process_order_ticket
+
+    process_order_ticket(order_id, user_id, address_id, pay_method, items, flash_sku_ids)
@@ -0,0 +1,371 @@
+"""
+短信批量发送: 待发送的短信放入 Redis 队列, 由 dispatch_sms 任务成批取出, 通过保持连接的 HTTP 客户端逐条发送
+
+- 每个 worker 进程(线程)对每个服务商只保持一个 keep-alive 连接, 签名每秒只计算一次, 请求和响应都使用 json
+- 队列中有短信时只提交一个 dispatch_sms 任务, 任务开始执行之前放入的短信会在同一批中发送
+- 同时向一个服务商发送的任务数不超过服务商配置的 concurrency, 名额保存在 Redis 有序集合中, 每发送一条短信前按需续期,
+  任务异常退出时名额到期自动释放
+- 取出的一批短信同时放入任务自己的处理中列表, 任务出错时把没有发送的短信放回队列;
+  任务被强制结束时, 下一个任务获取名额时把到期名额的处理中列表放回队列(其中已经发送的短信会再发送一次)
+- 服务商返回临时错误(网络错误、5xx)的短信放回队列, 最多尝试 SMS_MAX_ATTEMPTS 次, 其他错误(号码无效、发送过频繁等)不再重试;
+  网络错误时这一批剩余的短信也放回队列, 稍后再发送
+
+服务商配置在 settings.SMS_PROVIDERS 中, settings.SMS_PROVIDER 为当前使用的服务商,
+压力测试时可以使用 scripts/fake_sms_provider.py 启动的本地模拟服务
+"""
+import base64
+import datetime
+import hashlib
+import http.client
+import json
+import logging
+import ssl
+import threading
+import time
+import uuid
+from collections import deque
+
+from django.conf import settings
+from django_redis import get_redis_connection
+
+from meiduo_mall.utils.redis_script import RedisScript
+
+logger = logging.getLogger('django')
+
+# 待发送的短信队列
+SMS_QUEUE_KEY = 'sms_queue'
+
+# 已经提交 dispatch_sms 任务的标记, 任务开始取队列时删除
+SMS_DISPATCH_FLAG_KEY = 'sms_dispatch_scheduled'
+
+# 标记的有效期, 单位: 秒, 任务丢失时到期后可以再次提交
+SMS_DISPATCH_FLAG_EXPIRES = 60
+
+# 服务商发送名额的有序集合: {任务令牌: 到期时间}
+SMS_SLOTS_KEY = 'sms_slots_%s'
+
+# 名额的有效期, 单位: 秒
+SMS_SLOT_EXPIRES = 60
+
+# 名额续期的间隔, 单位: 秒, 发送每条短信前距离上次续期超过这个时间时续期
+# 一条短信最多等待两次请求超时(重新连接), 续期间隔加上两次超时要小于名额的有效期
+SMS_SLOT_RENEW_INTERVAL = 10
+
+# 任务正在发送的一批短信, 任务被强制结束时由下一个任务放回队列
+SMS_PROCESSING_KEY = 'sms_processing_%s'
+
+# 每批从队列取出的短信数量
+SMS_BATCH_SIZE = 50
+
+# 每条短信最多尝试发送的次数
+SMS_MAX_ATTEMPTS = 3
+
+# 发送失败后再次发送的延迟, 单位: 秒
+SMS_RETRY_DELAY = 10
+
+# 可以重试的服务商状态码: 172001 网络错误; 另外服务商返回 5xx 时状态码为 HTTP 状态码, 也可以重试
+SMS_TRANSIENT_STATUS_CODES = {'172001'}
+
+# 取出一批短信, 同时放入任务的处理中列表
+# KEYS[1]: 队列 KEYS[2]: 处理中列表  ARGV[1]: 数量
+POP_BATCH_SCRIPT = RedisScript("""
+local items = redis.call('LRANGE', KEYS[1], 0, tonumber(ARGV[1]) - 1)
+redis.call('LTRIM', KEYS[1], #items, -1)
+for i = 1, #items do
+    redis.call('RPUSH', KEYS[2], items[i])
+end
+return items
+""")
+
+# 获取发送名额: 先清理到期的名额并把它们的处理中列表放回队列头部, 没有超过并发数时占用一个
+# KEYS[1]: 名额有序集合 KEYS[2]: 队列
+# ARGV[1]: 当前时间 ARGV[2]: 到期时间 ARGV[3]: 并发数 ARGV[4]: 任务令牌 ARGV[5]: 处理中列表的键名格式
+ACQUIRE_SLOT_SCRIPT = RedisScript("""
+local expired = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+for i = 1, #expired do
+    local processing = string.gsub(ARGV[5], '%%s', expired[i])
+    while redis.call('RPOPLPUSH', processing, KEYS[2]) do
+    end
+end
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+if redis.call('ZCARD', KEYS[1]) >= tonumber(ARGV[3]) then
+    return 0
+end
+redis.call('ZADD', KEYS[1], ARGV[2], ARGV[4])
+return 1
+""")
+
+
+class SMSNetworkError(Exception):
+    """连接服务商失败或者没有收到响应, 短信可能没有发出"""
+    pass
+
+
+class CCPClient(object):
+    """
+    云通讯模板短信接口的客户端, 和 CCPRestSDK.REST.sendTemplateSMS 的请求一致, 但是:
+    保持一个 keep-alive 连接, 签名和认证头每秒只计算一次, 使用 json 格式, 直接 json.loads 解析响应
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self._conn = None
+        self._batch = None
+        self._path = None
+        self._headers = None
+
+    def _connect(self):
+        config = self.config
+        if config.get('ssl', True):
+            context = ssl.create_default_context()
+            if not config.get('verify_ssl', True):
+                context.check_hostname = False
+                context.verify_mode = ssl.CERT_NONE
+            return http.client.HTTPSConnection(config['host'], config['port'], timeout=config.get('timeout', 5),
+                                               context=context)
+        return http.client.HTTPConnection(config['host'], config['port'], timeout=config.get('timeout', 5))
+
+    def _sign(self):
+        """签名和认证头使用精确到秒的时间戳, 同一秒内复用"""
+        batch = datetime.datetime.now().strftime('%Y%m%d%H%M%S')
+        if batch != self._batch:
+            config = self.config
+            sig = hashlib.md5((config['account_sid'] + config['account_token'] + batch).encode()).hexdigest().upper()
+            self._path = '/%s/Accounts/%s/SMS/TemplateSMS?sig=%s' % (config['version'], config['account_sid'], sig)
+            self._headers = {
+                'Accept': 'application/json',
+                'Content-Type': 'application/json;charset=utf-8',
+                'Authorization': base64.b64encode((config['account_sid'] + ':' + batch).encode()).decode(),
+            }
+            self._batch = batch
+        return self._path, self._headers
+
+    def _request(self, body):
+        """发送一次请求, 复用的连接已经被服务商关闭时重新连接再发送一次"""
+        path, headers = self._sign()
+        for retry in (True, False):
+            reused = self._conn is not None
+            if not reused:
+                self._conn = self._connect()
+            try:
+                self._conn.request('POST', path, body, headers)
+                response = self._conn.getresponse()
+                data = response.read()
+            except (http.client.HTTPException, OSError) as e:
+                self.close()
+                # 只有复用的空闲连接被对方关闭时才重发, 新连接失败直接报错, 避免重复发送
+                if reused and retry and isinstance(e, (http.client.RemoteDisconnected, ConnectionResetError,
+                                                       BrokenPipeError)):
+                    continue
+                raise SMSNetworkError(e)
+            if response.will_close:
+                self.close()
+            return response.status, data
+
+    def send(self, mobile, datas, template_id):
+        """
+        发送模板短信
+        :param mobile: 手机号
+        :param datas: 模板数据, 例如 [验证码, 有效分钟数]
+        :param template_id: 模板id
+        :return: (是否成功, 服务商返回的数据)
+        """
+        # 包体为 bytes 时 http.client 和请求头一起发送, 避免 Nagle 算法和延迟确认造成的等待
+        body = json.dumps({
+            'to': mobile,
+            'datas': [str(data) for data in datas],
+            'templateId': str(template_id),
+            'appId': self.config['app_id'],
+        }).encode()
+        status, data = self._request(body)
+        try:
+            result = json.loads(data.decode())
+        except ValueError:
+            result = None
+        if status >= 500 or not isinstance(result, dict):
+            # 服务商出错或者没有返回 json 时使用 HTTP 状态码
+            result = {'statusCode': str(status), 'body': data[:200].decode(errors='replace')}
+        # 发送成功时 statusCode 为 "000000"
+        return result.get('statusCode') == '000000', result
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+# 每个线程对每个服务商保持一个客户端
+_local = threading.local()
+
+
+def get_client(provider):
+    """获取当前线程的服务商客户端"""
+    clients = getattr(_local, 'clients', None)
+    if clients is None:
+        clients = _local.clients = {}
+    client = clients.get(provider)
+    if client is None:
+        client = clients[provider] = CCPClient(settings.SMS_PROVIDERS[provider])
+    return client
+
+
+def _get_redis_conn():
+    """短信队列使用的 Redis 连接"""
+    return get_redis_connection('verify_code')
+
+
+def _schedule(redis_conn, countdown=None):
+    """没有已提交的任务时提交 dispatch_sms 任务"""
+    from celery_tasks.sms.tasks import dispatch_sms
+
+    if not redis_conn.set(SMS_DISPATCH_FLAG_KEY, 1, nx=True, ex=SMS_DISPATCH_FLAG_EXPIRES + (countdown or 0)):
+        return
+    try:
+        dispatch_sms.apply_async(countdown=countdown)
+    except Exception as e:
+        logger.error(e)
+        redis_conn.delete(SMS_DISPATCH_FLAG_KEY)
+
+
+def queue_sms(mobile, datas, template_id):
+    """
+    把短信放入发送队列
+    :param mobile: 手机号
+    :param datas: 模板数据
+    :param template_id: 模板id
+    """
+    redis_conn = _get_redis_conn()
+    redis_conn.rpush(SMS_QUEUE_KEY, json.dumps({'mobile': mobile, 'datas': list(datas),
+                                                'template_id': template_id, 'attempts': 0}))
+    _schedule(redis_conn)
+
+
+class SlotLease(object):
+    """
+    服务商发送名额的租约, 令牌同时用于任务的处理中列表
+    发送每条短信前调用 renew, 距离上次续期超过 SMS_SLOT_RENEW_INTERVAL 时续期
+    """
+
+    def __init__(self, redis_conn, provider):
+        self.redis_conn = redis_conn
+        self.provider = provider
+        self.key = SMS_SLOTS_KEY % provider
+        self.token = uuid.uuid4().hex
+        self.processing_key = SMS_PROCESSING_KEY % self.token
+        self.renewed_at = 0
+
+    def acquire(self):
+        """获取名额, 没有超过并发数时返回 True"""
+        now = time.time()
+        concurrency = settings.SMS_PROVIDERS[self.provider].get('concurrency', 1)
+        acquired = ACQUIRE_SLOT_SCRIPT(self.redis_conn, keys=[self.key, SMS_QUEUE_KEY],
+                                       args=[now, now + SMS_SLOT_EXPIRES, concurrency, self.token, SMS_PROCESSING_KEY])
+        if acquired:
+            self.renewed_at = now
+        return bool(acquired)
+
+    def renew(self):
+        now = time.time()
+        if now - self.renewed_at >= SMS_SLOT_RENEW_INTERVAL:
+            self.redis_conn.zadd(self.key, {self.token: now + SMS_SLOT_EXPIRES})
+            self.renewed_at = now
+
+    def release(self):
+        self.redis_conn.zrem(self.key, self.token)
+
+
+def _is_transient(result):
+    """服务商返回的错误是否是临时错误, 临时错误可以重试"""
+    status_code = result.get('statusCode') or ''
+    return status_code in SMS_TRANSIENT_STATUS_CODES or (len(status_code) == 3 and status_code.startswith('5'))
+
+
+def _send_batch(client, batch, retry, lease):
+    """
+    逐条发送一批短信, 发送过的短信从 batch 中移除, 需要再次发送的短信放入 retry
+    出现异常时 batch 中剩余的是还没有发送的短信
+    :return: (发送成功的数量, 是否出现网络错误)
+    """
+    sent = 0
+    while batch:
+        lease.renew()
+        message = batch[0]
+        try:
+            success, result = client.send(message['mobile'], message['datas'], message['template_id'])
+        except SMSNetworkError as e:
+            # 服务商可能不可用, 剩余的短信不再尝试
+            logger.error('发送短信失败: %s' % e)
+            message['attempts'] += 1
+            retry.extend(batch)
+            batch.clear()
+            return sent, True
+        batch.popleft()
+        if success:
+            sent += 1
+        elif _is_transient(result):
+            logger.error('发送短信失败: %s %s' % (message['mobile'], result))
+            message['attempts'] += 1
+            retry.append(message)
+        else:
+            logger.error('发送短信失败, 不再重试: %s %s' % (message['mobile'], result))
+    return sent, False
+
+
+def _requeue(redis_conn, lease, messages):
+    """
+    把需要再次发送的短信放回队列, 同时清空处理中列表
+    :return: 是否放回了短信
+    """
+    items = []
+    for message in messages:
+        if message['attempts'] >= SMS_MAX_ATTEMPTS:
+            logger.error('短信发送失败次数过多, 放弃发送: %s' % message['mobile'])
+        else:
+            items.append(json.dumps(message))
+    pl = redis_conn.pipeline()
+    if items:
+        pl.rpush(SMS_QUEUE_KEY, *items)
+    pl.delete(lease.processing_key)
+    pl.execute()
+    return bool(items)
+
+
+def dispatch(provider=None):
+    """
+    发送队列中的短信, 直到队列为空
+    :param provider: 服务商, 默认为 settings.SMS_PROVIDER
+    :return: 发送成功的数量, 没有空闲的发送名额时返回 None
+    """
+    provider = provider or settings.SMS_PROVIDER
+    redis_conn = _get_redis_conn()
+    lease = SlotLease(redis_conn, provider)
+    if not lease.acquire():
+        return None
+
+    client = get_client(provider)
+    sent = 0
+    retry = []
+    batch = deque()
+    try:
+        # 删除标记之后放入的短信会提交新的任务
+        redis_conn.delete(SMS_DISPATCH_FLAG_KEY)
+        while True:
+            items = POP_BATCH_SCRIPT(redis_conn, keys=[SMS_QUEUE_KEY, lease.processing_key], args=[SMS_BATCH_SIZE])
+            if not items:
+                break
+            batch = deque(json.loads(item.decode()) for item in items)
+            size = len(batch)
+            batch_sent, network_error = _send_batch(client, batch, retry, lease)
+            sent += batch_sent
+            if network_error or size < SMS_BATCH_SIZE:
+                # 服务商不可用或者队列已经取完
+                break
+            # 这一批已经发送完, 清空处理中列表
+            redis_conn.delete(lease.processing_key)
+    finally:
+        # 出现异常时 batch 中剩余的短信没有发送, 和失败的短信一起放回队列
+        if _requeue(redis_conn, lease, retry + list(batch)):
+            _schedule(redis_conn, countdown=SMS_RETRY_DELAY)
+        lease.release()
+
+    return sent
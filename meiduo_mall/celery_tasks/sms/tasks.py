@@ -2,37 +2,34 @@
 # name：异步任务别名
 # retry_backoff：异常自动重试的时间间隔 第n次(retry_backoff×2^(n-1))s
 # max_retries：异常自动重试次数的上限
-from venv import logger
+import logging
 
 from celery_tasks.main import celery_app
-from celery_tasks.yuntongxun.ccp_sms import CCP
 from verifications import const
 
+logger = logging.getLogger('django')
 
-@celery_app.task(bind = True, name='send_sms_code', retry_backoff=3)
-def send_sms_code(self, mobile, sms_code):
+
+@celery_app.task(name='send_sms_code')
+def send_sms_code(mobile, sms_code):
     """
-    异步发送短信
-    :param self:
+    异步发送短信验证码: 放入短信队列, 由 dispatch_sms 任务批量发送
     :param mobile:
     :param sms_code:
     :return:
     """
+    from celery_tasks.sms.dispatch import queue_sms
 
-    try:
-        # 调用CCP() 发送短信，并传递相关参数
-        result = CCP().send_template_sms(mobile,
-                                         [sms_code, const.IMAGE_COOE_REDIS_EXPIRES // 60], 1)
-
-    except Exception as e:
-        # 如果发送过程出错，打印错误日志
-        logger.error(e)
+    queue_sms(mobile, [sms_code, const.IMAGE_COOE_REDIS_EXPIRES // 60], 1)
 
-        # 有异常自动重试三次
-        raise self.retry(exc=e, max_retries=3)
 
-        # 如果发送成功，rend_ret 为0
-    if result != 0:
-        raise self.retry(exc=Exception('发送短信失败', max_retries=3))
+@celery_app.task(name='dispatch_sms')
+def dispatch_sms():
+    """
+    批量发送队列中的短信, 队列中有短信时提交, celery beat 也会定时执行, 避免短信滞留在队列中
+    发送名额已满时直接返回, 不重试: 正在发送的任务会继续取队列直到队列为空, 剩下的由 celery beat 发送
+    :return: 发送成功的数量, 发送名额已满时返回 None
+    """
+    from celery_tasks.sms.dispatch import dispatch
 
-    return result
+    return dispatch()
@@ -0,0 +1,20 @@
+import logging
+
+from celery_tasks.main import celery_app
+
+logger = logging.getLogger('django')
+
+
+@celery_app.task(name='reconcile_flash_stock')
+def reconcile_flash_stock():
+    """
+    把秒杀商品在 Redis 中已售出的数量同步到数据库, 由 celery beat 定时执行
+    :return: 同步的 SKU 数量
+    """
+    from orders.flash_stock import reconcile
+
+    try:
+        return reconcile()
+    except Exception as e:
+        # 未同步的数量已经放回 Redis, 下次定时任务会再次同步
+        logger.error(e)
@@ -0,0 +1,24 @@
+import logging
+
+from celery_tasks.main import celery_app
+
+logger = logging.getLogger('django')
+
+
+@celery_app.task(name='refill_captcha_pool')
+def refill_captcha_pool(token=None):
+    """
+    把图形验证码池补满, 验证码池数量不足时提交, celery beat 也会定时执行
+    :param token: 补充标记的令牌, 由数量不足时提交的任务传入, 任务结束时只清除自己的标记;
+                  定时执行时为 None, 不清除标记
+    :return: 生成的验证码数量
+    """
+    from verifications import captcha_pool
+
+    try:
+        return captcha_pool.refill()
+    except Exception as e:
+        logger.error(e)
+    finally:
+        if token:
+            captcha_pool.finish_refill(token)
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class AreasConfig(AppConfig):
     name = 'areas'
+
+    def ready(self):
+        # 注册信号处理函数
+        from areas import signals  # noqa
@@ -0,0 +1,2 @@
+# 进程内地区树的有效期, 单位: 秒 (地区数据基本不变, 到期后重新加载, 其他进程修改的数据最迟在到期后生效)
+AREA_TREE_EXPIRES = 3600 * 24
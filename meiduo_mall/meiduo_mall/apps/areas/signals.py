@@ -0,0 +1,11 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from areas.models import Area
+from areas.utils import reset_area_tree
+
+
+@receiver([post_save, post_delete], sender=Area)
+def invalidate_area_tree(sender, **kwargs):
+    """地区变化时, 重新加载当前进程的地区树"""
+    reset_area_tree()
@@ -0,0 +1,127 @@
+"""
+地区树: 一次查询加载 tb_areas 的所有数据, 保存在进程内存中, 省市区接口不再访问数据库和 Redis
+
+数据按照 id 排序保存在数组中, 通过二分查找定位;
+子级地区按照上级地区分组连续存放, child_offsets[i] 到 child_offsets[i + 1] 为第 i 个地区的子级在 children 中的范围
+"""
+import hashlib
+import threading
+import time
+from array import array
+from bisect import bisect_left
+
+from django.utils import timezone
+
+from areas import constants
+from areas.models import Area
+
+
+class AreaTree(object):
+    """按照 id 排序的数组保存的地区树"""
+
+    def __init__(self, rows):
+        """
+        :param rows: 按照 id 排序的 [(id, name, parent_id)]
+        """
+        self.ids = array('l', [row[0] for row in rows])
+        self.names = tuple(row[1] for row in rows)
+
+        # 每个地区的上级在数组中的位置, 没有上级(或者上级不存在)的为 -1
+        parents = array('l', [self._index(row[2]) if row[2] is not None else -1 for row in rows])
+
+        # 统计每个地区的子级数量, 计算每组子级的起始位置
+        counts = array('l', [0] * len(rows))
+        for parent in parents:
+            if parent >= 0:
+                counts[parent] += 1
+        self.child_offsets = array('l', [0] * (len(rows) + 1))
+        for i, count in enumerate(counts):
+            self.child_offsets[i + 1] = self.child_offsets[i] + count
+
+        # 按照 id 顺序把子级放入各自的分组
+        self.children = array('l', [0] * self.child_offsets[-1])
+        filled = array('l', self.child_offsets[:-1])
+        for i, parent in enumerate(parents):
+            if parent >= 0:
+                self.children[filled[parent]] = i
+                filled[parent] += 1
+        self.roots = array('l', [i for i, parent in enumerate(parents) if parent < 0])
+
+        # 数据的摘要作为 ETag, 各个进程加载到相同的数据时 ETag 一致
+        digest = hashlib.md5()
+        for row in rows:
+            digest.update(('%s,%s,%s\n' % row).encode())
+        self.etag = digest.hexdigest()
+        self.last_modified = timezone.now()
+
+    def _index(self, area_id):
+        """查找地区在数组中的位置, 不存在时返回 -1"""
+        i = bisect_left(self.ids, area_id)
+        if i < len(self.ids) and self.ids[i] == area_id:
+            return i
+        return -1
+
+    def _area(self, i):
+        return {'id': self.ids[i], 'name': self.names[i]}
+
+    def get_provinces(self):
+        """
+        获取省份
+        :return: [{'id': id, 'name': name}]
+        """
+        return [self._area(i) for i in self.roots]
+
+    def get_sub_data(self, area_id):
+        """
+        获取地区和它的下级地区
+        :param area_id: 地区id
+        :return: {'id': id, 'name': name, 'subs': [{'id': id, 'name': name}]}, 地区不存在时返回 None
+        """
+        i = self._index(int(area_id))
+        if i < 0:
+            return None
+        data = self._area(i)
+        data['subs'] = [self._area(child) for child in
+                        self.children[self.child_offsets[i]:self.child_offsets[i + 1]]]
+        return data
+
+
+# 进程内的地区树和加载的时间
+_area_tree = None
+_loaded_at = 0
+_lock = threading.Lock()
+
+
+def get_area_tree():
+    """
+    获取地区树, 进程内第一次使用或者过期时加载, 同一个进程内只有一个线程查询数据库
+    :return: AreaTree
+    """
+    global _area_tree, _loaded_at
+
+    tree = _area_tree
+    if tree is not None and time.time() - _loaded_at < constants.AREA_TREE_EXPIRES:
+        return tree
+
+    with _lock:
+        if _area_tree is None or time.time() - _loaded_at >= constants.AREA_TREE_EXPIRES:
+            rows = list(Area.objects.order_by('id').values_list('id', 'name', 'parent_id'))
+            _area_tree = AreaTree(rows)
+            _loaded_at = time.time()
+        return _area_tree
+
+
+def reset_area_tree():
+    """地区数据变化时, 让当前进程的地区树失效"""
+    global _area_tree
+    _area_tree = None
+
+
+def area_tree_etag(request, *args, **kwargs):
+    """省市区接口的 ETag"""
+    return get_area_tree().etag
+
+
+def area_tree_last_modified(request, *args, **kwargs):
+    """省市区接口的 Last-Modified"""
+    return get_area_tree().last_modified
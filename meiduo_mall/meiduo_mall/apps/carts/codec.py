@@ -0,0 +1,172 @@
+"""
+未登录用户 cookie 购物车的编码
+
+格式: base64url( 版本号(1字节) + 商品数据 + 签名 )
+商品数据: 每件商品依次写入 varint(sku_id) 和 varint(count << 1 | selected)
+签名: 对 版本号 + 商品数据 做 HMAC, 截取前 CART_SIGNATURE_LENGTH 个字节, 防止用户篡改
+
+旧版本的 cookie 是 base64(pickle.dumps(dict)), 只用受限的反序列化读取, 下次写入 cookie 时自动转为新格式
+"""
+import base64
+import binascii
+import hashlib
+import hmac
+import io
+import pickle
+from functools import lru_cache
+
+from django.conf import settings
+from django.utils.crypto import constant_time_compare
+
+# 当前的编码版本号
+CART_CODEC_VERSION = 1
+
+# 签名截取的字节数
+CART_SIGNATURE_LENGTH = 10
+
+# HMAC 使用的盐, 和项目中的其他签名区分开
+CART_SIGNATURE_SALT = 'carts.codec'
+
+
+def _write_varint(buf, value):
+    """把非负整数按 varint 写入 bytearray"""
+    while value > 0x7f:
+        buf.append((value & 0x7f) | 0x80)
+        value >>= 7
+    buf.append(value)
+
+
+def _read_varints(data, start):
+    """
+    从 start 开始读取所有的 varint
+    :return: 整数列表
+    """
+    values = []
+    value = 0
+    shift = 0
+    for byte in data[start:]:
+        if byte < 0x80:
+            values.append(value | (byte << shift))
+            value = 0
+            shift = 0
+        else:
+            value |= (byte & 0x7f) << shift
+            shift += 7
+    if shift:
+        # 最后一个 varint 不完整
+        raise ValueError('varint 不完整')
+    return values
+
+
+@lru_cache(maxsize=4)
+def _base_hmac(secret_key):
+    """
+    已经装入密钥的 HMAC 对象, 密钥的生成方式和 django salted_hmac 一致
+    每次签名时复制一份, 不用重复计算密钥和内外层填充
+    """
+    key = hashlib.sha1((CART_SIGNATURE_SALT + secret_key).encode()).digest()
+    return hmac.new(key, digestmod=hashlib.sha1)
+
+
+def _sign(data):
+    """计算签名"""
+    mac = _base_hmac(settings.SECRET_KEY).copy()
+    mac.update(data)
+    return mac.digest()[:CART_SIGNATURE_LENGTH]
+
+
+def dumps(cart_dict):
+    """
+    编码购物车
+    :param cart_dict: {sku_id: {'count': count, 'selected': selected}}
+    :return: 写入 cookie 的字符串
+    """
+    buf = bytearray([CART_CODEC_VERSION])
+    for sku_id, item in cart_dict.items():
+        count = int(item['count'])
+        # 数量不是正数的商品没有意义, 不写入
+        if count <= 0:
+            continue
+        _write_varint(buf, int(sku_id))
+        _write_varint(buf, count << 1 | (1 if item['selected'] else 0))
+
+    data = bytes(buf)
+    return base64.urlsafe_b64encode(data + _sign(data)).rstrip(b'=').decode()
+
+
+def _loads_v1(data):
+    """解析新格式的购物车, 签名错误时返回 None"""
+    payload, signature = data[:-CART_SIGNATURE_LENGTH], data[-CART_SIGNATURE_LENGTH:]
+    if not constant_time_compare(_sign(payload), signature):
+        return None
+
+    values = _read_varints(payload, 1)
+    if len(values) % 2:
+        return None
+
+    cart_dict = {}
+    for i in range(0, len(values), 2):
+        cart_dict[values[i]] = {
+            'count': values[i + 1] >> 1,
+            'selected': bool(values[i + 1] & 1)
+        }
+    return cart_dict
+
+
+class _RestrictedUnpickler(pickle.Unpickler):
+    """旧购物车只包含 dict/int/bool, 禁止加载任何类和函数"""
+
+    def find_class(self, module, name):
+        raise pickle.UnpicklingError('不允许加载 %s.%s' % (module, name))
+
+
+def _loads_legacy(data):
+    """
+    读取旧版本 pickle 格式的购物车, 只保留格式正确的商品
+    :return: 购物车字典, 无法解析时返回 None
+    """
+    try:
+        legacy_dict = _RestrictedUnpickler(io.BytesIO(data)).load()
+    except Exception:
+        return None
+
+    if not isinstance(legacy_dict, dict):
+        return None
+
+    cart_dict = {}
+    for sku_id, item in legacy_dict.items():
+        try:
+            cart_dict[int(sku_id)] = {
+                'count': int(item['count']),
+                'selected': bool(item['selected'])
+            }
+        except (TypeError, ValueError, KeyError):
+            continue
+    return cart_dict
+
+
+def loads(cookie_cart):
+    """
+    解码购物车, cookie 为空、被篡改或者无法解析时返回空购物车
+    :param cookie_cart: cookie 中的字符串
+    :return: {sku_id: {'count': count, 'selected': selected}}
+    """
+    if not cookie_cart:
+        return {}
+
+    try:
+        data = base64.urlsafe_b64decode(cookie_cart + '=' * (-len(cookie_cart) % 4))
+    except (binascii.Error, ValueError):
+        data = b''
+
+    cart_dict = None
+    if len(data) > CART_SIGNATURE_LENGTH and data[0] == CART_CODEC_VERSION:
+        try:
+            cart_dict = _loads_v1(data)
+        except ValueError:
+            cart_dict = None
+    elif data[:1] == b'\x80':
+        # pickle 数据以 PROTO 操作码 0x80 开头
+        cart_dict = _loads_legacy(data)
+
+    return cart_dict or {}
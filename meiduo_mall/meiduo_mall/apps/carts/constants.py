@@ -0,0 +1,2 @@
+# 购物车合计的有效期, 单位: 秒 (合计中记录的是商品加入购物车时的价格, 过期后按照最新的价格重新计算)
+CART_TOTALS_EXPIRES = 3600
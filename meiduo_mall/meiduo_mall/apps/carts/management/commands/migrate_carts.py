@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from django_redis import get_redis_connection
+
+from carts.storage import RedisCart
+
+
+class Command(BaseCommand):
+    help = '把旧结构的购物车(carts_<user_id> 哈希 + selected_<user_id> 集合)转换为 cart_<user_id> 哈希, 可以在线执行'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch', type=int, default=500, help='每次 SCAN 返回的键数量')
+
+    def handle(self, *args, **options):
+        redis_conn = get_redis_connection('carts')
+
+        # 旧勾选集合可能在购物车哈希删除后单独存在, 两种键都要扫描
+        migrated = set()
+        for pattern in ('carts_*', 'selected_*'):
+            for key in redis_conn.scan_iter(match=pattern, count=options['batch']):
+                cart_id = key.decode().split('_', 1)[1]
+                if cart_id in migrated:
+                    continue
+                # 每个购物车在一个 Lua 脚本中转换, 和正在进行的购物车操作互不影响
+                RedisCart(cart_id).migrate()
+                migrated.add(cart_id)
+
+        self.stdout.write('共转换 %d 个购物车' % len(migrated))
@@ -0,0 +1,624 @@
+"""
+购物车存储
+
+Redis 购物车: 每个购物车只用一个哈希 cart_<cart_id> = {sku_id: count}, count 为正数表示勾选, 负数表示未勾选
+所有操作都在 Lua 脚本中完成, 每次操作只需要一次往返
+
+旧的购物车分为 carts_<user_id> 哈希和 selected_<user_id> 集合两部分,
+每个脚本执行前会先把旧结构合并到新结构中, 也可以使用 migrate_carts 命令批量转换
+
+未登录用户的购物车默认保存在 cookie 中; CARTS_ANONYMOUS_STORAGE = 'redis' 时保存在 Redis 中,
+cookie 中只保存签名后的购物车令牌, 购物车在 CARTS_ANONYMOUS_EXPIRES 秒内没有修改会自动过期
+
+视图通过 get_cart(request) 获取购物车, 三种购物车的接口一致, 修改后调用 save(response) 写入 cookie
+
+购物车合计(商品总数量、勾选数量、勾选金额)保存在 cart_totals_<cart_id> 哈希中, 由修改购物车的脚本增量更新,
+金额以分为单位, 同时记录每件商品计入合计时的价格 p:<sku_id>, 删除商品时按照记录的价格扣减;
+合计在 CART_TOTALS_EXPIRES 秒后过期, 过期后按照最新的价格重新计算, 登录合并购物车时直接删除合计
+"""
+import uuid
+from decimal import Decimal
+
+from django.conf import settings
+from django.core import signing
+from django_redis import get_redis_connection
+
+from carts import codec, constants
+from goods import sku_summary
+from meiduo_mall.utils.redis_script import RedisScript
+
+# 登录时合并购物车的策略
+# cookie: 以 cookie 中的数量为准  sum: 数量相加  max: 取较大的数量
+MERGE_POLICIES = ('cookie', 'sum', 'max')
+
+# cookie 购物车的 cookie 名
+CART_COOKIE = 'carts'
+
+# 未登录用户 Redis 购物车令牌的 cookie 名和签名使用的盐
+CART_TOKEN_COOKIE = 'cart_token'
+CART_TOKEN_SALT = 'carts.token'
+
+# 把旧结构合并到新结构中, 新结构中已有的商品以新结构为准
+# KEYS[1]: 新购物车哈希 KEYS[2]: 旧购物车哈希 KEYS[3]: 旧勾选集合 KEYS[4]: 合计哈希
+MIGRATE_LUA = """
+if redis.call('EXISTS', KEYS[2]) == 1 then
+    redis.call('DEL', KEYS[4])
+    local items = redis.call('HGETALL', KEYS[2])
+    for i = 1, #items, 2 do
+        local count = tonumber(items[i + 1])
+        if count > 0 then
+            if redis.call('SISMEMBER', KEYS[3], items[i]) == 0 then
+                count = -count
+            end
+            redis.call('HSETNX', KEYS[1], items[i], count)
+        end
+    end
+end
+redis.call('DEL', KEYS[2], KEYS[3])
+"""
+
+# 把 items 中的商品合并到购物车中: 已有的商品按照合并策略计算数量, 勾选状态以 items 为准;
+# 新商品在购物车未满时添加
+# items: {sku_id1, 带符号的数量1, sku_id2, 带符号的数量2 ...}
+# 返回: 因为购物车已满而没有合并的商品数量
+MERGE_LUA = """
+local function merge_items(items, start, policy, limit)
+    local size = redis.call('HLEN', KEYS[1])
+    local dropped = 0
+    for i = start, #items, 2 do
+        local new = tonumber(items[i + 1])
+        local old = redis.call('HGET', KEYS[1], items[i])
+        if old then
+            local count = math.abs(new)
+            if policy == 'sum' then
+                count = math.abs(tonumber(old)) + count
+            elseif policy == 'max' then
+                count = math.max(math.abs(tonumber(old)), count)
+            end
+            if new < 0 then
+                count = -count
+            end
+            redis.call('HSET', KEYS[1], items[i], count)
+        elseif size < limit then
+            redis.call('HSET', KEYS[1], items[i], new)
+            size = size + 1
+        else
+            dropped = dropped + 1
+        end
+    end
+    return dropped
+end
+"""
+
+# 增量更新合计: 商品带符号的数量从 old 变为 new, 合计不存在时不处理
+# price: 商品第一次计入合计时的价格(分), 为空字符串且没有记录价格时无法计算, 删除合计等待重新计算
+# 记录的价格为 -1 表示商品已经不存在, 不计入合计
+TOTALS_LUA = """
+local function adjust_totals(sku_id, old, new, price)
+    if old == new or redis.call('EXISTS', KEYS[4]) == 0 then
+        return
+    end
+    local field = 'p:' .. sku_id
+    local recorded = redis.call('HGET', KEYS[4], field)
+    if recorded then
+        price = tonumber(recorded)
+    elseif price ~= '' then
+        price = tonumber(price)
+    else
+        redis.call('DEL', KEYS[4])
+        return
+    end
+    if new == 0 then
+        redis.call('HDEL', KEYS[4], field)
+    else
+        redis.call('HSET', KEYS[4], field, price)
+    end
+    if price < 0 then
+        return
+    end
+    local count = math.abs(new) - math.abs(old)
+    local selected = math.max(new, 0) - math.max(old, 0)
+    redis.call('HINCRBY', KEYS[4], 'count', count)
+    redis.call('HINCRBY', KEYS[4], 'amount', count * price)
+    redis.call('HINCRBY', KEYS[4], 'selected_count', selected)
+    redis.call('HINCRBY', KEYS[4], 'selected_amount', selected * price)
+end
+"""
+
+# 合计哈希中的字段
+TOTALS_FIELDS = ('count', 'amount', 'selected_count', 'selected_amount')
+
+
+def _script(body):
+    """
+    拼接完整的 Lua 脚本: 先转换旧结构, 再执行 body, 最后按需设置购物车的有效期
+    ARGV[1] 为有效期(秒, 0 表示不过期), 执行 body 前移除, body 中的 ARGV 从 1 开始
+    """
+    return RedisScript(MIGRATE_LUA + MERGE_LUA + TOTALS_LUA + """
+local expires = tonumber(table.remove(ARGV, 1))
+local function run()
+""" + body + """
+end
+local result = run()
+if expires > 0 then
+    redis.call('EXPIRE', KEYS[1], expires)
+end
+return result
+""")
+
+
+# 只转换旧结构
+MIGRATE_SCRIPT = _script("""
+return 0
+""")
+
+# 读取购物车
+GET_SCRIPT = _script("""
+return redis.call('HGETALL', KEYS[1])
+""")
+
+# 读取合计
+# 返回: {1, count, amount, selected_count, selected_amount} 或者合计不存在时 {0}
+GET_TOTALS_SCRIPT = _script("""
+if redis.call('EXISTS', KEYS[4]) == 0 then
+    return {0}
+end
+local totals = redis.call('HMGET', KEYS[4], 'count', 'amount', 'selected_count', 'selected_amount')
+table.insert(totals, 1, 1)
+return totals
+""")
+
+# 按照传入的价格重新计算合计, 购物车中有商品没有传入价格(计算期间被添加)时不保存
+# ARGV[1]: 合计的有效期 ARGV[2...]: sku_id1, 价格1(分), sku_id2, 价格2 ...
+# 返回: {count, amount, selected_count, selected_amount} 或者没有保存时 {}
+BUILD_TOTALS_SCRIPT = _script("""
+local prices = {}
+for i = 2, #ARGV, 2 do
+    prices[ARGV[i]] = tonumber(ARGV[i + 1])
+end
+local totals = {0, 0, 0, 0}
+local fields = {}
+local items = redis.call('HGETALL', KEYS[1])
+for i = 1, #items, 2 do
+    local price = prices[items[i]]
+    if not price then
+        return {}
+    end
+    table.insert(fields, 'p:' .. items[i])
+    table.insert(fields, price)
+    if price >= 0 then
+        local count = tonumber(items[i + 1])
+        totals[1] = totals[1] + math.abs(count)
+        totals[2] = totals[2] + math.abs(count) * price
+        if count > 0 then
+            totals[3] = totals[3] + count
+            totals[4] = totals[4] + count * price
+        end
+    end
+end
+redis.call('DEL', KEYS[4])
+redis.call('HMSET', KEYS[4], 'count', totals[1], 'amount', totals[2],
+           'selected_count', totals[3], 'selected_amount', totals[4])
+for i = 1, #fields, 2 do
+    redis.call('HSET', KEYS[4], fields[i], fields[i + 1])
+end
+redis.call('EXPIRE', KEYS[4], ARGV[1])
+return totals
+""")
+
+# 添加商品: 数量累加, 传入勾选或者原来已勾选时为勾选状态
+# ARGV[1]: sku_id ARGV[2]: 数量 ARGV[3]: 是否勾选(1/0) ARGV[4]: 购物车最多的商品种类数 ARGV[5]: 价格(分)
+# 返回: 累加后的数量, 购物车已满时返回 -1
+ADD_SCRIPT = _script("""
+local old = tonumber(redis.call('HGET', KEYS[1], ARGV[1]) or '0')
+if old == 0 and redis.call('HLEN', KEYS[1]) >= tonumber(ARGV[4]) then
+    return -1
+end
+local count = math.abs(old) + tonumber(ARGV[2])
+if count <= 0 then
+    redis.call('HDEL', KEYS[1], ARGV[1])
+    adjust_totals(ARGV[1], old, 0, ARGV[5])
+    return 0
+end
+if ARGV[3] ~= '1' and old <= 0 then
+    count = -count
+end
+redis.call('HSET', KEYS[1], ARGV[1], count)
+adjust_totals(ARGV[1], old, count, ARGV[5])
+return math.abs(count)
+""")
+
+# 修改商品: 直接覆盖数量和勾选状态
+# ARGV[1]: sku_id ARGV[2]: 数量 ARGV[3]: 是否勾选(1/0) ARGV[4]: 价格(分)
+UPDATE_SCRIPT = _script("""
+local old = tonumber(redis.call('HGET', KEYS[1], ARGV[1]) or '0')
+local count = math.max(tonumber(ARGV[2]), 0)
+if count == 0 then
+    redis.call('HDEL', KEYS[1], ARGV[1])
+else
+    if ARGV[3] ~= '1' then
+        count = -count
+    end
+    redis.call('HSET', KEYS[1], ARGV[1], count)
+end
+adjust_totals(ARGV[1], old, count, ARGV[4])
+return 0
+""")
+
+# 合并传入的商品
+# ARGV[1]: 合并策略 ARGV[2]: 购物车最多的商品种类数 ARGV[3...]: sku_id1, 带符号的数量1 ...
+MERGE_SCRIPT = _script("""
+redis.call('DEL', KEYS[4])
+return merge_items(ARGV, 3, ARGV[1], tonumber(ARGV[2]))
+""")
+
+# 合并另一个购物车哈希, 合并后删除它和它的合计; 当前购物车为空时直接改名
+# KEYS[5]: 被合并的购物车哈希 KEYS[6]: 被合并的合计哈希  ARGV[1]: 合并策略 ARGV[2]: 购物车最多的商品种类数
+MERGE_CART_SCRIPT = _script("""
+redis.call('DEL', KEYS[6])
+if redis.call('EXISTS', KEYS[5]) == 0 then
+    return 0
+end
+redis.call('DEL', KEYS[4])
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    redis.call('RENAME', KEYS[5], KEYS[1])
+    redis.call('PERSIST', KEYS[1])
+    return 0
+end
+local dropped = merge_items(redis.call('HGETALL', KEYS[5]), 1, ARGV[1], tonumber(ARGV[2]))
+redis.call('DEL', KEYS[5])
+return dropped
+""")
+
+# 删除商品
+# ARGV: sku_id 列表
+REMOVE_SCRIPT = _script("""
+for i = 1, #ARGV do
+    local old = redis.call('HGET', KEYS[1], ARGV[i])
+    if old then
+        redis.call('HDEL', KEYS[1], ARGV[i])
+        adjust_totals(ARGV[i], tonumber(old), 0, '')
+    end
+end
+return 0
+""")
+
+# 全选或者取消全选
+# ARGV[1]: 是否勾选(1/0)
+SELECT_ALL_SCRIPT = _script("""
+local items = redis.call('HGETALL', KEYS[1])
+for i = 1, #items, 2 do
+    local count = math.abs(tonumber(items[i + 1]))
+    if ARGV[1] ~= '1' then
+        count = -count
+    end
+    redis.call('HSET', KEYS[1], items[i], count)
+end
+if redis.call('EXISTS', KEYS[4]) == 1 then
+    local totals = redis.call('HMGET', KEYS[4], 'count', 'amount')
+    if ARGV[1] ~= '1' then
+        totals = {0, 0}
+    end
+    redis.call('HMSET', KEYS[4], 'selected_count', totals[1], 'selected_amount', totals[2])
+end
+return 0
+""")
+
+
+def _check_policy(policy):
+    """检查合并策略, 不传时使用 CARTS_MERGE_POLICY"""
+    policy = policy or settings.CARTS_MERGE_POLICY
+    if policy not in MERGE_POLICIES:
+        raise ValueError('不支持的购物车合并策略: %s' % policy)
+    return policy
+
+
+def _to_cents(price):
+    """价格转为以分为单位的整数, 未知的价格转为空字符串"""
+    if price is None:
+        return ''
+    return int(Decimal(price) * 100)
+
+
+def _totals_dict(count, amount, selected_count, selected_amount):
+    """
+    构造合计字典, 金额由分转为元
+    :return: {'count': 商品总数量, 'amount': 总金额, 'selected_count': 勾选的数量, 'selected_amount': 勾选的金额}
+    """
+    return {
+        'count': int(count),
+        'amount': Decimal(int(amount)).scaleb(-2),
+        'selected_count': int(selected_count),
+        'selected_amount': Decimal(int(selected_amount)).scaleb(-2)
+    }
+
+
+def compute_totals(cart_dict, prices):
+    """
+    根据购物车和商品价格计算合计, 没有价格的商品(已经不存在)不计入合计
+    :param cart_dict: {sku_id: {'count': count, 'selected': selected}}
+    :param prices: {sku_id: 价格}
+    """
+    totals = [0, 0, 0, 0]
+    for sku_id, item in cart_dict.items():
+        price = prices.get(sku_id)
+        if price is None:
+            continue
+        price = _to_cents(price)
+        totals[0] += item['count']
+        totals[1] += item['count'] * price
+        if item['selected']:
+            totals[2] += item['count']
+            totals[3] += item['count'] * price
+    return _totals_dict(*totals)
+
+
+def get_prices(sku_ids):
+    """
+    读取商品价格
+    :return: {sku_id: 价格}, 不存在的商品被忽略
+    """
+    return {sku['id']: sku['price'] for sku in sku_summary.get_many(sku_ids)}
+
+
+class RedisCart(object):
+    """
+    Redis 购物车
+    cart_id: 购物车的标识, 已登录用户为用户id
+    expires: 购物车的有效期(秒), 每次操作后重新计算, None 表示不过期
+    """
+
+    def __init__(self, cart_id, expires=None):
+        self.cart_id = cart_id
+        self.expires = expires
+        self.modified = False
+        self.redis_conn = get_redis_connection('carts')
+
+    @property
+    def keys(self):
+        """新购物车哈希, 旧购物车哈希, 旧勾选集合, 合计哈希"""
+        return ['cart_%s' % self.cart_id, 'carts_%s' % self.cart_id, 'selected_%s' % self.cart_id,
+                'cart_totals_%s' % self.cart_id]
+
+    def _execute(self, script, *args, extra_keys=()):
+        """执行 Lua 脚本"""
+        args = (self.expires or 0,) + args
+        return script(self.redis_conn, keys=self.keys + list(extra_keys), args=args)
+
+    def get(self):
+        """
+        读取购物车, 格式和 cookie 购物车一致
+        :return: {sku_id: {'count': count, 'selected': selected}}
+        """
+        items = self._execute(GET_SCRIPT)
+        cart_dict = {}
+        for i in range(0, len(items), 2):
+            count = int(items[i + 1])
+            cart_dict[int(items[i])] = {
+                'count': abs(count),
+                'selected': count > 0
+            }
+        return cart_dict
+
+    def get_selected(self):
+        """
+        读取勾选的商品
+        :return: {sku_id: count}
+        """
+        return {sku_id: item['count'] for sku_id, item in self.get().items() if item['selected']}
+
+    def get_totals(self):
+        """
+        读取合计, 合计不存在时按照最新的价格重新计算
+        :return: {'count': 商品总数量, 'amount': 总金额, 'selected_count': 勾选的数量, 'selected_amount': 勾选的金额}
+        """
+        result = self._execute(GET_TOTALS_SCRIPT)
+        if int(result[0]) == 1:
+            return _totals_dict(*result[1:])
+
+        cart_dict = self.get()
+        prices = get_prices(cart_dict.keys())
+        args = [constants.CART_TOTALS_EXPIRES]
+        for sku_id in cart_dict:
+            args.extend([sku_id, _to_cents(prices[sku_id]) if sku_id in prices else -1])
+        totals = self._execute(BUILD_TOTALS_SCRIPT, *args)
+        if totals:
+            return _totals_dict(*totals)
+        # 计算期间购物车被修改, 先返回本次读取到的购物车的合计
+        return compute_totals(cart_dict, prices)
+
+    def add(self, sku_id, count, selected=True, price=None):
+        """
+        添加商品, 数量累加
+        :param price: 商品价格, 用于更新合计
+        :return: 累加后的数量, 购物车已满时返回 -1
+        """
+        self.modified = True
+        return int(self._execute(ADD_SCRIPT, sku_id, count, 1 if selected else 0, settings.CARTS_MAX_ITEMS,
+                                 _to_cents(price)))
+
+    def update(self, sku_id, count, selected, price=None):
+        """
+        修改商品的数量和勾选状态
+        :param price: 商品价格, 用于更新合计
+        """
+        self.modified = True
+        self._execute(UPDATE_SCRIPT, sku_id, count, 1 if selected else 0, _to_cents(price))
+
+    def merge(self, cart_dict, policy=None):
+        """
+        合并购物车, 不论商品有多少, 都只执行一次 Lua 脚本
+        :param cart_dict: {sku_id: {'count': count, 'selected': selected}}
+        :param policy: 合并策略, 不传时使用 CARTS_MERGE_POLICY
+        :return: 因为购物车已满而没有合并的商品数量
+        """
+        args = [_check_policy(policy), settings.CARTS_MAX_ITEMS]
+        for sku_id, item in cart_dict.items():
+            if item['count'] > 0:
+                args.extend([sku_id, item['count'] if item['selected'] else -item['count']])
+        if len(args) == 2:
+            return 0
+        self.modified = True
+        return int(self._execute(MERGE_SCRIPT, *args))
+
+    def merge_cart(self, other, policy=None):
+        """
+        在 Redis 中合并另一个购物车并删除它, 购物车数据不经过应用
+        :param other: 被合并的 RedisCart
+        :param policy: 合并策略, 不传时使用 CARTS_MERGE_POLICY
+        :return: 因为购物车已满而没有合并的商品数量
+        """
+        self.modified = True
+        return int(self._execute(MERGE_CART_SCRIPT, _check_policy(policy), settings.CARTS_MAX_ITEMS,
+                                 extra_keys=[other.keys[0], other.keys[3]]))
+
+    def remove(self, *sku_ids):
+        """删除商品"""
+        self.modified = True
+        self._execute(REMOVE_SCRIPT, *sku_ids)
+
+    def select_all(self, selected):
+        """全选或者取消全选"""
+        self.modified = True
+        self._execute(SELECT_ALL_SCRIPT, 1 if selected else 0)
+
+    def migrate(self):
+        """把旧结构的购物车转换为新结构"""
+        self._execute(MIGRATE_SCRIPT)
+
+    def save(self, response):
+        """已登录用户的购物车不需要写 cookie"""
+        return response
+
+
+def load_cart_token(request):
+    """
+    读取并校验未登录用户的购物车令牌
+    :return: 令牌, 不存在或者签名错误时返回 None
+    """
+    value = request.COOKIES.get(CART_TOKEN_COOKIE)
+    if not value:
+        return None
+    try:
+        return signing.Signer(salt=CART_TOKEN_SALT).unsign(value)
+    except signing.BadSignature:
+        return None
+
+
+class AnonymousRedisCart(RedisCart):
+    """
+    未登录用户的 Redis 购物车, cookie 中只保存签名后的令牌
+    第一次修改购物车时写入令牌, 切换存储方式前的 cookie 购物车会合并进来
+    """
+
+    def __init__(self, request):
+        token = load_cart_token(request)
+        self.is_new = token is None
+        self.token = token or uuid.uuid4().hex
+        super(AnonymousRedisCart, self).__init__('anon_%s' % self.token, settings.CARTS_ANONYMOUS_EXPIRES)
+
+        self.cookie_cart = request.COOKIES.get(CART_COOKIE)
+        if self.cookie_cart:
+            self.merge(codec.loads(self.cookie_cart), 'cookie')
+
+    def get(self):
+        # 还没有令牌时购物车一定为空, 不需要访问 Redis
+        if self.is_new and not self.modified:
+            return {}
+        return super(AnonymousRedisCart, self).get()
+
+    def get_totals(self):
+        if self.is_new and not self.modified:
+            return compute_totals({}, {})
+        return super(AnonymousRedisCart, self).get_totals()
+
+    def save(self, response):
+        """修改过购物车时写入令牌, cookie 的有效期和购物车一致"""
+        if self.modified:
+            response.set_cookie(CART_TOKEN_COOKIE, signing.Signer(salt=CART_TOKEN_SALT).sign(self.token),
+                                max_age=self.expires, httponly=True)
+        if self.cookie_cart:
+            response.delete_cookie(CART_COOKIE)
+        return response
+
+
+class CookieCart(object):
+    """未登录用户的 cookie 购物车, 接口和 RedisCart 一致"""
+
+    def __init__(self, request):
+        self.cart_dict = codec.loads(request.COOKIES.get(CART_COOKIE))
+        self.modified = False
+
+    def get(self):
+        """
+        读取购物车
+        :return: {sku_id: {'count': count, 'selected': selected}}
+        """
+        return self.cart_dict
+
+    def get_selected(self):
+        """
+        读取勾选的商品
+        :return: {sku_id: count}
+        """
+        return {sku_id: item['count'] for sku_id, item in self.cart_dict.items() if item['selected']}
+
+    def get_totals(self):
+        """读取合计, cookie 购物车每次都重新计算"""
+        return compute_totals(self.cart_dict, get_prices(self.cart_dict.keys()))
+
+    def add(self, sku_id, count, selected=True, price=None):
+        """
+        添加商品, 数量累加
+        :return: 累加后的数量, 购物车已满时返回 -1
+        """
+        old = self.cart_dict.get(sku_id)
+        if old is None and len(self.cart_dict) >= settings.CARTS_MAX_ITEMS:
+            return -1
+
+        if old is not None:
+            count += old['count']
+            selected = selected or old['selected']
+        self.update(sku_id, count, selected)
+        return max(count, 0)
+
+    def update(self, sku_id, count, selected, price=None):
+        """修改商品的数量和勾选状态"""
+        self.modified = True
+        if count <= 0:
+            self.cart_dict.pop(sku_id, None)
+        else:
+            self.cart_dict[sku_id] = {
+                'count': count,
+                'selected': bool(selected)
+            }
+
+    def remove(self, *sku_ids):
+        """删除商品"""
+        for sku_id in sku_ids:
+            if self.cart_dict.pop(sku_id, None) is not None:
+                self.modified = True
+
+    def select_all(self, selected):
+        """全选或者取消全选"""
+        for item in self.cart_dict.values():
+            item['selected'] = bool(selected)
+            self.modified = True
+
+    def save(self, response):
+        """修改过购物车时重新写入 cookie"""
+        if self.modified:
+            response.set_cookie(CART_COOKIE, codec.dumps(self.cart_dict))
+        return response
+
+
+def get_cart(request):
+    """
+    获取当前请求的购物车
+    :return: 已登录返回 RedisCart, 未登录按照 CARTS_ANONYMOUS_STORAGE 返回 AnonymousRedisCart 或者 CookieCart
+    """
+    if request.user.is_authenticated:
+        return RedisCart(request.user.id)
+    if settings.CARTS_ANONYMOUS_STORAGE == 'redis':
+        return AnonymousRedisCart(request)
+    return CookieCart(request)
@@ -1,3 +1,132 @@
-from django.test import TestCase
+import base64
+import os
+import pickle
 
-# Create your tests here.
+from django.test import SimpleTestCase, override_settings
+
+from carts import codec
+
+# 被恶意 pickle 调用时记录参数, 用来确认反序列化时没有执行
+_called = []
+
+
+def _record(*args):
+    _called.append(args)
+    return {}
+
+
+class _Evil(object):
+    """反序列化时调用 _record 的对象"""
+
+    def __reduce__(self):
+        return _record, ('pwned',)
+
+
+class _System(object):
+    """反序列化时调用 os.system 的对象"""
+
+    def __reduce__(self):
+        return os.system, ('true',)
+
+
+def _legacy_cookie(obj, protocol=pickle.DEFAULT_PROTOCOL):
+    """旧版本写入 cookie 的方式: base64(pickle.dumps(dict))"""
+    return base64.b64encode(pickle.dumps(obj, protocol)).decode()
+
+
+class CartCodecTest(SimpleTestCase):
+    """cookie 购物车的编码和解码"""
+
+    def setUp(self):
+        _called.clear()
+
+    def test_round_trip(self):
+        cart_dict = {
+            1: {'count': 2, 'selected': True},
+            300: {'count': 1, 'selected': False},
+            2 ** 40: {'count': 70000, 'selected': True},
+        }
+        cookie = codec.dumps(cart_dict)
+        self.assertEqual(codec.loads(cookie), cart_dict)
+        # cookie 中不出现需要转义的字符
+        self.assertRegex(cookie, r'^[A-Za-z0-9_-]+$')
+
+    def test_round_trip_skips_non_positive_counts(self):
+        cookie = codec.dumps({1: {'count': 0, 'selected': True}, 2: {'count': 3, 'selected': False}})
+        self.assertEqual(codec.loads(cookie), {2: {'count': 3, 'selected': False}})
+
+    def test_empty_cart(self):
+        self.assertEqual(codec.loads(codec.dumps({})), {})
+        self.assertEqual(codec.loads(''), {})
+        self.assertEqual(codec.loads(None), {})
+
+    def test_tampered_payload_rejected(self):
+        data = bytearray(base64.urlsafe_b64decode(
+            codec.dumps({5: {'count': 1, 'selected': True}}) + '=='))
+        # 把数量从 1 改为 63
+        data[2] = 63 << 1 | 1
+        cookie = base64.urlsafe_b64encode(bytes(data)).rstrip(b'=').decode()
+        self.assertEqual(codec.loads(cookie), {})
+
+    def test_tampered_signature_rejected(self):
+        data = bytearray(base64.urlsafe_b64decode(
+            codec.dumps({5: {'count': 1, 'selected': True}}) + '=='))
+        data[-1] ^= 0x01
+        cookie = base64.urlsafe_b64encode(bytes(data)).rstrip(b'=').decode()
+        self.assertEqual(codec.loads(cookie), {})
+
+    def test_truncated_signature_rejected(self):
+        cookie = codec.dumps({5: {'count': 1, 'selected': True}})
+        self.assertEqual(codec.loads(cookie[:-4]), {})
+
+    def test_other_secret_key_rejected(self):
+        with override_settings(SECRET_KEY='another-secret-key'):
+            cookie = codec.dumps({5: {'count': 1, 'selected': True}})
+        self.assertEqual(codec.loads(cookie), {})
+
+    def test_garbage_rejected(self):
+        for cookie in ('not base64!', 'AAAA', 'gA', codec.dumps({})[:3]):
+            self.assertEqual(codec.loads(cookie), {})
+
+    def test_legacy_pickle_accepted(self):
+        cart_dict = {
+            1: {'count': 2, 'selected': True},
+            16: {'count': 1, 'selected': False},
+        }
+        for protocol in range(2, pickle.HIGHEST_PROTOCOL + 1):
+            self.assertEqual(codec.loads(_legacy_cookie(cart_dict, protocol)), cart_dict)
+
+    def test_legacy_pickle_standard_base64_accepted(self):
+        # 旧 cookie 使用标准 base64, 可能包含 + 和 /
+        cart_dict = {1: {'count': 248, 'selected': True}}
+        cookie = _legacy_cookie(cart_dict, 3)
+        self.assertIn('+', cookie)
+        self.assertEqual(codec.loads(cookie), cart_dict)
+
+    def test_legacy_pickle_keeps_valid_items(self):
+        cookie = _legacy_cookie({
+            1: {'count': 2, 'selected': True},
+            2: {'count': 'x', 'selected': True},
+            3: {'selected': True},
+            4: 'bad',
+        })
+        self.assertEqual(codec.loads(cookie), {1: {'count': 2, 'selected': True}})
+
+    def test_legacy_pickle_non_dict_rejected(self):
+        self.assertEqual(codec.loads(_legacy_cookie([1, 2, 3])), {})
+
+    def test_legacy_pickle_with_global_rejected(self):
+        cookie = _legacy_cookie({1: {'count': 1, 'selected': True, 'extra': _Evil()}})
+        self.assertEqual(codec.loads(cookie), {})
+        self.assertEqual(_called, [])
+
+    def test_legacy_pickle_with_builtin_global_rejected(self):
+        # 即使是 builtins 中的类型也不允许加载
+        for obj in ({1: {'count': 1, 'selected': True, 'extra': range(3)}}, _System()):
+            self.assertEqual(codec.loads(_legacy_cookie(obj)), {})
+
+    def test_loaded_cookie_is_rewritten_in_new_format(self):
+        cart_dict = {7: {'count': 3, 'selected': True}}
+        cookie = codec.dumps(codec.loads(_legacy_cookie(cart_dict)))
+        self.assertEqual(base64.urlsafe_b64decode(cookie + '==')[0], codec.CART_CODEC_VERSION)
+        self.assertEqual(codec.loads(cookie), cart_dict)
@@ -9,4 +9,6 @@ urlpatterns = [
     url(r'^carts/selection/$', views.CartsSelectAllView.as_view()),
     # 提供商品页面右上角购物车数据
     url(r'^carts/simple/$', views.CartsSimpleView.as_view()),
+    # 购物车合计
+    url(r'^carts/totals/$', views.CartsTotalsView.as_view()),
 ]
@@ -1,6 +1,9 @@
-import base64
-import pickle
-from django_redis import get_redis_connection
+import logging
+
+from carts import codec
+from carts.storage import CART_TOKEN_COOKIE, RedisCart, load_cart_token
+
+logger = logging.getLogger('django')
 
 
 def merge_cart_cookie_to_redis(request, user, response):
@@ -11,40 +14,44 @@ def merge_cart_cookie_to_redis(request, user, response):
 :param user: 登录用户信息，获取 user_id
 :return: response
 """
+    cart = RedisCart(user.id)
+
+    # 未登录时使用的 Redis 购物车, 直接在 Redis 中合并
+    token = load_cart_token(request)
+    if token:
+        dropped = cart.merge_cart(RedisCart('anon_%s' % token))
+        if dropped:
+            logger.info('用户 %s 的购物车已满, %d 件商品没有合并' % (user.id, dropped))
+        response.delete_cookie(CART_TOKEN_COOKIE)
+
     # 获取cookie中的购物车数据
     cookie_cart = request.COOKIES.get('carts')
 
     # cookie中没有数据就响应结果
     if not cookie_cart:
         return response
-    cart_dict = pickle.loads(base64.b64decode(cookie_cart))
-
-    new_dict = {}
-    new_add = []
-    new_remove = []
-
-    # 同步cookie中购物车数据
-    for sku_id, item in cart_dict.items():
-        new_dict[sku_id] = item['count']
+    cart_dict = codec.loads(cookie_cart)
 
-        if item['selected']:
-            new_add.append(sku_id)
-        else:
-            new_remove.append(sku_id)
-
-    # 将new_cart_dict 写入到redis数据库
-    redis_conn = get_redis_connection('carts')
-    pl = redis_conn.pipeline()
-    pl.hmset('carts_%s' % user.id, new_dict)
-
-    # 将勾选状态同步到redis数据库
-    if new_add:
-        pl.sadd('selected_%s' % user.id, *new_add)
-    if new_remove:
-        pl.srem('selected_%s' % user.id, *new_remove)
-    pl.execute()
+    # 按照 CARTS_MERGE_POLICY 将cookie中的购物车数据合并到redis购物车中, 超出 CARTS_MAX_ITEMS 的商品不再合并
+    dropped = cart.merge(cart_dict)
+    if dropped:
+        logger.info('用户 %s 的购物车已满, %d 件商品没有合并' % (user.id, dropped))
 
     # 清除cookie
     response.delete_cookie('carts')
 
     return response
+
+
+def get_cart_totals(cart):
+    """
+    读取购物车合计, 转为 JSON 数据
+    :param cart: get_cart() 返回的购物车
+    :return: {'count': 商品总数量, 'selected_count': 勾选的数量, 'selected_amount': 勾选的金额}
+    """
+    totals = cart.get_totals()
+    return {
+        'count': totals['count'],
+        'selected_count': totals['selected_count'],
+        'selected_amount': str(totals['selected_amount'])
+    }
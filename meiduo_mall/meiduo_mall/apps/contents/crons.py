@@ -0,0 +1,78 @@
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+from django.template import loader
+
+from contents.models import ContentCategory, Content
+from goods.utils import get_categories
+from meiduo_mall.utils.static_html import get_static_html_path, write_static_html
+
+logger = logging.getLogger('django')
+
+# 首页重新生成任务是否已经在排队的标记
+INDEX_HTML_PENDING_KEY = 'index_html_pending'
+
+
+def get_index_contents():
+    """
+    获取首页的广告数据, 不管有多少个广告类别, 只需要两次查询
+    :return: {类别键名: [广告内容, ...]}
+    """
+    # 定义一个字典, 所有的广告类别都有对应的列表
+    contents = {}
+    key_map = {}
+    for cat in ContentCategory.objects.all():
+        contents[cat.key] = []
+        key_map[cat.id] = cat.key
+
+    # 一次查询出所有展示的广告, 按照类别分组, 类别内按照 sequence 排序
+    for content in Content.objects.filter(status=True).order_by('category_id', 'sequence'):
+        contents[key_map[content.category_id]].append(content)
+
+    return contents
+
+
+def get_index_context():
+    """
+    获取首页的模板数据, 动态渲染和页面静态化共用
+    :return: 模板数据
+    """
+    return {
+        # 这是首页需要的一二级分类信息
+        'categories': get_categories(),
+        # 这是首页需要的能展示的三级信息
+        'contents': get_index_contents()
+    }
+
+
+def get_static_index_html_path():
+    """获取首页静态文件的路径"""
+    return get_static_html_path('index.html')
+
+
+def generate_static_index_html():
+    """
+    生成首页静态文件
+    先渲染到临时文件, 再原子地替换旧的 index.html
+    """
+    html = loader.get_template('index.html').render(get_index_context())
+    write_static_html(get_static_index_html_path(), html)
+
+
+def schedule_static_index_html():
+    """
+    安排重新生成首页静态文件
+    防抖: 排队中的任务还没执行时不再重复发送, 后台批量修改只会生成一次
+    """
+    from celery_tasks.html.tasks import generate_static_index_html as generate_task
+
+    # 标记的有效期比延迟时间长, 避免任务丢失后一直不能再次发送
+    if not cache.add(INDEX_HTML_PENDING_KEY, 1, settings.INDEX_HTML_DEBOUNCE * 10):
+        return
+
+    try:
+        generate_task.apply_async(countdown=settings.INDEX_HTML_DEBOUNCE)
+    except Exception as e:
+        logger.error(e)
+        cache.delete(INDEX_HTML_PENDING_KEY)
@@ -0,0 +1,16 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from contents.crons import schedule_static_index_html
+from contents.models import ContentCategory, Content
+from goods.models import GoodsCategory, GoodsChannel
+
+
+@receiver([post_save, post_delete], sender=Content)
+@receiver([post_save, post_delete], sender=ContentCategory)
+@receiver([post_save, post_delete], sender=GoodsChannel)
+@receiver([post_save, post_delete], sender=GoodsCategory)
+def refresh_index_html(sender, **kwargs):
+    """广告或商品分类菜单变化时, 重新生成首页静态文件"""
+    transaction.on_commit(schedule_static_index_html)
@@ -1,8 +1,10 @@
+from django import http
+from django.conf import settings
 from django.shortcuts import render
 from django.views import View
 
-from contents.models import ContentCategory
-from goods.utils import get_categories
+from contents.crons import get_index_context, get_static_index_html_path, schedule_static_index_html
+from meiduo_mall.utils.static_html import open_static_html
 
 
 class IndexView(View):
@@ -11,25 +13,15 @@ class IndexView(View):
     def get(self, request):
         """提供首页广告界面"""
 
-        # 查询首页广告界面
-        categories = get_categories()
-
-        # 定义一个空的字典
-        dict = {}
-        # 查询出所有的广告类别
-        content_categories = ContentCategory.objects.all()
-        # 遍历所有的广告类别，然后放入到定义的空字典中
-        for cat in content_categories:
-            # 获取类别对应的展示数据， 并对数据进行排序
-            dict[cat.key] = cat.content_set.filter(status=True).order_by('sequence')
-        # 拼接参数
-        context = {
-            # 这是首页需要的一二级分类信息
-            'categories': categories,
-            # 这是首页需要的能展示的三级信息
-            'contents': dict
-        }
-
-        return render(request, 'index.html', context=context)
+        # 优先返回已经静态化的首页
+        html_path = get_static_index_html_path()
+        html_file = open_static_html(html_path, settings.INDEX_HTML_EXPIRES)
+        if html_file is not None:
+            return http.FileResponse(html_file, content_type='text/html; charset=utf-8')
+
+        # 静态文件不存在或者已过期, 安排重新生成, 本次请求动态渲染
+        schedule_static_index_html()
+
+        return render(request, 'index.html', context=get_index_context())
 
 # Create your views here.
@@ -0,0 +1,42 @@
+# 商品分类菜单缓存版本号的键名, 分类或频道变化时版本号自增
+CATEGORIES_VERSION_KEY = 'goods_categories_version'
+
+# 商品分类菜单缓存的有效期, 单位: 秒 (旧版本的菜单到期后自动淘汰)
+CATEGORIES_CACHE_EXPIRES = 3600 * 24
+
+# 进程内分类菜单缓存最多保存的版本数
+CATEGORIES_LRU_SIZE = 4
+
+# 商品规格矩阵缓存的有效期, 单位: 秒
+SPEC_MATRIX_CACHE_EXPIRES = 3600 * 24
+
+# SKU 摘要在 Redis 中的有效期, 单位: 秒
+SKU_SUMMARY_CACHE_EXPIRES = 3600
+
+# 不存在的 SKU 在 Redis 中的缓存时间, 单位: 秒
+SKU_SUMMARY_MISSING_EXPIRES = 60
+
+# 进程内 SKU 摘要缓存的条目数和有效期(秒), 有效期即其他进程读到旧数据的最长时间
+SKU_SUMMARY_LRU_SIZE = 10000
+SKU_SUMMARY_LRU_EXPIRES = 30
+
+# 商品列表页每页的商品数量
+GOODS_LIST_LIMIT = 5
+
+# 分类上架商品数量缓存的有效期, 单位: 秒
+CATEGORY_SKU_COUNT_EXPIRES = 600
+
+# 已经生成商品排行的分类集合的键名, 只有集合中的分类才从排行中读取和增量更新
+RANKING_CATEGORIES_KEY = 'rank_categories'
+
+# 重新生成商品排行时每批写入的 SKU 数量
+RANKING_REBUILD_BATCH = 1000
+
+# 待写入数据库的分类访问量哈希的键名: {'日期_分类id': 访问量}
+GOODS_VISIT_PENDING_KEY = 'goods_visit_pending'
+
+# 写入访问量的锁, 同一时间只有一个 flush 写入数据库, 避免重复插入同一个 (日期, 分类) 的记录
+GOODS_VISIT_FLUSH_LOCK_KEY = 'goods_visit_flush_lock'
+
+# 写入访问量的锁的有效期, 单位: 秒, 持有锁的任务异常退出时到期释放
+GOODS_VISIT_FLUSH_LOCK_EXPIRES = 300
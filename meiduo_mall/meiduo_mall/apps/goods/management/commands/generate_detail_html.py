@@ -0,0 +1,50 @@
+import multiprocessing
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from goods.models import SKU
+from goods.utils import generate_static_sku_detail_html
+
+
+def _generate(sku_id):
+    """子进程中生成单个详情页, 出错时返回错误信息而不是中断整个进程池"""
+    try:
+        generate_static_sku_detail_html(sku_id)
+    except Exception as e:
+        return sku_id, str(e)
+    return sku_id, None
+
+
+class Command(BaseCommand):
+    help = '生成商品详情页的静态文件: detail/<sku_id>.html'
+
+    def add_arguments(self, parser):
+        parser.add_argument('sku_ids', nargs='*', type=int,
+                            help='只生成指定 sku 的详情页, 不传则全量生成')
+        parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count(),
+                            help='并行生成的进程数')
+
+    def handle(self, *args, **options):
+        sku_ids = options['sku_ids'] or list(SKU.objects.order_by('id').values_list('id', flat=True))
+        workers = max(1, min(options['workers'], len(sku_ids)))
+
+        if workers == 1:
+            results = map(_generate, sku_ids)
+        else:
+            # fork 之前关闭数据库连接, 避免子进程共用同一个连接
+            connections.close_all()
+            pool = multiprocessing.Pool(workers)
+            results = pool.imap_unordered(_generate, sku_ids, chunksize=16)
+
+        errors = 0
+        for sku_id, error in results:
+            if error:
+                errors += 1
+                self.stderr.write('sku %s 生成失败: %s' % (sku_id, error))
+
+        if workers > 1:
+            pool.close()
+            pool.join()
+
+        self.stdout.write('共生成 %d 个详情页, 失败 %d 个' % (len(sku_ids) - errors, errors))
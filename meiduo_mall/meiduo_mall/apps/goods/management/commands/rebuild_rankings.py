@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from goods import rankings
+
+
+class Command(BaseCommand):
+    help = '从数据库重新生成分类商品排行(默认/价格/销量)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('category_ids', nargs='*', type=int,
+                            help='只生成指定分类的排行, 不传则生成所有分类')
+
+    def handle(self, *args, **options):
+        total = rankings.rebuild(options['category_ids'] or None)
+        self.stdout.write('共写入 %d 个商品的排行' % total)
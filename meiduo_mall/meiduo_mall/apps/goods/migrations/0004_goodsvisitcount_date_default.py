@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.11 on 2026-10-18 13:48
+from __future__ import unicode_literals
+
+import datetime
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('goods', '0003_sku_list_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='goodsvisitcount',
+            name='date',
+            field=models.DateField(default=datetime.date.today, verbose_name='统计日期'),
+        ),
+    ]
@@ -1,3 +1,5 @@
+import datetime
+
 from django.db import models
 
 from meiduo_mall.utils.models import BaseModel
@@ -165,6 +167,12 @@ class SKU(BaseModel):
         db_table = 'tb_sku'
         verbose_name = '商品SKU'
         verbose_name_plural = verbose_name
+        # 商品列表页三种排序方式使用的索引, 按照游标翻页时直接从索引中定位
+        indexes = [
+            models.Index(fields=['category', 'is_launched', 'create_time', 'id'], name='tb_sku_list_default_idx'),
+            models.Index(fields=['category', 'is_launched', 'price', 'id'], name='tb_sku_list_price_idx'),
+            models.Index(fields=['category', 'is_launched', 'sales', 'id'], name='tb_sku_list_hot_idx'),
+        ]
 
     def __str__(self):
         return '%s: %s' % (self.id, self.name)
@@ -214,7 +222,8 @@ class GoodsVisitCount(BaseModel):
                                  on_delete=models.CASCADE,
                                  verbose_name='商品分类')
     count = models.IntegerField(verbose_name='访问量', default=0)
-    date = models.DateField(auto_now_add=True, verbose_name='统计日期')
+    # 默认为今天, 批量写入访问量时可以指定其他日期
+    date = models.DateField(default=datetime.date.today, verbose_name='统计日期')
 
     class Meta:
         db_table = 'tb_goods_visit'
@@ -0,0 +1,194 @@
+"""
+商品排行: 每个分类的上架商品按照 默认(上架时间)/价格/销量 保存在三个有序集合中,
+商品列表页和热销排行直接按照排名读取 sku_id, 再通过 SKU 摘要服务批量获取商品信息, 不需要在数据库中排序
+
+有序集合 rank_<sort>_<category_id> = {sku_id: 分数}
+分数: 上架时间为微秒数, 价格以分为单位, 销量为整数, 都可以用浮点数精确表示
+成员为补零到固定长度的 sku_id, 分数相同时按照 sku_id 排序, 和数据库的排序一致
+
+只有生成过排行的分类(RANKING_CATEGORIES_KEY 集合中)才会被增量更新和读取, 其他分类仍然查询数据库;
+SKU 保存、删除时更新价格和上架状态, 下单时增加销量, rebuild_rankings 命令从数据库重新生成
+"""
+from django.db import transaction
+from django_redis import get_redis_connection
+
+from goods import constants
+from goods.models import GoodsCategory, SKU
+from meiduo_mall.utils.redis_script import RedisScript
+from meiduo_mall.utils.timestamps import to_microseconds
+
+# 排行的排序方式, 和商品列表页一致: {sort: 是否倒序}
+RANKING_SORTS = {
+    'default': False,
+    'price': False,
+    'hot': True,
+}
+
+# 更新一个 SKU 的排行: 上架时写入上架时间和价格, 销量只在第一次写入, 之后由下单增量更新; 下架时删除
+# KEYS[1]: 已生成排行的分类集合 KEYS[2-4]: 默认/价格/销量有序集合
+# ARGV[1]: 分类id ARGV[2]: 成员 ARGV[3]: 是否上架(1/0) ARGV[4]: 上架时间分数 ARGV[5]: 价格分数 ARGV[6]: 销量
+UPDATE_SCRIPT = RedisScript("""
+if redis.call('SISMEMBER', KEYS[1], ARGV[1]) == 0 then
+    return 0
+end
+if ARGV[3] == '1' then
+    redis.call('ZADD', KEYS[2], ARGV[4], ARGV[2])
+    redis.call('ZADD', KEYS[3], ARGV[5], ARGV[2])
+    if not redis.call('ZSCORE', KEYS[4], ARGV[2]) then
+        redis.call('ZADD', KEYS[4], ARGV[6], ARGV[2])
+    end
+else
+    redis.call('ZREM', KEYS[2], ARGV[2])
+    redis.call('ZREM', KEYS[3], ARGV[2])
+    redis.call('ZREM', KEYS[4], ARGV[2])
+end
+return 1
+""")
+
+# 增加销量, 只更新已经在排行中的 SKU
+# KEYS[1]: 已生成排行的分类集合 KEYS[2...]: 每个 SKU 所在分类的销量有序集合
+# ARGV: 分类id1, 成员1, 数量1, 分类id2, 成员2, 数量2 ...
+ADD_SALES_SCRIPT = RedisScript("""
+for i = 2, #KEYS do
+    local j = (i - 2) * 3 + 1
+    if redis.call('SISMEMBER', KEYS[1], ARGV[j]) == 1 and redis.call('ZSCORE', KEYS[i], ARGV[j + 1]) then
+        redis.call('ZINCRBY', KEYS[i], ARGV[j + 2], ARGV[j + 1])
+    end
+end
+return 0
+""")
+
+
+def _get_redis_conn():
+    """商品排行使用的 Redis 连接"""
+    return get_redis_connection('rankings')
+
+
+def _ranking_key(sort, category_id):
+    """有序集合的键名"""
+    return 'rank_%s_%s' % (sort, category_id)
+
+
+def _member(sku_id):
+    """sku_id 补零, 分数相同时按照 sku_id 排序"""
+    return '%010d' % sku_id
+
+
+def _scores(create_time, price, sales):
+    """
+    计算 SKU 在三个排行中的分数
+    :return: (上架时间分数, 价格分数, 销量分数)
+    """
+    return to_microseconds(create_time), int(price * 100), sales
+
+
+def _update(sku, launched, category_id=None):
+    """更新一个 SKU 在分类排行中的数据, 默认为 SKU 当前的分类"""
+    category_id = category_id or sku.category_id
+    redis_conn = _get_redis_conn()
+    keys = [constants.RANKING_CATEGORIES_KEY] + [_ranking_key(sort, category_id) for sort in RANKING_SORTS]
+    UPDATE_SCRIPT(redis_conn, keys=keys, args=[category_id, _member(sku.id), 1 if launched else 0] +
+                  list(_scores(sku.create_time, sku.price, sku.sales)))
+
+
+def update_sku(sku, old_category_id=None):
+    """
+    SKU 保存后更新排行: 上架的 SKU 写入价格和上架时间, 下架的 SKU 从排行中删除
+    :param sku: SKU
+    :param old_category_id: 保存前的分类id, 分类变化时先从原分类的排行中删除
+    """
+    if old_category_id and old_category_id != sku.category_id:
+        _update(sku, False, old_category_id)
+    _update(sku, sku.is_launched)
+
+
+def remove_sku(sku):
+    """SKU 删除后从排行中删除"""
+    _update(sku, False)
+
+
+def add_sales(skus, counts):
+    """
+    下单后增加销量排行的分数, 一次执行
+    :param skus: SKU 列表, 需要 id 和 category_id
+    :param counts: {sku_id: 数量}
+    """
+    keys = [constants.RANKING_CATEGORIES_KEY]
+    args = []
+    for sku in skus:
+        keys.append(_ranking_key('hot', sku.category_id))
+        args.extend([sku.category_id, _member(sku.id), counts[sku.id]])
+    if not args:
+        return
+
+    redis_conn = _get_redis_conn()
+    ADD_SALES_SCRIPT(redis_conn, keys=keys, args=args)
+
+
+def add_sales_on_commit(skus, counts):
+    """事务提交后再增加销量排行, 事务回滚时不修改排行"""
+    skus = list(skus)
+    counts = dict(counts)
+    transaction.on_commit(lambda: add_sales(skus, counts))
+
+
+def get_page(category_id, sort, start, limit):
+    """
+    按照排名读取一页 sku_id, 一次往返同时读取商品数量
+    :param category_id: 分类id
+    :param sort: 排序方式 default/price/hot
+    :param start: 起始位置
+    :param limit: 数量
+    :return: (商品数量, sku_id 列表), 分类没有生成排行时返回 None
+    """
+    descending = RANKING_SORTS[sort]
+    key = _ranking_key(sort, category_id)
+
+    redis_conn = _get_redis_conn()
+    pl = redis_conn.pipeline(transaction=False)
+    pl.sismember(constants.RANKING_CATEGORIES_KEY, category_id)
+    pl.zcard(key)
+    if descending:
+        pl.zrevrange(key, start, start + limit - 1)
+    else:
+        pl.zrange(key, start, start + limit - 1)
+    built, count, members = pl.execute()
+
+    # 排行为空时也查询数据库, 避免排行数据丢失后列表页一直为空
+    if not built or not count:
+        return None
+    return count, [int(member) for member in members]
+
+
+def rebuild(category_ids=None):
+    """
+    从数据库重新生成排行, 每个分类在一个事务中替换, 读取时不会看到生成一半的排行
+    :param category_ids: 分类id列表, 不传时生成所有分类
+    :return: 写入排行的 SKU 数量
+    """
+    if category_ids is None:
+        category_ids = list(GoodsCategory.objects.values_list('id', flat=True))
+
+    skus = SKU.objects.filter(category_id__in=category_ids, is_launched=True).order_by('id').values_list(
+        'id', 'category_id', 'create_time', 'price', 'sales')
+    rankings = {category_id: {sort: {} for sort in RANKING_SORTS} for category_id in category_ids}
+    for sku_id, category_id, create_time, price, sales in skus:
+        member = _member(sku_id)
+        for sort, score in zip(RANKING_SORTS, _scores(create_time, price, sales)):
+            rankings[category_id][sort][member] = score
+
+    redis_conn = _get_redis_conn()
+    total = 0
+    for category_id, sorts in rankings.items():
+        pl = redis_conn.pipeline()
+        for sort, scores in sorts.items():
+            key = _ranking_key(sort, category_id)
+            pl.delete(key)
+            members = list(scores)
+            for i in range(0, len(members), constants.RANKING_REBUILD_BATCH):
+                pl.zadd(key, {member: scores[member] for member in members[i:i + constants.RANKING_REBUILD_BATCH]})
+        pl.sadd(constants.RANKING_CATEGORIES_KEY, category_id)
+        pl.execute()
+        total += len(sorts['default'])
+
+    return total
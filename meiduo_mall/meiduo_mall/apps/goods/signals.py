@@ -0,0 +1,84 @@
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+
+from goods.models import GoodsCategory, GoodsChannel, GoodsSpecification, SKU, SKUSpecification, \
+    SpecificationOption, Goods
+from goods import rankings, sku_summary
+from goods.utils import bump_categories_version, delete_spec_matrix, refresh_static_sku_detail_html, \
+    delete_category_sku_count
+
+
+@receiver([post_save, post_delete], sender=GoodsCategory)
+@receiver([post_save, post_delete], sender=GoodsChannel)
+def invalidate_categories(sender, **kwargs):
+    """分类或频道变化时, 让商品分类菜单缓存失效"""
+    bump_categories_version()
+
+
+@receiver([post_save, post_delete], sender=SKU)
+@receiver([post_save, post_delete], sender=GoodsSpecification)
+def invalidate_spec_matrix(sender, instance, **kwargs):
+    """SKU 或商品规格变化时, 删除对应商品的规格矩阵缓存"""
+    delete_spec_matrix(instance.goods_id)
+
+
+@receiver([post_save, post_delete], sender=SKUSpecification)
+def invalidate_sku_spec_matrix(sender, instance, **kwargs):
+    """SKU 规格变化时, 删除对应商品的规格矩阵缓存"""
+    for goods_id in SKU.objects.filter(id=instance.sku_id).values_list('goods_id', flat=True):
+        delete_spec_matrix(goods_id)
+
+
+@receiver([post_save, post_delete], sender=SpecificationOption)
+def invalidate_option_spec_matrix(sender, instance, **kwargs):
+    """规格选项变化时, 删除对应商品的规格矩阵缓存"""
+    for goods_id in GoodsSpecification.objects.filter(id=instance.spec_id).values_list('goods_id', flat=True):
+        delete_spec_matrix(goods_id)
+
+
+@receiver([post_save, post_delete], sender=SKU)
+def refresh_sku_detail_html(sender, instance, **kwargs):
+    """SKU 变化时, 重新生成该 SKU 的详情页静态文件"""
+    refresh_static_sku_detail_html([instance.id])
+
+
+@receiver(post_save, sender=Goods)
+def refresh_goods_detail_html(sender, instance, **kwargs):
+    """商品变化时, 重新生成该商品下所有 SKU 的详情页静态文件"""
+    refresh_static_sku_detail_html(list(instance.sku_set.values_list('id', flat=True)))
+
+
+@receiver([post_save, post_delete], sender=SKU)
+def invalidate_sku_summary(sender, instance, **kwargs):
+    """SKU 变化时, 删除 SKU 摘要缓存"""
+    sku_summary.invalidate(instance.id)
+
+
+@receiver(pre_save, sender=SKU)
+def remember_sku_category(sender, instance, update_fields=None, **kwargs):
+    """SKU 保存前记录原来的分类, 分类变化时保存后的信号处理函数同时处理原分类"""
+    instance._old_category_id = None
+    if instance.pk is None or (update_fields is not None and not {'category', 'category_id'} & set(update_fields)):
+        return
+    instance._old_category_id = SKU.objects.filter(id=instance.pk).values_list('category_id', flat=True).first()
+
+
+@receiver([post_save, post_delete], sender=SKU)
+def invalidate_category_sku_count(sender, instance, **kwargs):
+    """SKU 上架、下架、删除或者修改分类时, 删除分类上架商品数量的缓存"""
+    delete_category_sku_count(instance.category_id)
+    old_category_id = getattr(instance, '_old_category_id', None)
+    if old_category_id and old_category_id != instance.category_id:
+        delete_category_sku_count(old_category_id)
+
+
+@receiver(post_save, sender=SKU)
+def update_sku_rankings(sender, instance, **kwargs):
+    """SKU 保存后更新商品排行中的价格和上架状态, 修改分类时从原分类的排行中删除"""
+    rankings.update_sku(instance, getattr(instance, '_old_category_id', None))
+
+
+@receiver(post_delete, sender=SKU)
+def remove_sku_rankings(sender, instance, **kwargs):
+    """SKU 删除后从商品排行中删除"""
+    rankings.remove_sku(instance)
@@ -0,0 +1,148 @@
+"""
+SKU 摘要服务: 购物车、浏览记录、热销排行、订单结算等商品卡片共用的 SKU 信息
+(id, name, price, default_image_url)
+
+读取顺序: 进程内 LRU -> Redis 哈希(一次管道往返) -> 数据库(一次 id__in 查询)
+不存在的 SKU 也会缓存一段时间, 避免无效的 id 反复穿透到数据库
+"""
+from decimal import Decimal
+
+from django_redis import get_redis_connection
+
+from goods import constants
+from goods.models import SKU
+from meiduo_mall.utils.cache import LRUCache
+
+# 进程内缓存: {sku_id: 摘要字典}, 值为 None 表示该 SKU 不存在
+_local_cache = LRUCache(maxsize=constants.SKU_SUMMARY_LRU_SIZE, timeout=constants.SKU_SUMMARY_LRU_EXPIRES)
+
+# 进程内缓存未命中时的占位对象
+_MISSING = object()
+
+
+def _summary_key(sku_id):
+    """SKU 摘要在 Redis 中的键名"""
+    return 'sku_summary_%s' % sku_id
+
+
+def _to_summary(sku):
+    """把 SKU 模型对象转为摘要字典"""
+    return {
+        'id': sku.id,
+        'name': sku.name,
+        'default_image_url': sku.default_image_url,
+        'price': sku.price
+    }
+
+
+def _decode(data):
+    """把 Redis 哈希中的数据转为摘要字典"""
+    return {
+        'id': int(data[b'id']),
+        'name': data[b'name'].decode(),
+        'default_image_url': data[b'default_image_url'].decode(),
+        'price': Decimal(data[b'price'].decode())
+    }
+
+
+def _load_from_db(sku_ids, redis_conn):
+    """
+    从数据库中查询摘要并回写 Redis, 不存在的 SKU 写入空标记
+    :return: {sku_id: 摘要字典}
+    """
+    summaries = {}
+    skus = SKU.objects.filter(id__in=sku_ids).only('id', 'name', 'price', 'default_image_url')
+    for sku in skus:
+        summaries[sku.id] = _to_summary(sku)
+
+    pl = redis_conn.pipeline(transaction=False)
+    for sku_id in sku_ids:
+        key = _summary_key(sku_id)
+        summary = summaries.get(sku_id)
+        if summary is None:
+            pl.hset(key, 'missing', 1)
+            pl.expire(key, constants.SKU_SUMMARY_MISSING_EXPIRES)
+        else:
+            pl.hset(key, mapping={
+                'id': summary['id'],
+                'name': summary['name'],
+                'default_image_url': summary['default_image_url'] or '',
+                'price': str(summary['price'])
+            })
+            pl.expire(key, constants.SKU_SUMMARY_CACHE_EXPIRES)
+    pl.execute()
+
+    return summaries
+
+
+def get_many(sku_ids):
+    """
+    批量获取 SKU 摘要
+    :param sku_ids: sku id 列表
+    :return: 摘要字典列表, 顺序和 sku_ids 一致, 不存在的 SKU 被忽略
+    """
+    sku_ids = [int(sku_id) for sku_id in sku_ids]
+    summaries = {}
+
+    # 1. 进程内缓存
+    remote_ids = []
+    for sku_id in set(sku_ids):
+        summary = _local_cache.get(sku_id, _MISSING)
+        if summary is _MISSING:
+            remote_ids.append(sku_id)
+        elif summary is not None:
+            summaries[sku_id] = summary
+
+    if remote_ids:
+        # 2. Redis: 使用管道一次往返读取所有的哈希
+        redis_conn = get_redis_connection('default')
+        pl = redis_conn.pipeline(transaction=False)
+        for sku_id in remote_ids:
+            pl.hgetall(_summary_key(sku_id))
+
+        db_ids = []
+        for sku_id, data in zip(remote_ids, pl.execute()):
+            if not data:
+                db_ids.append(sku_id)
+            elif b'missing' in data:
+                _local_cache.set(sku_id, None)
+            else:
+                summaries[sku_id] = _decode(data)
+                _local_cache.set(sku_id, summaries[sku_id])
+
+        # 3. 数据库: 一次 id__in 查询补齐
+        if db_ids:
+            db_summaries = _load_from_db(db_ids, redis_conn)
+            for sku_id in db_ids:
+                summary = db_summaries.get(sku_id)
+                _local_cache.set(sku_id, summary)
+                if summary is not None:
+                    summaries[sku_id] = summary
+
+    # 按照传入的顺序返回
+    return [summaries[sku_id] for sku_id in sku_ids if sku_id in summaries]
+
+
+def get(sku_id):
+    """
+    获取单个 SKU 的摘要
+    :param sku_id: sku id
+    :return: 摘要字典, SKU 不存在时返回 None
+    """
+    try:
+        sku_id = int(sku_id)
+    except (TypeError, ValueError):
+        return None
+
+    summaries = get_many([sku_id])
+    return summaries[0] if summaries else None
+
+
+def invalidate(sku_id):
+    """
+    SKU 变化时删除摘要缓存
+    其他进程的进程内缓存在 SKU_SUMMARY_LRU_EXPIRES 秒内过期
+    :param sku_id: sku id
+    """
+    _local_cache.delete(sku_id)
+    get_redis_connection('default').delete(_summary_key(sku_id))
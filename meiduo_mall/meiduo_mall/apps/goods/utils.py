@@ -1,21 +1,74 @@
-from collections import OrderedDict
+import logging
+import time
+from collections import OrderedDict, namedtuple
+from decimal import Decimal, InvalidOperation
 
-from django.shortcuts import render
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+from django.template import loader
 
-from goods.models import GoodsChannel, SKU
+from goods import constants, rankings, sku_summary
+from goods.models import GoodsCategory, GoodsChannel, GoodsSpecification, SKU, SKUSpecification, \
+    SpecificationOption
+from meiduo_mall.utils.cache import LRUCache
+from meiduo_mall.utils.static_html import get_static_html_path, write_static_html, delete_static_html
+from meiduo_mall.utils.timestamps import to_microseconds, from_microseconds
 
+logger = logging.getLogger('django')
 
-def get_categories():
+# 进程内的分类菜单缓存: {版本号: 菜单字典}
+_categories_lru = LRUCache(maxsize=constants.CATEGORIES_LRU_SIZE)
+
+# 进程内的分类索引: {版本号: {分类id: CategoryNode}}, 分类和频道变化时版本号自增, 自动重新构建
+_category_index_lru = LRUCache(maxsize=constants.CATEGORIES_LRU_SIZE)
+
+# 分类索引中的分类: level 为级别(1-3), cat1_id/cat2_id/cat3_id 为从一级分类到当前分类的各级分类id,
+# 低于当前级别的为 None; url 为分类的频道链接, 只有一级分类有
+CategoryNode = namedtuple('CategoryNode', ['id', 'name', 'url', 'level', 'cat1_id', 'cat2_id', 'cat3_id'])
+
+
+def get_categories_version():
     """
-    获取商城商品分类菜单
-    :return: 菜单字典
+    获取商品分类菜单缓存的版本号
+    :return: 版本号
     """
+    version = cache.get(constants.CATEGORIES_VERSION_KEY)
+    if version is None:
+        # 版本号丢失时使用当前时间戳, 避免和旧版本的缓存重复
+        cache.add(constants.CATEGORIES_VERSION_KEY, int(time.time() * 1000), None)
+        version = cache.get(constants.CATEGORIES_VERSION_KEY)
+    return version
 
-    # 第一部分: 从数据库中取数据:
+
+def bump_categories_version():
+    """
+    分类或频道发生变化时, 让商品分类菜单缓存的版本号自增
+    旧版本的缓存不再被读取, 到期后自动淘汰
+    """
+    try:
+        cache.incr(constants.CATEGORIES_VERSION_KEY)
+    except ValueError:
+        # 版本号不存在, 重新生成
+        cache.set(constants.CATEGORIES_VERSION_KEY, int(time.time() * 1000), None)
+
+
+def build_categories():
+    """
+    从数据库中构建商品分类菜单, 只需要两次查询
+    :return: 菜单字典
+    """
     # 定义一个有序字典对象
     categories = OrderedDict()
+
+    # 查询出所有的二级和三级分类, 按照上级分类分组
+    sub_cats_map = {}
+    sub_categories = GoodsCategory.objects.filter(parent__isnull=False).order_by('id')
+    for cat in sub_categories.values('id', 'name', 'parent_id'):
+        sub_cats_map.setdefault(cat['parent_id'], []).append(cat)
+
     # 对GoodsChannel 进行 group_id 和 sequence 排序，获取排序后的结果
-    channels = GoodsChannel.objects.order_by('group_id', 'sequence')
+    channels = GoodsChannel.objects.select_related('category').order_by('group_id', 'sequence')
     # 遍历排序后的结果： 得到所有的一级菜单（即，频道）
     for channel in channels:
         # 从频道中得到当前的组id
@@ -37,26 +90,108 @@ def get_categories():
             'url': channel.url
         })
 
-        # 根据cta1 的外键反向， 获取下一级（二级菜单）所有的分类数据，并遍历
-        for cat2 in cat1.goodscategory_set.all():
-            # 创建一个新列表
-            cat2.sub_cats = []
-            # 根据 cat2 的外键反向，获取下一级的所有分类数据，并遍历
-            for cat3 in cat2.goodscategory_set.all():
-                # 拼接新的列表
-                cat2.sub_cats.append(cat3)
-            # 所有内容都增加到 以及菜单生成的有序字典中去
-            categories[group_id]['sub_cats'].append(cat2)
+        # 一级分类下的二级分类, 以及二级分类下的三级分类
+        for cat2 in sub_cats_map.get(cat1.id, []):
+            categories[group_id]['sub_cats'].append({
+                'id': cat2['id'],
+                'name': cat2['name'],
+                'sub_cats': [{'id': cat3['id'], 'name': cat3['name']}
+                             for cat3 in sub_cats_map.get(cat2['id'], [])]
+            })
 
     return categories
 
 
-def get_breadcrumb(category):
+def get_categories():
     """
-    获取面包屑
-    :param category: 商品类别
-    :return:
+    获取商城商品分类菜单
+    先查进程内缓存, 再查 Redis 缓存, 都没有时才查询数据库
+    :return: 菜单字典
     """
+    version = get_categories_version()
+
+    # 第一层: 进程内缓存
+    categories = _categories_lru.get(version)
+    if categories is not None:
+        return categories
+
+    # 第二层: Redis 缓存
+    cache_key = 'goods_categories_%s' % version
+    categories = cache.get(cache_key)
+    if categories is None:
+        # 缓存中没有, 从数据库中构建
+        categories = build_categories()
+        cache.set(cache_key, categories, constants.CATEGORIES_CACHE_EXPIRES)
+
+    _categories_lru.set(version, categories)
+    return categories
+
+
+def build_category_index():
+    """
+    从数据库中构建分类索引, 只需要两次查询
+    :return: {分类id: CategoryNode}
+    """
+    categories = {cat['id']: cat for cat in GoodsCategory.objects.values('id', 'name', 'parent_id')}
+    channel_urls = dict(GoodsChannel.objects.values_list('category_id', 'url'))
+
+    def ancestors(category_id):
+        # 从一级分类到当前分类的 id 列表
+        path = []
+        while category_id is not None and category_id in categories and len(path) < 3:
+            path.insert(0, category_id)
+            category_id = categories[category_id]['parent_id']
+        return path
+
+    index = {}
+    for category_id, cat in categories.items():
+        path = ancestors(category_id)
+        path += [None] * (3 - len(path))
+        index[category_id] = CategoryNode(
+            id=category_id,
+            name=cat['name'],
+            url=channel_urls.get(category_id, ''),
+            level=3 - path.count(None),
+            cat1_id=path[0],
+            cat2_id=path[1],
+            cat3_id=path[2]
+        )
+    return index
+
+
+def get_category_index():
+    """
+    获取分类索引, 每个进程在分类菜单版本号变化时重新构建一次
+    :return: {分类id: CategoryNode}
+    """
+    version = get_categories_version()
+    index = _category_index_lru.get(version)
+    if index is None:
+        index = build_category_index()
+        _category_index_lru.set(version, index)
+    return index
+
+
+def get_category(category_id):
+    """
+    查询分类, 不访问数据库
+    :param category_id: 分类id
+    :return: CategoryNode, 分类不存在时返回 None
+    """
+    try:
+        return get_category_index().get(int(category_id))
+    except (TypeError, ValueError):
+        return None
+
+
+def get_breadcrumb(category_id):
+    """
+    获取面包屑, 从分类索引中读取各级分类, 不访问数据库
+    :param category_id: 商品类别id
+    :return: {'cat1': 一级分类, 'cat2': 二级分类, 'cat3': 三级分类}, 没有的级别为空字符串
+    """
+    index = get_category_index()
+    category = index.get(category_id)
 
     # 定义一个字典
     breadcrumb = dict(
@@ -64,103 +199,263 @@ def get_breadcrumb(category):
         cat2='',
         cat3=''
     )
-    # 判断 category 是哪一个级别的
-    #  category 是 GoodsCategory 对象
-    if category.parent is None:
-        # 当类别为1 时, 只需展示一级
-        breadcrumb['cat1'] = category
-    elif category.goodscategory_set.count() == 0:
-        # 当对象的下一级数量为0时，证明是最后一级,需要将所有的级别展示出来
-        breadcrumb['cat3'] = category
-        cat2 = category.parent
-        breadcrumb['cat2'] = cat2
-        breadcrumb['cat1'] = cat2.parent
-    else:
-        # 当前类别为二级，需要展示两级
-        breadcrumb['cat2'] = category
-        breadcrumb['cat1'] = category.parent
+    if category is None:
+        return breadcrumb
+
+    # 按照当前分类的级别展示到当前级别
+    for key in ('cat1', 'cat2', 'cat3'):
+        ancestor_id = getattr(category, key + '_id')
+        if ancestor_id is not None:
+            breadcrumb[key] = index[ancestor_id]
 
     # 返回面包屑结果
     return breadcrumb
 
 
-def get_goods_and_spec(sku_id, request):
-    # 获取当前sku的信息
+# 商品列表页的排序方式: {sort: (排序字段, 是否倒序)}, 相同值的商品再按照 id 排序
+LIST_SORTS = {
+    'default': ('create_time', False),
+    'price': ('price', False),
+    'hot': ('sales', True),
+}
+
+
+def _category_sku_count_key(category_id):
+    """分类上架商品数量的缓存键名"""
+    return 'category_sku_count_%s' % category_id
+
+
+def get_category_sku_count(category_id):
+    """
+    获取分类上架的商品数量, 不需要每次都执行 COUNT(*)
+    :param category_id: 分类id
+    :return: 商品数量
+    """
+    cache_key = _category_sku_count_key(category_id)
+    count = cache.get(cache_key)
+    if count is None:
+        count = SKU.objects.filter(category_id=category_id, is_launched=True).count()
+        cache.set(cache_key, count, constants.CATEGORY_SKU_COUNT_EXPIRES)
+    return count
+
+
+def delete_category_sku_count(category_id):
+    """删除分类上架商品数量的缓存"""
+    cache.delete(_category_sku_count_key(category_id))
+
+
+def _encode_cursor(sku, field):
+    """
+    把商品的排序字段值和 id 编码为游标
+    :return: '排序字段值_id'
+    """
+    value = getattr(sku, field)
+    if field == 'create_time':
+        # 时间转为微秒数, 游标中不出现需要转义的字符, 和分类排行的上架时间分数一致
+        value = to_microseconds(value)
+    return '%s_%s' % (value, sku.id)
+
+
+def _decode_cursor(cursor, field):
+    """
+    解析游标
+    :return: (排序字段值, id), 格式错误时返回 None
+    """
     try:
-        sku = SKU.objects.get(id=sku_id)
-        sku.images = sku.skuimage_set.all()
-    except SKU.DoesNotExist:
-        return render(request, '404.html')
+        value, sku_id = cursor.rsplit('_', 1)
+        sku_id = int(sku_id)
+        if field == 'create_time':
+            value = from_microseconds(int(value))
+        elif field == 'price':
+            value = Decimal(value)
+        else:
+            value = int(value)
+    except (ValueError, OverflowError, InvalidOperation):
+        return None
+    return value, sku_id
 
-    # 面包屑导航信息中的频道
-    goods = sku.goods
-    goods.channel = goods.category1.goodschannel_set.all()[0]
 
-    # 构建当前商品的规格键
-    # sku_key = [规格1参数id， 规格2参数id， 规格3参数id, ...]
-    sku_specs = sku.skuspecification_set.order_by('spec_id')
-    # sku_specs = sku.specs.order_by('spec_id')
-    sku_key = []
-    for spec in sku_specs:
-        sku_key.append(spec.option.id)
+def _seek(skus, field, descending, cursor, backward):
+    """
+    从游标处开始向后(或者向前)查询一页商品, 利用 (category_id, is_launched, 排序字段, id) 索引直接定位, 不需要 OFFSET
+    :return: 商品列表, 游标格式错误时返回 None
+    """
+    position = _decode_cursor(cursor, field)
+    if position is None:
+        return None
+    value, sku_id = position
+
+    # 升序向后翻页和倒序向前翻页取更大的值, 反之取更小的值
+    op = 'lt' if descending != backward else 'gt'
+    bound = 'lte' if op == 'lt' else 'gte'
+    skus = skus.filter(Q(**{'%s__%s' % (field, bound): value}),
+                       Q(**{'%s__%s' % (field, op): value}) | Q(**{field: value, 'id__%s' % op: sku_id}))
+
+    prefix = '-' if op == 'lt' else ''
+    page_skus = list(skus.order_by(prefix + field, prefix + 'id')[:constants.GOODS_LIST_LIMIT])
+    if backward:
+        page_skus.reverse()
+    return page_skus
+
+
+def get_list_page(category_id, sort, page_num, after=None, before=None):
+    """
+    查询商品列表页的一页商品
+    分类生成过商品排行时, 直接按照排名读取 sku_id, 再批量获取 SKU 摘要;
+    否则查询数据库: 带着上一页最后一个商品的游标(after)或者下一页第一个商品的游标(before)翻页时使用游标定位,
+    直接跳转到某一页时使用 OFFSET
+    :param category_id: 分类id
+    :param sort: 排序方式 default/price/hot
+    :param page_num: 页码
+    :param after: 上一页最后一个商品的游标
+    :param before: 下一页第一个商品的游标
+    :return: (分类上架的商品数量, 商品列表, 本页第一个商品的游标, 本页最后一个商品的游标)
+    """
+    offset = (page_num - 1) * constants.GOODS_LIST_LIMIT
+
+    # 1. 商品排行, 不需要游标
+    ranking_page = rankings.get_page(category_id, sort, offset, constants.GOODS_LIST_LIMIT)
+    if ranking_page is not None:
+        count, sku_ids = ranking_page
+        return count, sku_summary.get_many(sku_ids), None, None
+
+    # 2. 数据库
+    count = get_category_sku_count(category_id)
+    if offset >= count:
+        return count, [], None, None
 
-    # 获取当前商品的所有SKU
-    skus = goods.sku_set.all()
+    field, descending = LIST_SORTS.get(sort, LIST_SORTS['default'])
+    skus = SKU.objects.filter(category_id=category_id, is_launched=True).only(
+        'id', 'name', 'price', 'default_image_url', field)
+
+    page_skus = None
+    if after or before:
+        page_skus = _seek(skus, field, descending, after or before, backward=not after)
+
+    if not page_skus:
+        # 没有游标、游标错误或者游标处的商品已经变化时, 使用 OFFSET 查询
+        prefix = '-' if descending else ''
+        page_skus = list(skus.order_by(prefix + field, prefix + 'id')[offset:offset + constants.GOODS_LIST_LIMIT])
+
+    if not page_skus:
+        return count, [], None, None
+    return count, page_skus, _encode_cursor(page_skus[0], field), _encode_cursor(page_skus[-1], field)
+
+
+def build_spec_matrix(goods_id):
+    """
+    构建商品(SPU)的规格矩阵, 查询次数固定, 和 SKU 数量无关
+    :param goods_id: 商品id
+    :return: 规格矩阵字典
+    """
+    # 一次查询出该商品所有 SKU 的规格选项
+    # sku_keys = {sku_id: [规格1参数id， 规格2参数id， 规格3参数id, ...]}
+    sku_keys = {}
+    sku_specs = SKUSpecification.objects.filter(sku__goods_id=goods_id).order_by('sku_id', 'spec_id')
+    for sku_id, option_id in sku_specs.values_list('sku_id', 'option_id'):
+        sku_keys.setdefault(sku_id, []).append(option_id)
 
     # 构建不同规格参数（选项）的sku字典
     # spec_sku_map = {
     #     (规格1参数id, 规格2参数id, 规格3参数id, ...): sku_id,
-    #     (规格1参数id, 规格2参数id, 规格3参数id, ...): sku_id,
     #     ...
     # }
     spec_sku_map = {}
-    for s in skus:
-        # 获取sku的规格参数
-        s_specs = s.skuspecification_set.order_by('spec_id')
-        # s_specs = s.specs.order_by('spec_id')
-        # 用于形成规格参数-sku字典的键
-        key = []
-        for spec in s_specs:
-            key.append(spec.option.id)
-        # 向规格参数-sku字典添加记录
-        spec_sku_map[tuple(key)] = s.id
+    for sku_id, key in sku_keys.items():
+        spec_sku_map[tuple(key)] = sku_id
+
+    # 商品的规格以及每个规格的选项
+    # specs = [{'id': xx, 'name': '颜色', 'options': [{'id': xx, 'value': '银色'}, ...]}, ...]
+    specs = []
+    options_map = {}
+    for spec in GoodsSpecification.objects.filter(goods_id=goods_id).order_by('id').values('id', 'name'):
+        spec['options'] = options_map[spec['id']] = []
+        specs.append(spec)
+    options = SpecificationOption.objects.filter(spec__goods_id=goods_id).order_by('id')
+    for option in options.values('id', 'spec_id', 'value'):
+        options_map[option['spec_id']].append({'id': option['id'], 'value': option['value']})
+
+    return {
+        'sku_keys': sku_keys,
+        'spec_sku_map': spec_sku_map,
+        'specs': specs
+    }
+
+
+def get_spec_matrix(goods_id):
+    """
+    获取商品的规格矩阵, 优先读取缓存
+    :param goods_id: 商品id
+    :return: 规格矩阵字典
+    """
+    cache_key = 'spec_matrix_%s' % goods_id
+    matrix = cache.get(cache_key)
+    if matrix is None:
+        matrix = build_spec_matrix(goods_id)
+        cache.set(cache_key, matrix, constants.SPEC_MATRIX_CACHE_EXPIRES)
+    return matrix
+
+
+def delete_spec_matrix(goods_id):
+    """
+    SKU 或规格发生变化时, 删除商品的规格矩阵缓存
+    :param goods_id: 商品id
+    """
+    cache.delete('spec_matrix_%s' % goods_id)
+
+
+def get_goods_and_spec(sku):
+    """
+    获取 sku 对应的商品和规格信息
+    :param sku: 商品SKU
+    :return: 商品、规格、sku 组成的字典
+    """
+    sku.images = sku.skuimage_set.all()
+
+    # 面包屑导航信息中的频道
+    goods = sku.goods
+    goods.channel = get_category(goods.category1_id)
+
+    # 获取商品的规格矩阵
+    matrix = get_spec_matrix(goods.id)
+    spec_sku_map = matrix['spec_sku_map']
+
+    # 构建当前商品的规格键
+    # sku_key = [规格1参数id， 规格2参数id， 规格3参数id, ...]
+    sku_key = matrix['sku_keys'].get(sku.id, [])
 
     # 获取当前商品的规格信息
     # specs = [
     #    {
     #        'name': '屏幕尺寸',
-    #        'options': [
+    #        'spec_options': [
     #            {'value': '13.3寸', 'sku_id': xxx},
     #            {'value': '15.4寸', 'sku_id': xxx},
     #        ]
     #    },
-    #    {
-    #        'name': '颜色',
-    #        'options': [
-    #            {'value': '银色', 'sku_id': xxx},
-    #            {'value': '黑色', 'sku_id': xxx}
-    #        ]
-    #    },
     #    ...
     # ]
-    goods_specs = goods.goodsspecification_set.order_by('id')
-    # goods_specs = goods.specs.order_by('id')
+    goods_specs = []
     # 若当前sku的规格信息不完整，则不再继续
-    if len(sku_key) < len(goods_specs):
-        return
-    for index, spec in enumerate(goods_specs):
+    specs = matrix['specs'] if len(sku_key) >= len(matrix['specs']) else []
+    for index, spec in enumerate(specs):
         # 复制当前sku的规格键
         key = sku_key[:]
-        # 该规格的选项
-        spec_options = spec.specificationoption_set.all()
-        # spec_options = spec.options.all()
-        for option in spec_options:
+        spec_options = []
+        for option in spec['options']:
             # 在规格参数sku字典中查找符合当前规格的sku
-            key[index] = option.id
-            option.sku_id = spec_sku_map.get(tuple(key))
+            key[index] = option['id']
+            spec_options.append({
+                'id': option['id'],
+                'value': option['value'],
+                'sku_id': spec_sku_map.get(tuple(key))
+            })
 
-        # spec.options = spec_options
-        spec.spec_options = spec_options
+        goods_specs.append({
+            'id': spec['id'],
+            'name': spec['name'],
+            'spec_options': spec_options
+        })
 
     data = {
         'goods': goods,
@@ -169,3 +464,78 @@ def get_goods_and_spec(sku_id, request):
     }
 
     return data
+
+
+def get_detail_context(sku_id):
+    """
+    获取商品详情页的模板数据, 动态渲染和页面静态化共用
+    :param sku_id: 商品sku id
+    :return: 模板数据, sku 不存在时返回 None
+    """
+    try:
+        sku = SKU.objects.select_related('goods').get(id=sku_id)
+    except SKU.DoesNotExist:
+        return None
+
+    # 调用封装的函数, 根据 sku 获取对应的
+    # 1. 类别( sku )
+    # 2. 商品( goods )
+    # 3. 商品规格( spec )
+    data = get_goods_and_spec(sku)
+
+    # 拼接数据
+    return {
+        'categories': get_categories(),  # 商品频道分类
+        'goods': data.get('goods'),
+        'breadcrumb': get_breadcrumb(sku.category_id),  # 面包屑导航
+        'specs': data.get('goods_specs'),
+        'sku': data.get('sku')
+    }
+
+
+def get_static_detail_html_path(sku_id):
+    """
+    获取详情页静态文件的路径
+    :param sku_id: 商品sku id
+    :return: detail/<sku_id>.html 的绝对路径
+    """
+    return get_static_html_path('detail', '%s.html' % sku_id)
+
+
+def generate_static_sku_detail_html(sku_id):
+    """
+    生成商品详情页的静态文件
+    :param sku_id: 商品sku id
+    :return: 生成成功返回 True, sku 不存在返回 False
+    """
+    context = get_detail_context(sku_id)
+    path = get_static_detail_html_path(sku_id)
+    if context is None:
+        # sku 已经不存在, 清理旧的静态文件
+        delete_static_html(path)
+        return False
+
+    html = loader.get_template('detail.html').render(context)
+    write_static_html(path, html)
+    return True
+
+
+def refresh_static_sku_detail_html(sku_ids):
+    """
+    数据变化后增量更新详情页静态文件
+    先删除旧文件, 详情页立即改为动态渲染, 事务提交后再异步重新生成
+    :param sku_ids: 需要更新的 sku id 列表
+    """
+    from celery_tasks.html.tasks import generate_static_sku_detail_html as generate_task
+
+    def send_tasks():
+        for sku_id in sku_ids:
+            try:
+                generate_task.delay(sku_id)
+            except Exception as e:
+                # 异步任务发送失败不影响保存, 页面会动态渲染
+                logger.error(e)
+
+    for sku_id in sku_ids:
+        delete_static_html(get_static_detail_html_path(sku_id))
+    transaction.on_commit(send_tasks)
@@ -1,16 +1,17 @@
-import datetime
+import math
 from unicodedata import category
 
-from django.utils import timezone
-
 from django import http
-from django.core.paginator import Paginator, EmptyPage
+from django.conf import settings
 from django.shortcuts import render
 from django.views import View
 
-from goods.models import GoodsCategory, SKU, GoodsVisitCount, Goods
-from goods.utils import get_categories, get_breadcrumb, get_goods_and_spec
+from goods import constants, rankings, sku_summary, visit_counts
+from goods.models import SKU, Goods
+from goods.utils import get_categories, get_breadcrumb, get_detail_context, get_static_detail_html_path, \
+    get_list_page, get_category, LIST_SORTS
 from meiduo_mall.utils.response_code import RETCODE
+from meiduo_mall.utils.static_html import open_static_html
 import logging
 
 logger = logging.getLogger('django')
@@ -21,31 +22,9 @@ class DetailVisitView(View):
 
     def post(self, request, category_id):
 
-        # 根据传入的 category_id 值， 获取对应类别的商品
-        try:
-            category = GoodsCategory.objects.get(id=category_id)
-        except GoodsCategory.DoesNotExist:
-            return http.HttpResponseNotFound('缺少必传参数')
-
-        # 获取今天的日期
-        # 先获取时间对象
-        t = timezone.localtime()
-        # 根据时间对象拼接日期的字符串
-        today_str = '%d-%02d-%02d' % (t.year, t.month, t.day)
-        # 将字符串转为日期格式
-        today_data = datetime.datetime.strptime(today_str, '%Y-%m-%d')
-        try:
-            # 将今天的日期传入进去, 获取该商品今天的访问量:
-            # 查询今天该类别的商品的访问量
-            counts_data = category.goodsvisitcount_set.get(date=today_data)
-        except GoodsVisitCount.DoesNotExist:
-            counts_data = GoodsVisitCount()
-
+        # 在 Redis 中累加今天该分类的访问量, 由定时任务写入数据库, 不存在的分类在写入时丢弃
         try:
-            # 更新模型类对象里的属性 category 和 count
-            counts_data.category = category
-            counts_data.count += 1
-            counts_data.save()
+            visit_counts.incr(category_id)
         except Exception as e:
             logger.error(e)
             return http.HttpResponseNotFound('服务器异常')
@@ -59,32 +38,16 @@ class DetailView(View):
     """商品详情页"""
 
     def get(self, request, sku_id):
-        # 查询商品频道分类
-
-        categories = get_categories()
-        # 获取当前sku的信息
-        sku = SKU.objects.get(id=sku_id)
+        # 优先返回已经静态化的详情页
+        html_path = get_static_detail_html_path(sku_id)
+        html_file = open_static_html(html_path, settings.DETAIL_HTML_EXPIRES)
+        if html_file is not None:
+            return http.FileResponse(html_file, content_type='text/html; charset=utf-8')
 
-        category = sku.category
-
-        # 3.调用工具类方法 查询面包屑导航
-        breadcrumb = get_breadcrumb(category)
-
-        # 调用封装的函数, 根据 sku_id 获取对应的
-        # 1. 类别( sku )
-        # 2. 商品( goods )
-        # 3. 商品规格( spec )
-        data = get_goods_and_spec(sku_id, request)
-
-        # 拼接数据
-        context = {
-            'categories': categories,
-            'goods': data.get('goods'),
-            'breadcrumb': breadcrumb,  # 面包屑导航
-            'specs': data.get('goods_specs'),
-            'sku': data.get('sku')
-
-        }
+        # 静态文件不存在或者已过期, 动态渲染
+        context = get_detail_context(sku_id)
+        if context is None:
+            return http.HttpResponseNotFound('商品不存在')
 
         # 返回
         return render(request, 'detail.html', context)
@@ -102,47 +65,36 @@ class ListView(View):
         :return:
         """
 
-        # 1.判断category_id 是否正确
-        try:
-            category = GoodsCategory.objects.get(id=category_id)
-        except GoodsCategory.DoesNotExist:
+        # 1.判断category_id 是否正确, 从分类索引中查询, 不访问数据库
+        category = get_category(category_id)
+        if category is None:
             return http.HttpResponseForbidden('GoodsCategory 不存在')
 
         # 2.调用工具类方法 查询商品频道分类
         categories = get_categories()
 
         # 3.调用工具类方法 查询面包屑导航
-        breadcrumb = get_breadcrumb(category)
+        breadcrumb = get_breadcrumb(category.id)
 
         # 4.接收sort 排序方式参数， 如果用户不传，就设置默认值
         sort = request.GET.get('sort', 'default')
 
-        # 5. 按照排序规则查询该分类商品SKU信息
-        if sort == 'price':
-            # 按照价格从低到高
-            sortkind = 'price'
-        elif sort == 'hot':
-            # 按照热度从高到低
-            sortkind = '-sales'
-        else:
-            # 'price'和'sales'以外的所有排序方式都归为'default'
-            sortkind = 'create_time'
-
-        # 获取当前分类并且上架的商品.( 并且对商品按照排序字段进行排序 )
-        skus = SKU.objects.filter(category=category,
-                                  is_launched=True).order_by(sortkind)
-        # 7.创建分页器
-        # skus是所有商品， 5 是每页显示的个数
-        paginator = Paginator(skus, 5)
-        # 使用分页器
-        try:
-            # page()方法，从第几页开始显示
-            page_skus = paginator.page(page_num)
-        except EmptyPage:
-            # 如果page_num 不正确，默认返回404
+        # 5.查询当前页的商品: 优先读取商品排行, 从上一页或者下一页翻页时使用游标定位
+        if sort not in LIST_SORTS:
+            # 'price'和'hot'以外的所有排序方式都归为'default'
+            sort = 'default'
+        page_num = int(page_num)
+        if page_num < 1:
+            return http.HttpResponseNotFound('empty page')
+        count, page_skus, first_cursor, last_cursor = get_list_page(category.id, sort, page_num,
+                                                                    after=request.GET.get('after'),
+                                                                    before=request.GET.get('before'))
+
+        # 6.计算总页数, 如果page_num 不正确，默认返回404
+        total_page = max(math.ceil(count / constants.GOODS_LIST_LIMIT), 1)
+        if page_num > total_page:
             return http.HttpResponseNotFound('empty page')
-        # 获取列表页总页数
-        total_page = paginator.num_pages
+
         # 4.拼接
         context = {
             'categories': categories,  # 频道分类
@@ -152,6 +104,8 @@ class ListView(View):
             'page_skus': page_skus,  # 分页后数据
             'total_page': total_page,  # 总页数
             'page_num': page_num,  # 当前页码
+            'first_cursor': first_cursor,  # 本页第一个商品的游标, 翻到上一页时使用
+            'last_cursor': last_cursor,  # 本页最后一个商品的游标, 翻到下一页时使用
         }
 
         # 5.返回
@@ -162,20 +116,15 @@ class HotGoodsView(View):
     """热销排行"""
 
     def get(self, request, category_id):
-        # 根据销售量排序，截取最多的两个商品
-        skus = SKU.objects.filter(category_id=category_id,
-                                  is_launched=True).order_by('-sales')[:2]
-        # 序列化(拼接数据)
-        hot_skus = []
-
-        # 选的拼接
-        for sku in skus:
-            hot_skus.append({
-                'id': sku.id,
-                'default_image_url': sku.default_image_url,
-                'name': sku.name,
-                'price': sku.price
-            })
+        # 根据销售量排序，截取最多的两个商品: 优先读取销量排行, 没有生成排行时查询数据库, 只查询 id
+        ranking_page = rankings.get_page(category_id, 'hot', 0, 2)
+        if ranking_page is not None:
+            sku_ids = ranking_page[1]
+        else:
+            sku_ids = SKU.objects.filter(category_id=category_id,
+                                         is_launched=True).order_by('-sales', '-id').values_list('id', flat=True)[:2]
+        # 序列化(拼接数据): 从 SKU 摘要服务中批量获取
+        hot_skus = sku_summary.get_many(sku_ids)
         # 返回
         return http.JsonResponse({'code': RETCODE.OK,
                                   'errmsg': 'ok',
@@ -0,0 +1,129 @@
+"""
+分类商品访问量: 详情页每次访问只在 Redis 中执行一次 HINCRBY, 按照日期和分类累加在待写入哈希中,
+由定时任务取出后汇总写入 GoodsVisitCount, 每次写入只执行一条 UPDATE 和一条 INSERT
+写入时持有 Redis 锁, 重叠执行的 flush 直接跳过, 不会重复插入同一个 (日期, 分类) 的记录
+"""
+import datetime
+import logging
+import uuid
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.utils import timezone
+from django_redis import get_redis_connection
+
+from goods import constants
+from goods.models import GoodsCategory, GoodsVisitCount
+from meiduo_mall.utils.redis_script import RedisScript
+
+logger = logging.getLogger('django')
+
+# 取出所有待写入的访问量并删除哈希, 取出之后的访问量累加到新的哈希中, 不会丢失
+# KEYS[1]: 待写入哈希
+DRAIN_SCRIPT = RedisScript("""
+local data = redis.call('HGETALL', KEYS[1])
+redis.call('DEL', KEYS[1])
+return data
+""")
+
+# 令牌一致时释放锁
+# KEYS[1]: 锁  ARGV[1]: 令牌
+RELEASE_LOCK_SCRIPT = RedisScript("""
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+""")
+
+
+def _get_redis_conn():
+    """访问量使用的 Redis 连接"""
+    return get_redis_connection('default')
+
+
+def incr(category_id):
+    """
+    记录一次分类商品的访问
+    :param category_id: 分类id
+    """
+    field = '%s_%s' % (timezone.localdate().isoformat(), int(category_id))
+    _get_redis_conn().hincrby(constants.GOODS_VISIT_PENDING_KEY, field, 1)
+
+
+def _save(counts):
+    """
+    把访问量写入数据库: 已有的记录用一条 UPDATE 累加, 没有的记录用一条 INSERT 批量插入
+    调用方需要持有写入锁, 否则两个 _save 可能同时插入同一个 (日期, 分类)
+    :param counts: {(日期, 分类id): 访问量}
+    """
+    # 不存在的分类直接丢弃
+    category_ids = set(GoodsCategory.objects.filter(
+        id__in={category_id for _, category_id in counts}).values_list('id', flat=True))
+    counts = {key: count for key, count in counts.items() if key[1] in category_ids}
+    if not counts:
+        return
+
+    with transaction.atomic():
+        existing = GoodsVisitCount.objects.filter(
+            date__in={date for date, _ in counts},
+            category_id__in={category_id for _, category_id in counts}
+        ).values_list('id', 'date', 'category_id')
+
+        # {记录id: 增加的访问量}
+        increments = {}
+        for visit_id, date, category_id in existing:
+            count = counts.pop((date, category_id), None)
+            if count:
+                increments[visit_id] = count
+
+        if increments:
+            GoodsVisitCount.objects.filter(id__in=increments).update(count=F('count') + Case(
+                *[When(id=visit_id, then=Value(count)) for visit_id, count in increments.items()],
+                output_field=IntegerField()
+            ))
+
+        GoodsVisitCount.objects.bulk_create([
+            GoodsVisitCount(date=date, category_id=category_id, count=count)
+            for (date, category_id), count in counts.items()
+        ])
+
+
+def flush():
+    """
+    把 Redis 中的访问量写入数据库, 写入失败时放回 Redis, 等待下次写入
+    其他 flush 正在写入时不取出访问量, 留给下次写入
+    :return: 写入的 (日期, 分类) 数量, 其他 flush 正在写入时返回 None
+    """
+    redis_conn = _get_redis_conn()
+    token = uuid.uuid4().hex
+    if not redis_conn.set(constants.GOODS_VISIT_FLUSH_LOCK_KEY, token, nx=True,
+                          ex=constants.GOODS_VISIT_FLUSH_LOCK_EXPIRES):
+        return None
+    try:
+        return _flush(redis_conn)
+    finally:
+        RELEASE_LOCK_SCRIPT(redis_conn, keys=[constants.GOODS_VISIT_FLUSH_LOCK_KEY], args=[token])
+
+
+def _flush(redis_conn):
+    """取出访问量并写入数据库, 需要持有写入锁"""
+    data = DRAIN_SCRIPT(redis_conn, keys=[constants.GOODS_VISIT_PENDING_KEY])
+
+    counts = defaultdict(int)
+    for i in range(0, len(data), 2):
+        date, category_id = data[i].decode().split('_')
+        counts[(datetime.datetime.strptime(date, '%Y-%m-%d').date(), int(category_id))] += int(data[i + 1])
+    if not counts:
+        return 0
+
+    try:
+        _save(dict(counts))
+    except Exception:
+        pl = redis_conn.pipeline()
+        for (date, category_id), count in counts.items():
+            pl.hincrby(constants.GOODS_VISIT_PENDING_KEY, '%s_%s' % (date.isoformat(), category_id), count)
+        pl.execute()
+        raise
+
+    return len(counts)
@@ -0,0 +1,37 @@
+# 下单遇到数据库死锁或锁等待超时时, 整个事务最多尝试的次数
+ORDER_COMMIT_RETRIES = 3
+
+# 重试前等待的基础时间, 单位: 秒 (每次重试翻倍, 并加入随机抖动)
+ORDER_COMMIT_BACKOFF = 0.05
+
+# 订单运费
+ORDER_FREIGHT = '10.00'
+
+# 秒杀库存: Redis 中的剩余库存哈希 {sku_id: stock}, 哈希中存在的 SKU 即为秒杀商品
+FLASH_STOCK_KEY = 'flash_stock'
+
+# 秒杀库存: 已售出但还没有同步到数据库的数量 {sku_id: count}
+FLASH_PENDING_KEY = 'flash_pending'
+
+# 秒杀库存同步到数据库时, 每个事务处理的 SKU 数量
+FLASH_RECONCILE_BATCH = 200
+
+# 排队下单的订单状态: 排队中、下单成功、下单失败
+ORDER_TICKET_QUEUED = 'queued'
+ORDER_TICKET_SUCCESS = 'success'
+ORDER_TICKET_FAILED = 'failed'
+
+# 排队下单的订单状态在 Redis 中的有效期, 单位: 秒
+ORDER_TICKET_EXPIRES = 3600
+
+# 用户排队中的订单标记的有效期, 标记存在时不能再次排队下单, 单位: 秒 (任务异常退出时标记到期后自动解除)
+ORDER_QUEUED_EXPIRES = 120
+
+# 排队下单订单号序号的有效期, 只需要覆盖同一秒内的多次下单, 单位: 秒
+ORDER_SEQ_EXPIRES = 60
+
+# 我的订单每页显示的订单数量
+ORDER_LIST_LIMIT = 2
+
+# 用户订单数量缓存的有效期, 单位: 秒
+ORDER_COUNT_CACHE_EXPIRES = 3600
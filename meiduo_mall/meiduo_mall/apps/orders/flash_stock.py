@@ -0,0 +1,238 @@
+"""
+秒杀库存: 热点 SKU 的库存放在 Redis 中, 下单时用 Lua 脚本原子扣减, 库存不足直接拒绝, 不访问数据库
+已售出的数量记录在待同步哈希中, 由定时任务批量写回 SKU.stock/sales 和 Goods.sales
+
+对于已加载的 SKU, 始终满足: 数据库库存 - 待同步数量 = Redis 库存
+"""
+import logging
+
+from django.db import transaction
+from django.db.models import F
+from django_redis import get_redis_connection
+
+from goods import rankings
+from goods.models import SKU
+from meiduo_mall.utils.redis_script import RedisScript
+from orders import constants
+
+logger = logging.getLogger('django')
+
+# 扣减库存: 所有秒杀商品的库存都足够时才扣减, 非秒杀商品跳过
+# KEYS[1]: 库存哈希 KEYS[2]: 待同步哈希  ARGV: sku_id1, count1, sku_id2, count2 ...
+# 返回: {0, 扣减的sku_id...} 或者 {1, 库存不足的sku_id}
+RESERVE_SCRIPT = RedisScript("""
+local reserved = {0}
+for i = 1, #ARGV, 2 do
+    local stock = redis.call('HGET', KEYS[1], ARGV[i])
+    if stock then
+        if tonumber(stock) < tonumber(ARGV[i + 1]) then
+            return {1, ARGV[i]}
+        end
+        table.insert(reserved, ARGV[i])
+    end
+end
+for i = 1, #ARGV, 2 do
+    if redis.call('HEXISTS', KEYS[1], ARGV[i]) == 1 then
+        redis.call('HINCRBY', KEYS[1], ARGV[i], -tonumber(ARGV[i + 1]))
+        redis.call('HINCRBY', KEYS[2], ARGV[i], ARGV[i + 1])
+    end
+end
+return reserved
+""")
+
+# 归还库存(下单失败时的补偿): 待同步数量一定减回去, 库存只在 SKU 仍是秒杀商品时加回去
+# KEYS[1]: 库存哈希 KEYS[2]: 待同步哈希  ARGV: sku_id1, count1, sku_id2, count2 ...
+RELEASE_SCRIPT = RedisScript("""
+for i = 1, #ARGV, 2 do
+    if redis.call('HEXISTS', KEYS[1], ARGV[i]) == 1 then
+        redis.call('HINCRBY', KEYS[1], ARGV[i], ARGV[i + 1])
+    end
+    redis.call('HINCRBY', KEYS[2], ARGV[i], -tonumber(ARGV[i + 1]))
+end
+return 0
+""")
+
+# 取出一批待同步的数量并从哈希中删除
+# KEYS[1]: 待同步哈希  ARGV[1]: 每批最多的 SKU 数量
+# 返回: {sku_id1, count1, sku_id2, count2 ...}
+DRAIN_SCRIPT = RedisScript("""
+local data = redis.call('HGETALL', KEYS[1])
+local result = {}
+local limit = tonumber(ARGV[1]) * 2
+for i = 1, #data, 2 do
+    if #result >= limit then
+        break
+    end
+    redis.call('HDEL', KEYS[1], data[i])
+    if tonumber(data[i + 1]) ~= 0 then
+        table.insert(result, data[i])
+        table.insert(result, data[i + 1])
+    end
+end
+return result
+""")
+
+
+def _get_redis_conn():
+    """秒杀库存使用的 Redis 连接"""
+    return get_redis_connection('inventory')
+
+
+def _flatten(counts):
+    """{sku_id: count} 转为 [sku_id1, count1, sku_id2, count2 ...]"""
+    args = []
+    for sku_id in sorted(counts):
+        args.extend([sku_id, counts[sku_id]])
+    return args
+
+
+def _to_dict(values):
+    """[sku_id1, count1, ...] 转为 {sku_id: count}"""
+    return {int(values[i]): int(values[i + 1]) for i in range(0, len(values), 2)}
+
+
+def reserve(carts):
+    """
+    扣减购物车中秒杀商品的 Redis 库存
+    :param carts: {sku_id: count}
+    :return: (已扣减的秒杀商品 {sku_id: count}, 库存不足的 sku_id 或者 None)
+    """
+    if not carts:
+        return {}, None
+
+    redis_conn = _get_redis_conn()
+    result = RESERVE_SCRIPT(redis_conn, keys=[constants.FLASH_STOCK_KEY, constants.FLASH_PENDING_KEY],
+                            args=_flatten(carts))
+
+    if int(result[0]) == 1:
+        return {}, int(result[1])
+
+    reserved = {int(sku_id): carts[int(sku_id)] for sku_id in result[1:]}
+    return reserved, None
+
+
+def release(reserved):
+    """
+    归还已扣减的 Redis 库存, 下单失败时调用
+    :param reserved: reserve() 返回的 {sku_id: count}
+    """
+    if not reserved:
+        return
+
+    redis_conn = _get_redis_conn()
+    RELEASE_SCRIPT(redis_conn, keys=[constants.FLASH_STOCK_KEY, constants.FLASH_PENDING_KEY], args=_flatten(reserved))
+
+
+def _apply_to_db(pending):
+    """
+    把已售出的数量写回数据库
+    :param pending: {sku_id: count}, count 可以为负数(下单失败归还的库存)
+    """
+    from orders.utils import add_goods_sales
+
+    with transaction.atomic():
+        for sku_id in sorted(pending):
+            SKU.objects.filter(id=sku_id).update(
+                stock=F('stock') - pending[sku_id],
+                sales=F('sales') + pending[sku_id]
+            )
+        skus = list(SKU.objects.filter(id__in=pending.keys()).only('id', 'goods_id', 'category_id'))
+        add_goods_sales(skus, pending)
+        rankings.add_sales_on_commit(skus, pending)
+
+
+def reconcile(batch_size=constants.FLASH_RECONCILE_BATCH):
+    """
+    把 Redis 中待同步的销量分批写回数据库, 写入失败时放回待同步哈希, 等待下次同步
+    :param batch_size: 每个事务处理的 SKU 数量
+    :return: 同步的 SKU 数量
+    """
+    redis_conn = _get_redis_conn()
+
+    total = 0
+    while True:
+        pending = _to_dict(DRAIN_SCRIPT(redis_conn, keys=[constants.FLASH_PENDING_KEY], args=[batch_size]))
+        if not pending:
+            break
+
+        try:
+            _apply_to_db(pending)
+        except Exception:
+            pl = redis_conn.pipeline()
+            for sku_id, count in pending.items():
+                pl.hincrby(constants.FLASH_PENDING_KEY, sku_id, count)
+            pl.execute()
+            raise
+
+        total += len(pending)
+        if len(pending) < batch_size:
+            break
+
+    return total
+
+
+def load(sku_ids, force=False):
+    """
+    把 SKU 的数据库库存加载到 Redis, 开启秒杀库存
+    :param sku_ids: sku id 列表
+    :param force: 已加载的 SKU 是否用数据库库存覆盖
+    :return: 加载的 SKU 数量
+    """
+    # 先同步待写回的销量, 保证数据库库存是最新的
+    reconcile()
+
+    redis_conn = _get_redis_conn()
+    skus = SKU.objects.filter(id__in=sku_ids).only('id', 'stock')
+    count = 0
+    for sku in skus:
+        if force:
+            redis_conn.hset(constants.FLASH_STOCK_KEY, sku.id, sku.stock)
+            count += 1
+        elif redis_conn.hsetnx(constants.FLASH_STOCK_KEY, sku.id, sku.stock):
+            count += 1
+    return count
+
+
+def unload(sku_ids):
+    """
+    关闭 SKU 的秒杀库存, 之后下单重新扣减数据库库存
+    :param sku_ids: sku id 列表
+    """
+    if sku_ids:
+        _get_redis_conn().hdel(constants.FLASH_STOCK_KEY, *sku_ids)
+    reconcile()
+
+
+def audit(fix=False):
+    """
+    检查 Redis 库存和数据库库存是否一致: 数据库库存 - 待同步数量 应该等于 Redis 库存
+    有订单正在提交或同步时可能出现短暂的误报
+    :param fix: 是否用数据库库存修正 Redis 库存
+    :return: 不一致的列表 [(sku_id, Redis 库存, 待同步数量, 数据库库存)]
+    """
+    redis_conn = _get_redis_conn()
+    pl = redis_conn.pipeline()
+    pl.hgetall(constants.FLASH_STOCK_KEY)
+    pl.hgetall(constants.FLASH_PENDING_KEY)
+    stock_dict, pending_dict = pl.execute()
+    stocks = {int(k): int(v) for k, v in stock_dict.items()}
+    pending = {int(k): int(v) for k, v in pending_dict.items()}
+
+    db_stocks = dict(SKU.objects.filter(id__in=stocks.keys()).values_list('id', 'stock'))
+
+    drifts = []
+    for sku_id in sorted(stocks):
+        db_stock = db_stocks.get(sku_id)
+        expected = None if db_stock is None else db_stock - pending.get(sku_id, 0)
+        if stocks[sku_id] == expected:
+            continue
+
+        drifts.append((sku_id, stocks[sku_id], pending.get(sku_id, 0), db_stock))
+        if fix:
+            if expected is None:
+                # 商品已经删除
+                redis_conn.hdel(constants.FLASH_STOCK_KEY, sku_id)
+            else:
+                redis_conn.hset(constants.FLASH_STOCK_KEY, sku_id, expected)
+
+    return drifts
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from orders import flash_stock
+
+
+class Command(BaseCommand):
+    help = '管理秒杀库存: load 加载到 Redis, unload 取消, reconcile 同步销量到数据库, audit 检查库存是否一致'
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=['load', 'unload', 'reconcile', 'audit'])
+        parser.add_argument('sku_ids', nargs='*', type=int, help='load/unload 操作的 sku id')
+        parser.add_argument('--force', action='store_true',
+                            help='load 时用数据库库存覆盖已加载的 Redis 库存')
+        parser.add_argument('--fix', action='store_true',
+                            help='audit 时用数据库库存修正 Redis 库存, 请在没有订单提交时执行')
+
+    def handle(self, *args, **options):
+        action = options['action']
+        sku_ids = options['sku_ids']
+
+        if action in ('load', 'unload') and not sku_ids:
+            raise CommandError('%s 需要指定 sku id' % action)
+
+        if action == 'load':
+            count = flash_stock.load(sku_ids, force=options['force'])
+            self.stdout.write('共加载 %d 个 SKU 的库存' % count)
+        elif action == 'unload':
+            flash_stock.unload(sku_ids)
+            self.stdout.write('已取消 %d 个 SKU 的秒杀库存' % len(sku_ids))
+        elif action == 'reconcile':
+            count = flash_stock.reconcile()
+            self.stdout.write('共同步 %d 个 SKU 的销量' % count)
+        else:
+            drifts = flash_stock.audit(fix=options['fix'])
+            for sku_id, stock, pending, db_stock in drifts:
+                self.stdout.write('sku %s: Redis 库存 %s, 待同步 %s, 数据库库存 %s' % (sku_id, stock, pending, db_stock))
+            self.stdout.write('共 %d 个 SKU 库存不一致%s' % (len(drifts), ', 已修正' if drifts and options['fix'] else ''))
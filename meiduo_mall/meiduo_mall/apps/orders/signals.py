@@ -0,0 +1,18 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from orders.models import OrderInfo
+from orders.utils import delete_user_order_count
+
+
+@receiver(post_save, sender=OrderInfo)
+def invalidate_order_count_on_create(sender, instance, created, **kwargs):
+    """新增订单时, 删除用户订单数量缓存"""
+    if created:
+        delete_user_order_count(instance.user_id)
+
+
+@receiver(post_delete, sender=OrderInfo)
+def invalidate_order_count_on_delete(sender, instance, **kwargs):
+    """删除订单时, 删除用户订单数量缓存"""
+    delete_user_order_count(instance.user_id)
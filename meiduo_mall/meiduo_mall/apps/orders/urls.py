@@ -7,6 +7,8 @@ urlpatterns = [
     url(r'^orders/settlement/$', views.OrderSettlementView.as_view(), name='settlement'),
     # 订单提交
     url(r'^orders/commit/$', views.OrderCommitView.as_view()),
+    # 排队下单的订单状态
+    url(r'^orders/status/(?P<order_id>\d+)/$', views.OrderStatusView.as_view()),
     # 订单提交成功过渡页面
     url(r'^orders/success/$', views.OrderSuccessView.as_view()),
     # 我的订单
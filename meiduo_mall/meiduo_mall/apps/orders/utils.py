@@ -0,0 +1,373 @@
+import logging
+import random
+import time
+from collections import defaultdict
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction, OperationalError
+from django.db.models import F
+from django.utils import timezone
+from django_redis import get_redis_connection
+
+from carts.storage import RedisCart
+from goods import rankings
+from goods.models import SKU, Goods
+from meiduo_mall.utils.redis_script import RedisScript
+from orders import constants, flash_stock
+from orders.models import OrderInfo, OrderGoods
+from users.models import User, Address
+from meiduo_mall.utils.response_code import RETCODE
+
+logger = logging.getLogger('django')
+
+# 创建排队下单的订单状态: 用户没有排队中的订单并且订单号没有使用过时才创建, 同时设置用户的排队标记
+# KEYS[1]: 用户的排队标记 KEYS[2]: 订单状态哈希
+# ARGV[1]: 订单号 ARGV[2]: 用户id ARGV[3]: 排队中的状态 ARGV[4]: 排队标记的有效期 ARGV[5]: 订单状态的有效期
+# 返回: 1 创建成功, 0 用户已有排队中的订单
+CREATE_TICKET_SCRIPT = RedisScript("""
+if redis.call('EXISTS', KEYS[2]) == 1 or not redis.call('SET', KEYS[1], ARGV[1], 'NX', 'EX', ARGV[4]) then
+    return 0
+end
+redis.call('HMSET', KEYS[2], 'user_id', ARGV[2], 'status', ARGV[3], 'code', '0', 'errmsg', '')
+redis.call('EXPIRE', KEYS[2], ARGV[5])
+return 1
+""")
+
+# 标记中的订单号一致时清除用户的排队标记, 标记到期后被新的订单重新设置时不清除
+# KEYS[1]: 用户的排队标记 ARGV[1]: 订单号
+RELEASE_QUEUED_SCRIPT = RedisScript("""
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+""")
+
+
+class StockShortageError(Exception):
+    """库存不足"""
+
+    def __init__(self, sku_id):
+        super(StockShortageError, self).__init__('商品 %s 库存不足' % sku_id)
+        self.sku_id = sku_id
+
+
+class OrderQueuedError(Exception):
+    """用户已有排队中的订单"""
+
+    def __init__(self, user_id):
+        super(OrderQueuedError, self).__init__('用户 %s 已有排队中的订单' % user_id)
+        self.user_id = user_id
+
+
+def reserve_stock(carts):
+    """
+    扣减库存, 增加销量
+    每个 SKU 只执行一条带条件的 UPDATE (stock >= count), 不需要先查询再比较,
+    并且按照 sku_id 排序加行锁, 并发下单时加锁顺序一致, 避免死锁
+    :param carts: {sku_id: count}
+    :return: None, 任意一个 SKU 库存不足时抛出 StockShortageError
+    """
+    for sku_id in sorted(carts):
+        count = carts[sku_id]
+        result = SKU.objects.filter(id=sku_id, stock__gte=count).update(
+            stock=F('stock') - count,
+            sales=F('sales') + count
+        )
+        if result == 0:
+            raise StockShortageError(sku_id)
+
+
+def add_goods_sales(skus, carts):
+    """
+    按 SPU 汇总销量后再更新, 同一个 SPU 的多个 SKU 只更新一次
+    :param skus: 已扣减库存的 SKU 列表
+    :param carts: {sku_id: count}
+    """
+    goods_sales = defaultdict(int)
+    for sku in skus:
+        goods_sales[sku.goods_id] += carts[sku.id]
+
+    for goods_id in sorted(goods_sales):
+        Goods.objects.filter(id=goods_id).update(sales=F('sales') + goods_sales[goods_id])
+
+
+def generate_order_id(user):
+    """
+    生成订单号: 下单时间 + 用户id
+    :param user: 下单用户
+    :return: 订单号
+    """
+    return timezone.localtime().strftime('%Y%m%d%H%M%S') + ('%09d' % user.id)
+
+
+def _order_seq_key(user_id):
+    """排队下单订单号序号的键名"""
+    return 'order_seq_%s' % user_id
+
+
+def generate_queued_order_id(user):
+    """
+    生成排队下单的订单号: 下单时间 + 用户id + 4 位序号
+    订单号在提交时就返回给前端, 同一个用户在同一秒内多次下单时由序号区分
+    :param user: 下单用户
+    :return: 订单号
+    """
+    key = _order_seq_key(user.id)
+    pl = get_redis_connection('default').pipeline()
+    pl.incr(key)
+    pl.expire(key, constants.ORDER_SEQ_EXPIRES)
+    seq = pl.execute()[0]
+    return generate_order_id(user) + ('%04d' % (seq % 10000))
+
+
+def _create_order(order_id, user, address, pay_method, carts, flash_skus):
+    """
+    在一个事务中保存订单: 订单基本信息、扣减库存、订单商品
+    秒杀商品的库存已经在 Redis 中扣减, 由定时任务同步到数据库, 这里跳过
+    """
+    with transaction.atomic():
+        # 先扣减库存, 库存不足时直接回滚, 不写入任何数据
+        reserve_stock({sku_id: count for sku_id, count in carts.items() if sku_id not in flash_skus})
+
+        # 一次查询出单价和所属 SPU
+        skus = list(SKU.objects.filter(id__in=carts.keys()).only(
+            'id', 'price', 'goods_id', 'category_id').order_by('id'))
+        sold_skus = [sku for sku in skus if sku.id not in flash_skus]
+        add_goods_sales(sold_skus, carts)
+        rankings.add_sales_on_commit(sold_skus, carts)
+
+        total_count = 0
+        total_amount = Decimal('0.00')
+        for sku in skus:
+            total_count += carts[sku.id]
+            total_amount += sku.price * carts[sku.id]
+
+        freight = Decimal(constants.ORDER_FREIGHT)
+        order = OrderInfo.objects.create(
+            order_id=order_id,
+            user=user,
+            address=address,
+            total_count=total_count,
+            total_amount=total_amount + freight,
+            freight=freight,
+            pay_method=pay_method,
+            status=OrderInfo.ORDER_STATUS_ENUM['UNPAID']
+            if pay_method == OrderInfo.PAY_METHODS_ENUM['ALIPAY']
+            else OrderInfo.ORDER_STATUS_ENUM['UNSEND']
+        )
+
+        # 一条 INSERT 保存所有的订单商品
+        OrderGoods.objects.bulk_create([
+            OrderGoods(order=order, sku=sku, count=carts[sku.id], price=sku.price)
+            for sku in skus
+        ])
+
+    return order
+
+
+def reserve_flash_stock(carts):
+    """
+    开启秒杀库存时, 在 Redis 中扣减秒杀商品的库存, 库存不足直接拒绝, 不访问数据库
+    :param carts: 勾选的商品 {sku_id: count}
+    :return: 已扣减的秒杀商品 {sku_id: count}, 库存不足时抛出 StockShortageError
+    """
+    if not settings.FLASH_STOCK_ENABLED:
+        return {}
+    flash_skus, short_sku_id = flash_stock.reserve(carts)
+    if short_sku_id is not None:
+        raise StockShortageError(short_sku_id)
+    return flash_skus
+
+
+def create_order(user, address, pay_method, carts, order_id=None, flash_skus=None):
+    """
+    创建订单
+    遇到死锁、锁等待超时等数据库错误时, 回滚后按指数退避重试整个事务, 重试次数有上限
+    :param user: 下单用户
+    :param address: 收货地址
+    :param pay_method: 支付方式
+    :param carts: 勾选的商品 {sku_id: count}
+    :param order_id: 订单号, 不传时自动生成
+    :param flash_skus: 已经由 reserve_flash_stock 扣减的秒杀商品, 不传时在这里扣减; 下单失败时归还
+    :return: 订单对象, 库存不足时抛出 StockShortageError
+    """
+    order_id = order_id or generate_order_id(user)
+
+    if flash_skus is None:
+        flash_skus = reserve_flash_stock(carts)
+
+    try:
+        for attempt in range(constants.ORDER_COMMIT_RETRIES):
+            try:
+                return _create_order(order_id, user, address, pay_method, carts, flash_skus)
+            except OperationalError as e:
+                if attempt == constants.ORDER_COMMIT_RETRIES - 1:
+                    raise
+                logger.warning('下单失败, 准备重试(%s): %s' % (attempt + 1, e))
+                time.sleep(constants.ORDER_COMMIT_BACKOFF * (2 ** attempt) * random.uniform(1, 2))
+    except Exception:
+        # 订单没有保存, 归还 Redis 中扣减的库存
+        flash_stock.release(flash_skus)
+        raise
+
+
+def _order_count_key(user_id):
+    """用户订单数量的缓存键名"""
+    return 'order_count_%s' % user_id
+
+
+def get_user_order_count(user):
+    """
+    获取用户的订单数量, 用于我的订单分页, 避免每次翻页都执行 COUNT(*)
+    :param user: 用户
+    :return: 订单数量
+    """
+    key = _order_count_key(user.id)
+    count = cache.get(key)
+    if count is None:
+        count = OrderInfo.objects.filter(user=user).count()
+        cache.set(key, count, constants.ORDER_COUNT_CACHE_EXPIRES)
+    return count
+
+
+def delete_user_order_count(user_id):
+    """
+    删除用户订单数量缓存, 在事务提交后删除, 避免其他请求把提交前的数量重新写入缓存
+    :param user_id: 用户id
+    """
+    transaction.on_commit(lambda: cache.delete(_order_count_key(user_id)))
+
+
+def clear_ordered_carts(user_id, sku_ids):
+    """
+    清除购物车中已下单的商品
+    :param user_id: 用户id
+    :param sku_ids: 已下单的 sku id
+    """
+    if not sku_ids:
+        return
+    RedisCart(user_id).remove(*sku_ids)
+
+
+def _ticket_key(order_id):
+    """排队下单的订单状态在 Redis 中的键名"""
+    return 'order_ticket_%s' % order_id
+
+
+def _queued_key(user_id):
+    """用户排队中的订单标记的键名, 值为订单号"""
+    return 'order_queued_%s' % user_id
+
+
+def _create_ticket(order_id, user_id):
+    """
+    记录排队中的订单状态
+    :return: 是否创建成功, 用户已有排队中的订单时返回 False
+    """
+    result = CREATE_TICKET_SCRIPT(get_redis_connection('default'),
+                                  keys=[_queued_key(user_id), _ticket_key(order_id)],
+                                  args=[order_id, user_id, constants.ORDER_TICKET_QUEUED,
+                                        constants.ORDER_QUEUED_EXPIRES, constants.ORDER_TICKET_EXPIRES])
+    return bool(int(result))
+
+
+def _drop_ticket(order_id, user_id):
+    """任务没有提交成功, 删除订单状态和用户的排队标记"""
+    redis_conn = get_redis_connection('default')
+    redis_conn.delete(_ticket_key(order_id))
+    RELEASE_QUEUED_SCRIPT(redis_conn, keys=[_queued_key(user_id)], args=[order_id])
+
+
+def _set_ticket(order_id, user_id, status, code=RETCODE.OK, errmsg=''):
+    """保存排队下单的结果, 并清除用户的排队标记"""
+    redis_conn = get_redis_connection('default')
+    key = _ticket_key(order_id)
+    pl = redis_conn.pipeline()
+    pl.hset(key, mapping={'user_id': user_id, 'status': status, 'code': code, 'errmsg': errmsg})
+    pl.expire(key, constants.ORDER_TICKET_EXPIRES)
+    pl.execute()
+    RELEASE_QUEUED_SCRIPT(redis_conn, keys=[_queued_key(user_id)], args=[order_id])
+
+
+def get_order_ticket(order_id, user_id):
+    """
+    查询排队下单的订单状态
+    :param order_id: 订单号
+    :param user_id: 当前用户id, 只能查询自己的订单
+    :return: {'status', 'code', 'errmsg'}, 不存在时返回 None
+    """
+    data = get_redis_connection('default').hgetall(_ticket_key(order_id))
+    if not data or int(data[b'user_id']) != user_id:
+        return None
+    return {
+        'status': data[b'status'].decode(),
+        'code': data[b'code'].decode(),
+        'errmsg': data[b'errmsg'].decode()
+    }
+
+
+def enqueue_order(user, address, pay_method, carts, flash_skus):
+    """
+    排队下单: 生成订单号并记录排队状态, 由 celery 任务保存订单
+    :param user: 下单用户
+    :param address: 收货地址
+    :param pay_method: 支付方式
+    :param carts: 勾选的商品 {sku_id: count}
+    :param flash_skus: 已经由 reserve_flash_stock 扣减的秒杀商品 {sku_id: count}
+    :return: 订单号, 用户已有排队中的订单时抛出 OrderQueuedError
+    """
+    from celery_tasks.orders.tasks import create_order as create_order_task
+
+    # 上一个订单还在排队时不再排队, 避免两个任务使用同一个购物车下单
+    order_id = generate_queued_order_id(user)
+    if not _create_ticket(order_id, user.id):
+        raise OrderQueuedError(user.id)
+
+    try:
+        # json 序列化后字典的键会变成字符串, 这里改为列表传递
+        create_order_task.delay(order_id, user.id, address.id, pay_method, list(carts.items()), list(flash_skus))
+    except Exception:
+        _drop_ticket(order_id, user.id)
+        raise
+    return order_id
+
+
+def process_order_ticket(order_id, user_id, address_id, pay_method, items, flash_sku_ids=None):
+    """
+    celery 任务中保存排队的订单, 完成后更新订单状态并清除购物车
+    :param order_id: 订单号
+    :param user_id: 用户id
+    :param address_id: 收货地址id
+    :param pay_method: 支付方式
+    :param items: 勾选的商品 [(sku_id, count)]
+    :param flash_sku_ids: 提交订单时已扣减 Redis 库存的秒杀商品 id, 下单失败时归还;
+                          为 None 时(升级前进入队列的任务)在这里扣减
+    """
+    carts = {int(sku_id): int(count) for sku_id, count in items}
+    flash_skus = None
+    if flash_sku_ids is not None:
+        flash_skus = {int(sku_id): carts[int(sku_id)] for sku_id in flash_sku_ids}
+
+    try:
+        user = User.objects.get(id=user_id)
+        address = Address.objects.get(id=address_id, user_id=user_id)
+    except Exception as e:
+        logger.error(e)
+        flash_stock.release(flash_skus)
+        _set_ticket(order_id, user_id, constants.ORDER_TICKET_FAILED, RETCODE.DBERR, '下单失败')
+        return
+
+    try:
+        create_order(user, address, pay_method, carts, order_id=order_id, flash_skus=flash_skus)
+    except StockShortageError:
+        _set_ticket(order_id, user_id, constants.ORDER_TICKET_FAILED, RETCODE.STOCKERR, '库存不足')
+        return
+    except Exception as e:
+        logger.error(e)
+        _set_ticket(order_id, user_id, constants.ORDER_TICKET_FAILED, RETCODE.DBERR, '下单失败')
+        return
+
+    clear_ordered_carts(user_id, list(carts.keys()))
+    _set_ticket(order_id, user_id, constants.ORDER_TICKET_SUCCESS)
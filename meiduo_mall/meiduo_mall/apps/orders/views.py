@@ -1,16 +1,19 @@
 import json
+import math
 from decimal import Decimal
 
 from django import http
-from django.core.paginator import Paginator, EmptyPage
-from django.db import transaction
+from django.conf import settings
 from django.shortcuts import render
-from django.utils import timezone
 from django.views import View
-from django_redis import get_redis_connection
 
-from goods.models import SKU
-from orders.models import OrderInfo, OrderGoods
+from carts.storage import RedisCart
+from goods import sku_summary
+from orders import constants
+from orders.models import OrderInfo
+from orders import flash_stock
+from orders.utils import create_order, enqueue_order, get_order_ticket, clear_ordered_carts, get_user_order_count, \
+    reserve_flash_stock, StockShortageError, OrderQueuedError
 from users.models import Address
 from meiduo_mall.utils.views import LoginRequiredMixin, LoginRequiredJSONMixin
 from meiduo_mall.utils.response_code import RETCODE
@@ -26,33 +29,35 @@ class UserOrderInfoView(LoginRequiredMixin, View):
         # 获取用户
         user = request.user
 
-        # 查询订单
-        orders = user.orderinfo_set.all().order_by('-create_time')
+        # 分页: 订单数量从缓存中读取, 不存在的页码直接返回
+        page_num = int(page_num)
+        total_count = get_user_order_count(user)
+        total_page = max(1, math.ceil(total_count / constants.ORDER_LIST_LIMIT))
+        if page_num < 1 or page_num > total_page:
+            return http.HttpResponseForbidden('订单不存在')
 
-        # 遍历所有订单
-        for order in orders:
+        # 只查询当前页的订单, 并一次性查询出这些订单的商品和 SKU
+        start = (page_num - 1) * constants.ORDER_LIST_LIMIT
+        page_orders = list(user.orderinfo_set.order_by('-create_time')
+                           .prefetch_related('skus__sku')[start:start + constants.ORDER_LIST_LIMIT])
+
+        # 遍历当前页的订单
+        for order in page_orders:
             # 绑定订单状态
-            order.status_name = OrderInfo.ORDER_STATUS_CHOICES[order.status_name]
+            order.status_name = order.get_status_display()
             # 绑定支付方式
-            order.pay_method_name = OrderInfo.PAY_METHOD_CHOICES[order.pay_method_name]
+            order.pay_method_name = order.get_pay_method_display()
             order.sku_list = []
-            # 查询订单商品
-            order_goods = order.skus.all()
-            # 遍历订单商品
-            for order_good in order_goods:
+            # 遍历订单商品, 同一个 SKU 的对象会被多个订单共用, 这里不修改它
+            for order_good in order.skus.all():
                 sku = order_good.sku
-                sku.count = order_good.count
-                sku.amount = sku.price * sku.count
-                order.sku_list.append(sku)
-
-        # 分页
-        page_num = int(page_num)
-        try:
-            paginator = Paginator(orders, 2)
-            page_orders = paginator.page(page_num)
-            total_page = paginator.num_pages
-        except EmptyPage:
-            return http.HttpResponseForbidden('订单不存在')
+                order.sku_list.append({
+                    'name': sku.name,
+                    'default_image_url': sku.default_image_url,
+                    'price': sku.price,
+                    'count': order_good.count,
+                    'amount': sku.price * order_good.count
+                })
 
         # 拼接格式
         context = {
@@ -98,10 +103,6 @@ class OrderCommitView(View):
         if not all([address_id, pay_method]):
             return http.HttpResponseForbidden('缺少必传参数')
 
-        try:
-            adderss = Address.objects.get(id=address_id)
-        except Address.DoesNotExist:
-            return http.HttpResponseForbidden('参数address_id 错误')
         if pay_method not in [OrderInfo.PAY_METHODS_ENUM['CASH'],
                               OrderInfo.PAY_METHODS_ENUM['ALIPAY']]:
             return http.HttpResponseForbidden('pay_method 参数错误')
@@ -109,111 +110,55 @@ class OrderCommitView(View):
         # 获取登录用户
         user = request.user
 
-        # 生成订单
-        order_id = timezone.localtime().strftime('%Y%m%d%H%M%S') + ('%09d' % user.id)
+        # 从redis中读取购物车中被勾选的商品信息 {sku_id: count}
+        carts = RedisCart(user.id).get_selected()
 
-        with transaction.atomic():
-            # 创建事务保存点
-            save_id = transaction.savepoint()
+        # 先在 Redis 中扣减秒杀库存, 秒杀商品库存不足时直接拒绝, 不访问数据库
+        try:
+            flash_skus = reserve_flash_stock(carts)
+        except StockShortageError:
+            return http.JsonResponse({'code': RETCODE.STOCKERR,
+                                      'errmsg': '库存不足'})
 
-            # 回滚
+        try:
+            adderss = Address.objects.get(id=address_id)
+        except Address.DoesNotExist:
+            flash_stock.release(flash_skus)
+            return http.HttpResponseForbidden('参数address_id 错误')
+
+        # 排队下单: 交给 celery 任务保存订单, 直接返回订单号, 前端轮询订单状态
+        # 已扣减的秒杀商品传给任务, 任务中不再扣减
+        if settings.ORDER_QUEUE_ENABLED:
             try:
-                # 保存订单基本信息
-                order = OrderInfo.objects.create(
-                    order_id=order_id,
-                    user=user,
-                    address=adderss,
-                    total_count=0,
-                    total_amount=Decimal('0.00'),
-                    freight=Decimal('10.00'),
-                    pay_method=pay_method,
-                    status=OrderInfo.ORDER_STATUS_ENUM['UNPAID']
-                    if pay_method == OrderInfo.PAY_METHODS_ENUM['ALIPAY']
-                    else OrderInfo.ORDER_STATUS_ENUM['UNSEND']
-                )
-
-                # 从redis中读取购物车中被勾选的商品信息
-                redis_conn = get_redis_connection('carts')
-                item_dict = redis_conn.hgetall('carts_%s' % user.id)
-                cart_selected = redis_conn.smembers('selected_%s' % user.id)
-                carts = {}
-
-                # 将在set中的商品信息 保存在carts 中
-                for sku_id in cart_selected:
-                    carts[int(sku_id)] = int(item_dict[sku_id])
-
-                # 获取选中的商品id
-                sku_ids = carts.keys()
-
-                # 遍历购物购物车中被勾选的商品
-                for sku_id in sku_ids:
-                    # 使用乐观锁
-                    while True:
-                        # 查询SKU信息
-                        sku = SKU.objects.get(id=sku_id)
-
-                        # 读取原始库存
-                        origin_stock = sku.stock
-                        origin_sales = sku.sales
-
-                        # 判断库存
-                        sku_count = carts[sku.id]
-                        if sku_count > origin_stock:
-                            # 出错就回滚到保存点
-                            transaction.savepoint_rollback(save_id)
-                            return http.JsonResponse({'code': RETCODE.STOCKERR,
-                                                      'errmsg': '库存不足'})
-
-                        # 减少库存，增加销量
-                        # sku.stock -= sku_count
-                        # sku.sales += sku_count
-                        # sku.save()
-
-                        # 修改库存和销量
-                        new_stock = origin_stock - sku_count
-                        new_sales = origin_sales + sku_count
-
-                        # 再次读取库存，来对比
-                        result = SKU.objects.filter(
-                                id=sku_id,
-                                stock=origin_stock
-                        ).update(stock=new_stock, sales=new_sales)
-
-                        if result == 0:
-                            continue
-
-                        sku.goods.sales += sku_count
-                        sku.goods.save()
-                        # 保存订单信息
-                        OrderGoods.objects.create(
-                            order=order,
-                            sku=sku,
-                            count=sku_count,
-                            price=sku.price
-                        )
-
-                        # 保存商品订单中总价和总数数量
-                        order.total_count += sku_count
-                        order.total_amount += (sku.price * sku_count)
-
-                        # 下单成功或者失败，就跳出循环
-                        break
-
-                # 添加邮费和保存订单信息
-                order.total_amount += order.freight
-                order.save()
+                order_id = enqueue_order(user, adderss, pay_method, carts, flash_skus)
+            except OrderQueuedError:
+                flash_stock.release(flash_skus)
+                return http.JsonResponse({'code': RETCODE.THROTTLINGERR,
+                                          'errmsg': '上一个订单正在处理中, 请稍后再试'})
             except Exception as e:
                 logger.error(e)
-                transaction.savepoint_rollback(save_id)
+                flash_stock.release(flash_skus)
                 return http.JsonResponse({'code': RETCODE.DBERR,
                                           'errmsg': '下单失败'})
 
-            # 提交事务
-            transaction.savepoint_commit(save_id)
+            return http.JsonResponse({'code': RETCODE.OK,
+                                      'errmsg': '排队中',
+                                      'order_id': order_id,
+                                      'queued': True})
+
+        # 保存订单: 条件更新扣减库存, 批量保存订单商品
+        try:
+            order = create_order(user, adderss, pay_method, carts, flash_skus=flash_skus)
+        except StockShortageError:
+            return http.JsonResponse({'code': RETCODE.STOCKERR,
+                                      'errmsg': '库存不足'})
+        except Exception as e:
+            logger.error(e)
+            return http.JsonResponse({'code': RETCODE.DBERR,
+                                      'errmsg': '下单失败'})
 
         # 清除购物车中已结算的商品
-        redis_conn.hdel('carts_%s' % user.id, *cart_selected)
-        redis_conn.srem('selected_%s' % user.id, *cart_selected)
+        clear_ordered_carts(user.id, list(carts.keys()))
 
         # 返回JSON
         return http.JsonResponse({'code': RETCODE.OK,
@@ -221,6 +166,26 @@ class OrderCommitView(View):
                                   'order_id': order.order_id})
 
 
+class OrderStatusView(LoginRequiredJSONMixin, View):
+    """排队下单的订单状态"""
+
+    def get(self, request, order_id):
+        user = request.user
+
+        # 从 Redis 中读取订单状态
+        ticket = get_order_ticket(order_id, user.id)
+        if ticket is None:
+            # 状态已过期, 订单存在即为下单成功
+            if not OrderInfo.objects.filter(order_id=order_id, user=user).exists():
+                return http.JsonResponse({'code': RETCODE.NODATAERR,
+                                          'errmsg': '订单不存在'})
+            ticket = {'status': constants.ORDER_TICKET_SUCCESS, 'code': RETCODE.OK, 'errmsg': ''}
+
+        return http.JsonResponse({'code': ticket['code'],
+                                  'errmsg': ticket['errmsg'] or 'ok',
+                                  'status': ticket['status']})
+
+
 class OrderSettlementView(LoginRequiredMixin, View):
     """结算订单"""
 
@@ -236,28 +201,26 @@ class OrderSettlementView(LoginRequiredMixin, View):
             # 如果地址为空， 渲染模版时会判断，并跳转到地址编辑页面
             addresser = None
 
-        # 从redis购物车中查询出被勾选的商品信息
-        redis_conn = get_redis_connection('carts')
-        item_dict = redis_conn.hgetall('carts_%s' % user.id)
-        cart_selected = redis_conn.smembers('selected_%s' % user.id)
-        cart = {}
-        for sku_id in cart_selected:
-            cart[int(sku_id)] = int(item_dict[sku_id])
+        # 从redis购物车中查询出被勾选的商品信息 {sku_id: count}
+        cart = RedisCart(user.id).get_selected()
 
         # 准备初始值
         total_count = 0
         total_amount = Decimal(0.00)
 
         # 查询商品信息
-        skus = SKU.objects.filter(id__in=cart.keys())
-        for sku in skus:
-            sku.count = cart[sku.id]
-            sku.amount = sku.price * sku.count
-            total_count += sku.count
-            total_amount += sku.count * sku.price
+        skus = []
+        for summary in sku_summary.get_many(cart.keys()):
+            # 复制一份摘要, 不修改缓存中的数据
+            sku = dict(summary)
+            sku['count'] = cart[sku['id']]
+            sku['amount'] = sku['price'] * sku['count']
+            total_count += sku['count']
+            total_amount += sku['amount']
+            skus.append(sku)
 
         # 补充运费
-        freight = Decimal('10.00')
+        freight = Decimal(constants.ORDER_FREIGHT)
 
         # 拼接数据，渲染界面
         context = {
@@ -0,0 +1,113 @@
+"""
+用户名、手机号的布隆过滤器: 每个字段一个 Redis 位图, 注册页检查用户名、手机号是否已存在时,
+布隆过滤器判断一定不存在的直接返回, 可能存在的再查询数据库
+
+用户保存时把用户名、手机号加入过滤器, 布隆过滤器不能删除, 修改和删除用户后旧的值只会变成误判, 再由数据库确认;
+rebuild_user_bloom 命令从数据库重新生成, 生成完成之前(或者 Redis 数据丢失后)所有检查都查询数据库
+"""
+import hashlib
+import logging
+import struct
+
+from django_redis import get_redis_connection
+
+from users import constants
+from users.models import User
+
+logger = logging.getLogger('django')
+
+
+def _get_redis_conn():
+    """布隆过滤器使用的 Redis 连接"""
+    return get_redis_connection('default')
+
+
+def _ready_value():
+    """生成标记的值, 位数或者哈希函数个数修改后需要重新生成"""
+    return '%d:%d' % (constants.USER_BLOOM_BITS, constants.USER_BLOOM_HASHES)
+
+
+def _positions(value):
+    """
+    计算值在位图中的位置: 用 md5 的前后 8 个字节做双重哈希, 得到 USER_BLOOM_HASHES 个位置
+    :return: 位置列表
+    """
+    h1, h2 = struct.unpack('>QQ', hashlib.md5(value.encode()).digest())
+    return [(h1 + i * h2) % constants.USER_BLOOM_BITS for i in range(constants.USER_BLOOM_HASHES)]
+
+
+def might_exist(field, value):
+    """
+    判断用户名或者手机号是否可能已经存在, 一次 Redis 往返
+    :param field: username/mobile
+    :param value: 用户名或者手机号
+    :return: False 表示一定不存在; True 表示可能存在, 需要查询数据库
+    """
+    try:
+        redis_conn = _get_redis_conn()
+        pl = redis_conn.pipeline(transaction=False)
+        pl.get(constants.USER_BLOOM_READY_KEY)
+        for position in _positions(value):
+            pl.getbit(constants.USER_BLOOM_KEYS[field], position)
+        result = pl.execute()
+    except Exception as e:
+        logger.error(e)
+        return True
+
+    # 过滤器没有生成或者配置已经修改时不能判断
+    if result[0] is None or result[0].decode() != _ready_value():
+        return True
+    return all(result[1:])
+
+
+def add(user):
+    """
+    把用户的用户名、手机号加入过滤器
+    写入失败时删除生成标记, 之后都查询数据库, 直到重新生成, 避免把已存在的用户判断为不存在
+    :param user: 用户对象
+    """
+    try:
+        redis_conn = _get_redis_conn()
+        pl = redis_conn.pipeline(transaction=False)
+        for field, key in constants.USER_BLOOM_KEYS.items():
+            for position in _positions(getattr(user, field)):
+                pl.setbit(key, position, 1)
+        pl.execute()
+    except Exception as e:
+        logger.error(e)
+        try:
+            _get_redis_conn().delete(constants.USER_BLOOM_READY_KEY)
+        except Exception as e:
+            logger.error(e)
+
+
+def rebuild():
+    """
+    从数据库重新生成过滤器: 在进程内生成位图后一次写入临时键, 再替换正式的键
+    生成期间新注册的用户在替换之后补充写入
+    :return: 写入的用户数量
+    """
+    max_id = User.objects.order_by('-id').values_list('id', flat=True).first() or 0
+
+    bitmaps = {field: bytearray(constants.USER_BLOOM_BITS // 8) for field in constants.USER_BLOOM_KEYS}
+    count = 0
+    for values in User.objects.filter(id__lte=max_id).values_list(*constants.USER_BLOOM_KEYS).iterator():
+        for field, value in zip(constants.USER_BLOOM_KEYS, values):
+            bitmap = bitmaps[field]
+            for position in _positions(value):
+                # Redis 位图中第 0 位是第一个字节的最高位
+                bitmap[position >> 3] |= 0x80 >> (position & 7)
+        count += 1
+
+    redis_conn = _get_redis_conn()
+    pl = redis_conn.pipeline()
+    for field, key in constants.USER_BLOOM_KEYS.items():
+        pl.set(key + '_tmp', bytes(bitmaps[field]))
+        pl.rename(key + '_tmp', key)
+    pl.set(constants.USER_BLOOM_READY_KEY, _ready_value())
+    pl.execute()
+
+    for user in User.objects.filter(id__gt=max_id).only(*constants.USER_BLOOM_KEYS):
+        add(user)
+        count += 1
+    return count
@@ -1 +1,16 @@
-SMS_CODE_REDIS_EXPIRES = 300
\ No newline at end of file
+SMS_CODE_REDIS_EXPIRES = 300
+
+# 用户名、手机号布隆过滤器的位图键名
+USER_BLOOM_KEYS = {
+    'username': 'user_bloom_username',
+    'mobile': 'user_bloom_mobile',
+}
+
+# 布隆过滤器生成完成的标记, 值为生成时使用的 位数:哈希函数个数, 和当前配置不一致时不使用
+USER_BLOOM_READY_KEY = 'user_bloom_ready'
+
+# 每个布隆过滤器的位数(2MB), 100 万用户时误判率约 0.05%
+USER_BLOOM_BITS = 2 ** 24
+
+# 哈希函数个数
+USER_BLOOM_HASHES = 7
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from users import bloom
+
+
+class Command(BaseCommand):
+    help = '从数据库重新生成用户名、手机号的布隆过滤器'
+
+    def handle(self, *args, **options):
+        count = bloom.rebuild()
+        self.stdout.write('共写入 %d 个用户' % count)
@@ -0,0 +1,13 @@
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from users import bloom
+from users.models import User
+
+
+@receiver(post_save, sender=User)
+def add_user_to_bloom(sender, instance, update_fields=None, **kwargs):
+    """用户保存后, 把用户名、手机号加入布隆过滤器, 只更新其他字段(例如登录时间)时跳过"""
+    if update_fields and not {'username', 'mobile'} & set(update_fields):
+        return
+    bloom.add(instance)
@@ -7,14 +7,17 @@ from django.shortcuts import render, redirect
 from django import http
 # Create your views here.
 from django.urls import reverse
+from django.utils.decorators import method_decorator
 from django.views import View
 import re
 from django_redis import get_redis_connection
 # from users.models import User
 from carts.utils import merge_cart_cookie_to_redis
-from goods.models import SKU
+from goods import sku_summary
+from meiduo_mall.utils.ratelimit import RateLimitMixin, ratelimit
 from meiduo_mall.utils.response_code import RETCODE
 from .models import User, Address
+from . import bloom
 from meiduo_mall.utils.views import LoginRequiredMixin, LoginRequiredJSONMixin
 import logging
 
@@ -30,16 +33,8 @@ class UserBrowseHistory(LoginRequiredJSONMixin, View):
         redis_conn = get_redis_connection('history')
         sku_ids = redis_conn.lrange('history_%s' % request.user.id, 0, -1)
 
-        # 根据sku_ids列表数据，查询出商品sku信息
-        skus = []
-        for sku_id in sku_ids:
-            sku = SKU.objects.get(id=sku_id)
-            skus.append({
-                'id': sku.id,
-                'name': sku.name,
-                'default_image_url': sku.default_image_url,
-                'price': sku.price
-            })
+        # 根据sku_ids列表数据，批量查询出商品sku信息, 保持浏览记录的顺序
+        skus = sku_summary.get_many(sku_ids)
 
         return http.JsonResponse({'code': RETCODE.OK, 'errmsg': 'OK', 'skus': skus})
 
@@ -50,9 +45,7 @@ class UserBrowseHistory(LoginRequiredJSONMixin, View):
         sku_id = json_dict.get('sku_id')
 
         # 校验参数:
-        try:
-            SKU.objects.get(id=sku_id)
-        except SKU.DoesNotExist:
+        if sku_summary.get(sku_id) is None:
             return http.HttpResponseForbidden('sku不存在')
 
         # 保存用户浏览数据
@@ -492,6 +485,11 @@ class LogoutView(View):
         return response
 
 
+def login_throttled(request, retry_after):
+    """登录过于频繁时返回登录页面并提示"""
+    return render(request, 'login.html', {'account_errmsg': '登录过于频繁, 请稍后再试'}, status=429)
+
+
 class LoginView(View):
 
     def get(self, request):
@@ -502,6 +500,8 @@ class LoginView(View):
         """
         return render(request, 'login.html')
 
+    # 按 IP 和用户名限流
+    @method_decorator(ratelimit('login', response=login_throttled))
     def post(self, request):
         """
         实现登录逻辑
@@ -565,7 +565,9 @@ class LoginView(View):
         # return redirect(reverse('contents:index'))
 
 
-class MobileCountView(View):
+class MobileCountView(RateLimitMixin, View):
+
+    rate_limit = 'register_check'
 
     def get(self, request, mobile):
         '''
@@ -574,14 +576,20 @@ class MobileCountView(View):
         :param mobile:
         :return:
         '''
-        count = User.objects.filter(mobile=mobile).count()
+        # 布隆过滤器判断一定不存在时不查询数据库
+        if not bloom.might_exist('mobile', mobile):
+            count = 0
+        else:
+            count = User.objects.filter(mobile=mobile).count()
 
         return http.JsonResponse({'code': RETCODE.OK,
                                   'errmsg': 'ok',
                                   'count': count})
 
 
-class UsernameCountView(View):
+class UsernameCountView(RateLimitMixin, View):
+
+    rate_limit = 'register_check'
 
     def get(self, request, username):
         '''
@@ -590,7 +598,11 @@ class UsernameCountView(View):
         :param username:
         :return:
         '''
-        count = User.objects.filter(username=username).count()
+        # 布隆过滤器判断一定不存在时不查询数据库
+        if not bloom.might_exist('username', username):
+            count = 0
+        else:
+            count = User.objects.filter(username=username).count()
         return http.JsonResponse({'code': RETCODE.OK,
                                   'errmsg': 'ok',
                                   'count': count})
@@ -0,0 +1,201 @@
+"""
+图形验证码池: 预先生成 (文字, JPEG) 保存在 Redis 列表中, 请求时 LPOP 取出一个, 不在请求线程中绘制图片
+
+列表元素: 文字 + b':' + JPEG 数据
+池中数量低于 CAPTCHA_POOL_LOW_WATERMARK 时提交 celery 任务补充, 定时任务也会补满;
+池为空时当场生成, 和原来的行为一致
+captcha_pool refill 命令可以用多个进程并行生成, captcha_pool stats 命令查看池中数量和生成速度
+"""
+import logging
+import multiprocessing
+import random
+import time
+import uuid
+
+from django_redis import get_redis_connection
+
+from meiduo_mall.libs.captcha.captcha import captcha
+from meiduo_mall.utils.redis_script import RedisScript
+from verifications import const
+
+logger = logging.getLogger('django')
+
+# 取出一个验证码并记录命中/未命中, 剩余数量不足且没有正在补充时设置补充标记, 标记的值为补充任务的令牌
+# KEYS[1]: 验证码池 KEYS[2]: 统计哈希 KEYS[3]: 补充标记
+# ARGV[1]: 低水位 ARGV[2]: 补充标记的有效期 ARGV[3]: 补充任务的令牌
+# 返回: {是否需要提交补充任务, 验证码或者 nil}
+POP_SCRIPT = RedisScript("""
+local item = redis.call('LPOP', KEYS[1])
+if item then
+    redis.call('HINCRBY', KEYS[2], 'hits', 1)
+else
+    redis.call('HINCRBY', KEYS[2], 'misses', 1)
+end
+local refill = 0
+if redis.call('LLEN', KEYS[1]) < tonumber(ARGV[1]) and redis.call('SET', KEYS[3], ARGV[3], 'NX', 'EX', ARGV[2]) then
+    refill = 1
+end
+return {refill, item}
+""")
+
+# 令牌一致时删除补充标记, 标记到期后被其他任务重新设置时不删除
+# KEYS[1]: 补充标记 ARGV[1]: 补充任务的令牌
+RELEASE_FLAG_SCRIPT = RedisScript("""
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+""")
+
+
+def _get_redis_conn():
+    """验证码池使用的 Redis 连接"""
+    return get_redis_connection('verify_code')
+
+
+def _pack(text, image):
+    return text.encode() + b':' + image
+
+
+def _unpack(item):
+    text, _, image = item.partition(b':')
+    return text.decode(), image
+
+
+def _generate(_=None):
+    """生成一个验证码, 也作为进程池的任务函数"""
+    return captcha.generate_captcha()
+
+
+def _init_worker():
+    """子进程重新设置随机数种子, 避免 fork 出的进程生成相同的验证码"""
+    random.seed()
+
+
+def _record_generated(redis_conn, count, seconds):
+    """记录生成的数量和耗时"""
+    pl = redis_conn.pipeline()
+    pl.hincrby(const.CAPTCHA_POOL_STATS_KEY, 'generated', count)
+    pl.hincrbyfloat(const.CAPTCHA_POOL_STATS_KEY, 'generate_seconds', seconds)
+    pl.execute()
+
+
+def _request_refill(token):
+    """提交补充验证码池的任务, 提交失败时清除补充标记"""
+    from celery_tasks.verifications.tasks import refill_captcha_pool
+
+    try:
+        refill_captcha_pool.delay(token)
+    except Exception as e:
+        logger.error(e)
+        finish_refill(token)
+
+
+def get_captcha():
+    """
+    获取一个图形验证码, 从验证码池中取出, 池为空时当场生成
+    :return: (text, image)
+    """
+    redis_conn = _get_redis_conn()
+    token = uuid.uuid4().hex
+    result = POP_SCRIPT(redis_conn,
+                        keys=[const.CAPTCHA_POOL_KEY, const.CAPTCHA_POOL_STATS_KEY, const.CAPTCHA_POOL_REFILL_FLAG_KEY],
+                        args=[const.CAPTCHA_POOL_LOW_WATERMARK, const.CAPTCHA_POOL_REFILL_FLAG_EXPIRES, token])
+    refill = int(result[0])
+    item = result[1] if len(result) > 1 else None
+
+    if refill:
+        _request_refill(token)
+
+    if item:
+        return _unpack(item)
+
+    start = time.time()
+    text, image = _generate()
+    _record_generated(redis_conn, 1, time.time() - start)
+    return text, image
+
+
+def _push(redis_conn, batch, size):
+    """把一批验证码写入池中, 超出容量的旧验证码被丢弃"""
+    pl = redis_conn.pipeline()
+    pl.rpush(const.CAPTCHA_POOL_KEY, *[_pack(text, image) for text, image in batch])
+    pl.ltrim(const.CAPTCHA_POOL_KEY, -size, -1)
+    pl.execute()
+
+
+def _push_all(redis_conn, captchas, size):
+    """分批写入生成的验证码, 生成一批写入一批, 补充过程中池里的验证码就可以使用"""
+    batch = []
+    for item in captchas:
+        batch.append(item)
+        if len(batch) >= const.CAPTCHA_POOL_PUSH_BATCH:
+            _push(redis_conn, batch, size)
+            batch = []
+    if batch:
+        _push(redis_conn, batch, size)
+
+
+def refill(processes=1, size=const.CAPTCHA_POOL_SIZE):
+    """
+    把验证码池补满
+    :param processes: 生成验证码的进程数, 大于 1 时使用进程池
+                      (celery 的 prefork worker 不能再创建子进程, 任务中只能使用 1)
+    :param size: 验证码池的容量
+    :return: 生成的验证码数量
+    """
+    redis_conn = _get_redis_conn()
+    needed = size - redis_conn.llen(const.CAPTCHA_POOL_KEY)
+    if needed <= 0:
+        return 0
+
+    start = time.time()
+    if processes > 1:
+        # 先在父进程中渲染好字符, fork 出的子进程直接使用
+        captcha.preload()
+        pool = multiprocessing.Pool(processes, initializer=_init_worker)
+        try:
+            chunksize = max(const.CAPTCHA_POOL_PUSH_BATCH // processes, 1)
+            _push_all(redis_conn, pool.imap_unordered(_generate, range(needed), chunksize), size)
+        finally:
+            pool.terminate()
+    else:
+        _push_all(redis_conn, (_generate() for _ in range(needed)), size)
+
+    _record_generated(redis_conn, needed, time.time() - start)
+    redis_conn.hset(const.CAPTCHA_POOL_STATS_KEY, 'last_refill', int(time.time()))
+    return needed
+
+
+def finish_refill(token):
+    """
+    补充任务结束, 清除这个任务设置的补充标记
+    :param token: 设置补充标记时使用的令牌
+    """
+    RELEASE_FLAG_SCRIPT(_get_redis_conn(), keys=[const.CAPTCHA_POOL_REFILL_FLAG_KEY], args=[token])
+
+
+def stats():
+    """
+    验证码池的统计数据
+    :return: {'depth': 池中数量, 'size': 容量, 'hits': 命中次数, 'misses': 未命中次数,
+              'generated': 生成数量, 'rate': 每秒生成数量, 'last_refill': 最近一次补满的时间戳}
+    """
+    redis_conn = _get_redis_conn()
+    pl = redis_conn.pipeline()
+    pl.llen(const.CAPTCHA_POOL_KEY)
+    pl.hgetall(const.CAPTCHA_POOL_STATS_KEY)
+    depth, data = pl.execute()
+    data = {key.decode(): value for key, value in data.items()}
+
+    generated = int(data.get('generated', 0))
+    seconds = float(data.get('generate_seconds', 0))
+    return {
+        'depth': depth,
+        'size': const.CAPTCHA_POOL_SIZE,
+        'hits': int(data.get('hits', 0)),
+        'misses': int(data.get('misses', 0)),
+        'generated': generated,
+        'rate': generated / seconds if seconds else 0,
+        'last_refill': int(data['last_refill']) if 'last_refill' in data else None,
+    }
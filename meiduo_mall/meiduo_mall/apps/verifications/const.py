@@ -1,2 +1,23 @@
 IMAGE_COOE_REDIS_EXPIRES = 300
-SEND_SMS_TEPLATE_ID = 300
\ No newline at end of file
+SEND_SMS_TEPLATE_ID = 300
+
+# 图形验证码池: 预先生成的验证码保存在 Redis 列表中
+CAPTCHA_POOL_KEY = 'captcha_pool'
+
+# 验证码池的统计数据(命中/未命中/生成数量/生成耗时)
+CAPTCHA_POOL_STATS_KEY = 'captcha_pool_stats'
+
+# 正在补充验证码池的标记, 避免重复提交补充任务
+CAPTCHA_POOL_REFILL_FLAG_KEY = 'captcha_pool_refilling'
+
+# 验证码池的容量
+CAPTCHA_POOL_SIZE = 500
+
+# 池中数量低于这个值时提交补充任务
+CAPTCHA_POOL_LOW_WATERMARK = 100
+
+# 补充标记的有效期, 单位: 秒, 补充任务异常退出时到期后可以再次提交
+CAPTCHA_POOL_REFILL_FLAG_EXPIRES = 60
+
+# 每次写入 Redis 的验证码数量
+CAPTCHA_POOL_PUSH_BATCH = 50
@@ -0,0 +1,29 @@
+import datetime
+
+from django.core.management.base import BaseCommand
+
+from verifications import captcha_pool, const
+
+
+class Command(BaseCommand):
+    help = '管理图形验证码池: refill 补满验证码池, stats 查看池中数量和生成速度'
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=['refill', 'stats'])
+        parser.add_argument('--processes', type=int, default=1, help='refill 时生成验证码的进程数')
+        parser.add_argument('--size', type=int, default=const.CAPTCHA_POOL_SIZE, help='refill 时补充到的数量')
+
+    def handle(self, *args, **options):
+        if options['action'] == 'refill':
+            count = captcha_pool.refill(processes=options['processes'], size=options['size'])
+            self.stdout.write('共生成 %d 个验证码' % count)
+            return
+
+        data = captcha_pool.stats()
+        requests = data['hits'] + data['misses']
+        self.stdout.write('池中数量: %d/%d' % (data['depth'], data['size']))
+        self.stdout.write('命中: %d, 未命中: %d, 命中率: %.1f%%' % (
+            data['hits'], data['misses'], data['hits'] * 100.0 / requests if requests else 0))
+        self.stdout.write('已生成: %d, 生成速度: %.1f 个/秒' % (data['generated'], data['rate']))
+        if data['last_refill']:
+            self.stdout.write('最近补满: %s' % datetime.datetime.fromtimestamp(data['last_refill']))
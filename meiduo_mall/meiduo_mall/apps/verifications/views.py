@@ -1,9 +1,10 @@
 from django import http
 from django.views import View
 import random
-from meiduo_mall.libs.captcha.captcha import captcha
+from meiduo_mall.utils import ratelimit
+from meiduo_mall.utils.ratelimit import RateLimitMixin
 from meiduo_mall.utils.response_code import RETCODE
-from verifications import const
+from verifications import const, captcha_pool
 from venv import logger
 from django_redis import get_redis_connection
 # from libs.yuntongxun.ccp_sms import CCP
@@ -14,9 +15,12 @@ import logging
 logging = logging.getLogger('django')
 
 
-class SMSCodeView(View):
+class SMSCodeView(RateLimitMixin, View):
     """短信验证码"""
 
+    # 按 IP 限流, 手机号在图形验证码校验通过之后限流
+    rate_limit = 'sms_code'
+
     def get(self, request, mobile):
         """
 
@@ -60,6 +64,11 @@ class SMSCodeView(View):
             return http.JsonResponse({'code': RETCODE.IMAGECODEERR,
                                       'errmsg': '输入图形验证码错误'})
 
+        # 按手机号限流
+        retry_after = ratelimit.check('sms_code_mobile', request, {'mobile': mobile})
+        if retry_after:
+            return ratelimit.throttled_response(request, retry_after)
+
         # 7. 生成短信验证码：生成6位数验证码
         sms_code = '%06d' % random.randint(0, 999999)
         logger.info(sms_code)
@@ -91,7 +100,10 @@ class SMSCodeView(View):
 
 # 图形验证码
 
-class ImageCode(View):
+class ImageCode(RateLimitMixin, View):
+
+    # 按 IP 限流
+    rate_limit = 'image_code'
 
     def get(self, request, uuid):
         """
@@ -100,8 +112,8 @@ class ImageCode(View):
         :param uuid: 当前用户的唯一id
         :return: image/jpg
         """
-        # 生成图片验证
-        text, image = captcha.generate_captcha()
+        # 从验证码池中取出图片验证码
+        text, image = captcha_pool.get_captcha()
 
         # 保存图片验证码
         redis_conn = get_redis_connection('verify_code')
@@ -3,16 +3,76 @@
 
 # refer to `https://bitbucket.org/akorn/wheezy.captcha`
 
+import math
 import random
 import string
+import os
 import os.path
 from io import BytesIO
 
 from PIL import Image
+from PIL import ImageChops
 from PIL import ImageFilter
 from PIL.ImageDraw import Draw
 from PIL.ImageFont import truetype
 
+# numpy 为可选依赖: 安装后贝塞尔系数和噪点用数组一次计算, 没有安装时使用原来的逐点绘制
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+if np is not None and hasattr(os, 'register_at_fork'):
+    # numpy 的随机数状态在 fork 之后不会自动重置, 避免多个进程生成相同的噪点
+    os.register_at_fork(after_in_child=np.random.seed)
+
+# 验证码使用的字符
+CHARACTERS = string.ascii_uppercase + string.ascii_uppercase + '3456789'
+
+# 默认的字体和字体大小
+FONT_NAMES = ('Arial.ttf', 'Georgia.ttf', 'actionj.ttf')
+FONT_SIZES = (65, 70, 75)
+
+
+class GlyphCache(object):
+    """
+    字体和字符位图的缓存: 每种 字体 x 大小 只加载一次, 每个字符只渲染一次
+    字符保存为裁剪后的灰度位图(白字黑底), 绘制时在灰度图上变形, 最后用颜色填充, 不再逐个字符创建 RGB 图片
+    """
+
+    def __init__(self):
+        self._fonts = {}
+        self._glyphs = {}
+
+    def font(self, name, size):
+        key = (name, size)
+        font = self._fonts.get(key)
+        if font is None:
+            font = self._fonts[key] = truetype(name, size)
+        return font
+
+    def glyph(self, char, name, size):
+        key = (char, name, size)
+        glyph = self._glyphs.get(key)
+        if glyph is None:
+            glyph = self._glyphs[key] = self._render(char, self.font(name, size))
+        return glyph
+
+    @staticmethod
+    def _render(char, font):
+        image = Image.new('L', (1, 1))
+        c_width, c_height = Draw(image).textsize(char, font=font)
+        image = Image.new('L', (c_width, c_height), 0)
+        Draw(image).text((0, 0), char, font=font, fill=255)
+        return image.crop(image.getbbox())
+
+    def preload(self, fonts, font_sizes=FONT_SIZES, characters=CHARACTERS):
+        """渲染所有字符, 在进程 fork 之前调用时子进程共享缓存"""
+        for name in fonts:
+            for size in font_sizes:
+                for char in set(characters):
+                    self.glyph(char, name, size)
+
 
 class Bezier:
     def __init__(self):
@@ -43,6 +103,13 @@ class Bezier:
             return self.beziers[n]
         except KeyError:
             combinations = self.pascal_row(n - 1)
+            if np is not None:
+                # 系数矩阵 (len(tsequence), n), 和路径点相乘得到曲线上的点
+                t = np.array(self.tsequence)[:, None]
+                i = np.arange(n)
+                result = np.array(combinations) * t ** i * (1 - t) ** (n - 1 - i)
+                self.beziers[n] = result
+                return result
             result = []
             for t in self.tsequence:
                 tpowers = (t ** i for i in range(n))
@@ -58,6 +125,7 @@ class Captcha(object):
     def __init__(self):
         self._bezier = Bezier()
         self._dir = os.path.dirname(__file__)
+        self._glyphs = GlyphCache()
         # self._captcha_path = os.path.join(self._dir, '..', 'static', 'captcha')
 
     @staticmethod
@@ -68,13 +136,17 @@ class Captcha(object):
 
     def initialize(self, width=200, height=75, color=None, text=None, fonts=None):
         # self.image = Image.new('RGB', (width, height), (255, 255, 255))
-        self._text = text if text else random.sample(string.ascii_uppercase + string.ascii_uppercase + '3456789', 4)
+        self._text = text if text else random.sample(CHARACTERS, 4)
         self.fonts = fonts if fonts else \
-            [os.path.join(self._dir, 'fonts', font) for font in ['Arial.ttf', 'Georgia.ttf', 'actionj.ttf']]
+            [os.path.join(self._dir, 'fonts', font) for font in FONT_NAMES]
         self.width = width
         self.height = height
         self._color = color if color else self.random_color(0, 200, random.randint(220, 255))
 
+    def preload(self):
+        """加载默认字体并渲染所有字符, 在创建子进程之前调用, 子进程不用再各自渲染"""
+        self._glyphs.preload([os.path.join(self._dir, 'fonts', font) for font in FONT_NAMES])
+
     @staticmethod
     def random_color(start, end, opacity=None):
         red = random.randint(start, end)
@@ -87,23 +159,35 @@ class Captcha(object):
     # draw image
 
     def background(self, image):
-        Draw(image).rectangle([(0, 0), image.size], fill=self.random_color(238, 255))
+        image.paste(self.random_color(238, 255), (0, 0) + image.size)
         return image
 
     @staticmethod
     def smooth(image):
         return image.filter(ImageFilter.SMOOTH)
 
+    def compose(self, layer, color=None):
+        """
+        按覆盖度图层在背景上填充颜色, 和直接在 RGB 图片上绘制再平滑的结果一致(相差取整误差)
+        :param layer: 覆盖度图层, 0 为背景, 255 为文字颜色
+        """
+        color = color if color else self._color
+        background = Image.new('RGB', layer.size, self.random_color(238, 255))
+        return Image.composite(Image.new('RGB', layer.size, color[:3]), background, layer)
+
     def curve(self, image, width=4, number=6, color=None):
         dx, height = image.size
         dx /= number
         path = [(dx * i, random.randint(0, height))
                 for i in range(1, number)]
         bcoefs = self._bezier.make_bezier(number - 1)
-        points = []
-        for coefs in bcoefs:
-            points.append(tuple(sum([coef * p for coef, p in zip(coefs, ps)])
-                                for ps in zip(*path)))
+        if np is not None:
+            points = [tuple(point) for point in np.dot(bcoefs, path).tolist()]
+        else:
+            points = []
+            for coefs in bcoefs:
+                points.append(tuple(sum([coef * p for coef, p in zip(coefs, ps)])
+                                    for ps in zip(*path)))
         Draw(image).line(points, fill=color if color else self._color, width=width)
         return image
 
@@ -113,27 +197,39 @@ class Captcha(object):
         width -= dx
         dy = height / 10
         height -= dy
+        fill = color if color else self._color
         draw = Draw(image)
+        if np is not None:
+            # 每个噪点是 (level + 1) x level 的色块, 和 Draw.line 画出的短线一致, 所有噪点的坐标一次算出, 一次画完
+            xy = np.random.uniform((dx, dy), (width, height), (number, 1, 1, 2)).astype(int)
+            xy[..., 1] -= level // 2
+            block_y, block_x = np.mgrid[0:level, 0:level + 1]
+            points = xy + np.stack((block_x, block_y), axis=-1)
+            draw.point(points.ravel().tolist(), fill=fill)
+            return image
         for i in range(number):
             x = int(random.uniform(dx, width))
             y = int(random.uniform(dy, height))
-            draw.line(((x, y), (x + level, y)), fill=color if color else self._color, width=level)
+            draw.line(((x, y), (x + level, y)), fill=fill, width=level)
         return image
 
+    @staticmethod
+    def _scale_mask(mask, color):
+        """
+        换算粘贴蒙版, 和原来 char_image.convert('L').point(lambda i: i * 1.97) 的结果一致(相差取整误差):
+        蒙版乘以 文字颜色亮度 / 255 * 1.97, 超过 255 截断
+        ImageChops.add 计算 (mask + mask) / scale 并截断, 一次 C 调用完成, 比 Image.point 在 Python 中处理映射表快
+        """
+        luminance = (color[0] * 299 + color[1] * 587 + color[2] * 114) // 1000
+        factor = max(luminance / 255 * 1.97, 1 / 255)
+        return ImageChops.add(mask, mask, 2 / factor)
+
     def text(self, image, fonts, font_sizes=None, drawings=None, squeeze_factor=0.75, color=None):
         color = color if color else self._color
-        fonts = tuple([truetype(name, size)
-                       for name in fonts
-                       for size in font_sizes or (65, 70, 75)])
-        draw = Draw(image)
+        font_keys = [(name, size) for name in fonts for size in font_sizes or FONT_SIZES]
         char_images = []
         for c in self._text:
-            font = random.choice(fonts)
-            c_width, c_height = draw.textsize(c, font=font)
-            char_image = Image.new('RGB', (c_width, c_height), (0, 0, 0))
-            char_draw = Draw(char_image)
-            char_draw.text((0, 0), c, font=font, fill=color)
-            char_image = char_image.crop(char_image.getbbox())
+            char_image = self._glyphs.glyph(c, *random.choice(font_keys))
             for drawing in drawings:
                 d = getattr(self, drawing)
                 char_image = d(char_image)
@@ -142,13 +238,24 @@ class Captcha(object):
         offset = int((width - sum(int(i.size[0] * squeeze_factor)
                                   for i in char_images[:-1]) -
                       char_images[-1].size[0]) / 2)
+        # 所有字符先合并到一张灰度蒙版上, 最后一次换算蒙版、一次填充颜色
+        mask = Image.new('L', image.size, 0)
         for char_image in char_images:
             c_width, c_height = char_image.size
-            mask = char_image.convert('L').point(lambda i: i * 1.97)
-            image.paste(char_image,
-                        (offset, int((height - c_height) / 2)),
-                        mask)
+            mask.paste(255,
+                       (offset, int((height - c_height) / 2)),
+                       char_image)
             offset += int(c_width * squeeze_factor)
+        box = mask.getbbox()
+        if not box:
+            return image
+        mask = self._scale_mask(mask.crop(box), color)
+        if image.mode == 'L':
+            # 覆盖度图层: 直接写入换算后的蒙版, 最后由 compose 填充颜色
+            image.paste(mask, box)
+        else:
+            # 只在有文字的区域内填充
+            image.paste(color[:len(image.getbands())], box, mask)
         return image
 
     # draw text
@@ -161,24 +268,70 @@ class Captcha(object):
         y1 = int(random.uniform(-dy, dy))
         x2 = int(random.uniform(-dx, dx))
         y2 = int(random.uniform(-dy, dy))
-        image2 = Image.new('RGB',
-                           (width + abs(x1) + abs(x2),
-                            height + abs(y1) + abs(y2)))
-        image2.paste(image, (abs(x1), abs(y1)))
-        width2, height2 = image2.size
-        return image2.transform(
+        # 相当于把图片放在 (abs(x1), abs(y1)) 处扩大画布再变形, 直接平移四边形的坐标, 超出原图的部分填充黑色
+        width2 = width + abs(x1) + abs(x2)
+        height2 = height + abs(y1) + abs(y2)
+        ox, oy = abs(x1), abs(y1)
+        return image.transform(
             (width, height), Image.QUAD,
-            (x1, y1,
-             -x1, height2 - y2,
-             width2 + x2, height2 + y2,
-             width2 - x2, -y1))
+            (x1 - ox, y1 - oy,
+             -x1 - ox, height2 - y2 - oy,
+             width2 + x2 - ox, height2 + y2 - oy,
+             width2 - x2 - ox, -y1 - oy))
+
+    @staticmethod
+    def distort(image, dx_factor=0.27, dy_factor=0.21, angle=25, offset_dx_factor=0.1, offset_dy_factor=0.2):
+        """
+        依次 warp、rotate(expand=1)、offset 的合并版本, 三次创建图片、两次重新采样合并为一次 QUAD 变换:
+        输出画布四个角先去掉 offset 的平移, 再按 Image.rotate 的仿射矩阵得到 warp 结果中的坐标,
+        最后经过 warp 的双线性映射得到原图中的四边形
+        """
+        width, height = image.size
+        dx = width * dx_factor
+        dy = height * dy_factor
+        x1 = int(random.uniform(-dx, dx))
+        y1 = int(random.uniform(-dy, dy))
+        x2 = int(random.uniform(-dx, dx))
+        y2 = int(random.uniform(-dy, dy))
+        width2 = width + abs(x1) + abs(x2)
+        height2 = height + abs(y1) + abs(y2)
+        ox, oy = abs(x1), abs(y1)
+        # warp 的四边形: 左上、左下、右下、右上
+        ul, ll, lr, ur = ((x1 - ox, y1 - oy), (-x1 - ox, height2 - y2 - oy),
+                          (width2 + x2 - ox, height2 + y2 - oy), (width2 - x2 - ox, -y1 - oy))
+
+        # 和 Image.rotate 相同的仿射矩阵: 旋转后的坐标 -> warp 结果中的坐标
+        theta = -math.radians(random.uniform(-angle, angle))
+        cos, sin = math.cos(theta), math.sin(theta)
+        cx, cy = width / 2.0, height / 2.0
+        corners = ((-cx, -cy), (cx, -cy), (cx, cy), (-cx, cy))
+        xs = [cos * x + sin * y for x, y in corners]
+        ys = [-sin * x + cos * y for x, y in corners]
+        rotated_width = math.ceil(max(xs) + cx) - math.floor(min(xs) + cx)
+        rotated_height = math.ceil(max(ys) + cy) - math.floor(min(ys) + cy)
+
+        # offset: 在左上方留出随机的空白
+        offset_x = int(random.random() * rotated_width * offset_dx_factor)
+        offset_y = int(random.random() * rotated_height * offset_dy_factor)
+        new_width, new_height = rotated_width + offset_x, rotated_height + offset_y
+
+        quad = []
+        for x, y in ((0, 0), (0, new_height), (new_width, new_height), (new_width, 0)):
+            x -= offset_x + rotated_width / 2.0
+            y -= offset_y + rotated_height / 2.0
+            u = (cos * x + sin * y + cx) / width
+            v = (-sin * x + cos * y + cy) / height
+            # warp 的双线性映射
+            quad.append(ul[0] + (ur[0] - ul[0]) * u + (ll[0] - ul[0]) * v + (ul[0] - ur[0] - ll[0] + lr[0]) * u * v)
+            quad.append(ul[1] + (ur[1] - ul[1]) * u + (ll[1] - ul[1]) * v + (ul[1] - ur[1] - ll[1] + lr[1]) * u * v)
+        return image.transform((new_width, new_height), Image.QUAD, quad, Image.BILINEAR)
 
     @staticmethod
     def offset(image, dx_factor=0.1, dy_factor=0.2):
         width, height = image.size
         dx = int(random.random() * width * dx_factor)
         dy = int(random.random() * height * dy_factor)
-        image2 = Image.new('RGB', (width + dx, height + dy))
+        image2 = Image.new(image.mode, (width + dx, height + dy))
         image2.paste(image, (dx, dy))
         return image2
 
@@ -199,12 +352,13 @@ class Captcha(object):
                 ('JGW9', '\x89PNG\r\n\x1a\n\x00\x00\x00\r...')
 
         """
-        image = Image.new('RGB', (self.width, self.height), (255, 255, 255))
-        image = self.background(image)
-        image = self.text(image, self.fonts, drawings=['warp', 'rotate', 'offset'])
-        image = self.curve(image)
-        image = self.noise(image)
-        image = self.smooth(image)
+        # 文字、曲线和噪点都是同一个颜色, 先画在灰度的覆盖度图层上, 只对一个通道平滑, 最后一次填充颜色
+        layer = Image.new('L', (self.width, self.height), 0)
+        layer = self.text(layer, self.fonts, drawings=['distort'])
+        layer = self.curve(layer, color=255)
+        layer = self.noise(layer, color=255)
+        layer = self.smooth(layer)
+        image = self.compose(layer)
         text = "".join(self._text)
         out = BytesIO()
         image.save(out, format=fmt)
@@ -184,6 +184,20 @@ CACHES = {
             "CLIENT_CLASS": "django_redis.client.DefaultClient",
         }
     },
+    "inventory": {  # 秒杀库存
+        "BACKEND": "django_redis.cache.RedisCache",
+        "LOCATION": "redis://127.0.0.1:6379/6",
+        "OPTIONS": {
+            "CLIENT_CLASS": "django_redis.client.DefaultClient",
+        }
+    },
+    "rankings": {  # 商品排行
+        "BACKEND": "django_redis.cache.RedisCache",
+        "LOCATION": "redis://127.0.0.1:6379/7",
+        "OPTIONS": {
+            "CLIENT_CLASS": "django_redis.client.DefaultClient",
+        }
+    },
 }
 SESSION_ENGINE = "django.contrib.sessions.backends.cache"
 SESSION_CACHE_ALIAS = "session"
@@ -282,3 +296,78 @@ HAYSTACK_CONNECTIONS = {
 # 当添加、修改、删除数据时，自动生成索引
 HAYSTACK_SIGNAL_PROCESSOR = 'haystack.signals.RealtimeSignalProcessor'
 HAYSTACK_SEARCH_RESULTS_PER_PAGE = 5
+
+# 页面静态化文件的保存目录
+STATIC_HTML_DIR = os.path.join(os.path.dirname(BASE_DIR), 'static_html')
+# 详情页静态文件的有效期, 单位: 秒, 过期后改为动态渲染
+DETAIL_HTML_EXPIRES = 3600
+# 首页静态文件的有效期, 单位: 秒
+INDEX_HTML_EXPIRES = 3600
+# 首页重新生成的延迟时间, 单位: 秒, 这段时间内的多次修改只会生成一次
+INDEX_HTML_DEBOUNCE = 10
+
+# 是否开启秒杀库存: 开启后, 通过 flash_stock 命令加载到 Redis 中的 SKU 在下单时只扣减 Redis 库存,
+# 再由定时任务批量同步到数据库
+FLASH_STOCK_ENABLED = False
+
+# 是否开启排队下单: 开启后, 提交订单只返回订单号, 由 celery 任务保存订单, 前端轮询订单状态
+ORDER_QUEUE_ENABLED = False
+
+# 登录时合并 cookie 购物车的策略: cookie 以 cookie 中的数量为准, sum 数量相加, max 取较大的数量
+CARTS_MERGE_POLICY = 'cookie'
+# 购物车最多保存的商品种类数
+CARTS_MAX_ITEMS = 100
+
+# 未登录用户购物车的存储方式: cookie 保存在 cookie 中, redis 保存在 Redis 中, cookie 只保存签名后的令牌
+CARTS_ANONYMOUS_STORAGE = 'cookie'
+# 未登录用户 Redis 购物车的有效期, 单位: 秒
+CARTS_ANONYMOUS_EXPIRES = 3600 * 24 * 7
+
+# 接口限流策略: {策略名称: [(维度, 令牌桶容量, 补满所需秒数)]}, 维度为 ip/mobile/username
+# 令牌桶容量为允许的突发次数, 补满之后平均每 秒数/容量 秒允许一次
+RATE_LIMITS = {
+    # 图形验证码: 每个 IP 每分钟 20 次
+    'image_code': [('ip', 20, 60)],
+    # 短信验证码: 每个 IP 每小时 20 次
+    'sms_code': [('ip', 20, 3600)],
+    # 短信验证码: 每个手机号每小时 5 次, 图形验证码校验通过之后才扣减, 避免他人用错误的请求耗尽这个手机号的次数
+    'sms_code_mobile': [('mobile', 5, 3600)],
+    # 登录: 每个 IP 每分钟 20 次, 每个用户名每 10 分钟 10 次
+    'login': [('ip', 20, 60), ('username', 10, 600)],
+    # 手机号、用户名是否已注册: 每个 IP 每分钟 60 次
+    'register_check': [('ip', 60, 60)],
+}
+# 限流时获取客户端 IP 的 request.META 字段, 部署在反向代理后面时改为代理设置的请求头, 例如 HTTP_X_REAL_IP
+RATE_LIMIT_IP_HEADER = 'REMOTE_ADDR'
+
+# 短信服务商配置, concurrency 为同时向服务商发送短信的任务数
+SMS_PROVIDERS = {
+    # 容联云通讯, 生产环境 host 改为 app.cloopen.com
+    'ccp': {
+        'host': 'sandboxapp.cloopen.com',
+        'port': 8883,
+        'ssl': True,
+        # 和 yuntongxun.ccp_sms 一致, 不验证沙箱环境的证书
+        'verify_ssl': False,
+        'timeout': 5,
+        'version': '2013-12-26',
+        'account_sid': '8aaf07086ab0c082016ac05b91f90cd5',
+        'account_token': 'e02a5d7097154c99adc1effca825dffd',
+        'app_id': '8aaf07086ab0c082016ac05b924b0cdc',
+        'concurrency': 4,
+    },
+    # 本地模拟服务, 压力测试时使用: python scripts/fake_sms_provider.py
+    'fake': {
+        'host': '127.0.0.1',
+        'port': 8900,
+        'ssl': False,
+        'timeout': 5,
+        'version': '2013-12-26',
+        'account_sid': 'fake',
+        'account_token': 'fake',
+        'app_id': 'fake',
+        'concurrency': 8,
+    },
+}
+# 当前使用的短信服务商
+SMS_PROVIDER = 'ccp'
@@ -68,6 +68,12 @@ var vm = new Vue({
             this.total_selected_amount = amount.toFixed(2); // for循环中不要使用toFixed的累加
             this.total_selected_count = total_count;
         },
+        // 使用服务器维护的购物车合计
+        apply_totals(totals){
+            this.total_count = totals.count;
+            this.total_selected_count = totals.selected_count;
+            this.total_selected_amount = totals.selected_amount;
+        },
         // 减少操作
         on_minus(index){
             if (this.carts[index].count > 1) {
@@ -117,9 +123,8 @@ var vm = new Vue({
                     if (response.data.code == '0') {
                         // this.carts[index].count = response.data.cart_sku.count; // 无法触发页面更新
                         Vue.set(this.carts, index, response.data.cart_sku); // 触发页面更新
-                        // 重新计算界面的价格和数量
-                        this.compute_total_selected_amount_count();
-                        this.compute_total_count();
+                        // 使用服务器返回的合计更新界面的价格和数量
+                        this.apply_totals(response.data.totals);
 
                         // 更新成功将新的购物车再次临时保存
                         this.carts_tmp = this.carts;
@@ -150,9 +155,8 @@ var vm = new Vue({
                 .then(response => {
                     if (response.data.code == '0') {
                         this.carts[index].selected = response.data.cart_sku.selected;
-                        // 重新计算界面的价格和数量
-                        this.compute_total_selected_amount_count();
-                        this.compute_total_count();
+                        // 使用服务器返回的合计更新界面的价格和数量
+                        this.apply_totals(response.data.totals);
                     } else {
                         alert(response.data.errmsg);
                     }
@@ -177,9 +181,8 @@ var vm = new Vue({
                 .then(response => {
                     if (response.data.code == '0') {
                         this.carts.splice(index, 1);
-                        // 重新计算界面的价格和数量
-                        this.compute_total_selected_amount_count();
-                        this.compute_total_count();
+                        // 使用服务器返回的合计更新界面的价格和数量
+                        this.apply_totals(response.data.totals);
                     } else {
                         alert(response.data.errmsg);
                     }
@@ -205,9 +208,8 @@ var vm = new Vue({
                         for (var i=0; i<this.carts.length;i++){
                             this.carts[i].selected = selected;
                         }
-                        // 重新计算界面的价格和数量
-                        this.compute_total_selected_amount_count();
-                        this.compute_total_count();
+                        // 使用服务器返回的合计更新界面的价格和数量
+                        this.apply_totals(response.data.totals);
                     } else {
                         alert(response.data.errmsg);
                     }
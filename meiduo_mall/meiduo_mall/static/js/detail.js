@@ -37,8 +37,8 @@ var vm = new Vue({
         // 记录商品详情的访问量
 		this.detail_visit();
 
-		// 获取购物车数据
-        this.get_carts();
+		// 获取购物车数量
+        this.get_cart_totals();
 
 		// 获取商品评价信息
         this.get_goods_comment();
@@ -160,7 +160,7 @@ var vm = new Vue({
                 .then(response => {
                     if (response.data.code == '0') {
                         alert('添加购物车成功');
-                        this.cart_total_count += this.sku_count;
+                        this.cart_total_count = response.data.totals.count;
                     } else { // 参数错误
                         alert(response.data.errmsg);
                     }
@@ -169,6 +169,19 @@ var vm = new Vue({
                     console.log(error.response);
                 })
         },
+        // 获取购物车合计, 只用于显示购物车数量, 不需要查询购物车中的商品
+        get_cart_totals(){
+            var url = this.host + '/carts/totals/';
+            axios.get(url, {
+                    responseType: 'json',
+                })
+                .then(response => {
+                    this.cart_total_count = response.data.totals.count;
+                })
+                .catch(error => {
+                    console.log(error.response);
+                })
+        },
         // 获取购物车数据
         get_carts(){
         	var url = this.host + '/carts/simple/';
@@ -10,13 +10,26 @@ var vm = new Vue({
         category_id: category_id,
     },
     mounted(){
-        // 获取购物车数据
-        this.get_carts();
+        // 获取购物车数量
+        this.get_cart_totals();
 
 		// 获取热销商品数据
         this.get_hot_goods();
     },
     methods: {
+        // 获取购物车合计, 只用于显示购物车数量, 不需要查询购物车中的商品
+        get_cart_totals(){
+            var url = this.host + '/carts/totals/';
+            axios.get(url, {
+                    responseType: 'json',
+                })
+                .then(response => {
+                    this.cart_total_count = response.data.totals.count;
+                })
+                .catch(error => {
+                    console.log(error.response);
+                })
+        },
         // 获取购物车数据
         get_carts(){
         	var url = this.host + '/carts/simple/';
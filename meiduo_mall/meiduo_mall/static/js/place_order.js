@@ -40,12 +40,16 @@ var vm = new Vue({
                     })
                     .then(response => {
                         if (response.data.code == '0') {
-                            location.href = '/orders/success/?order_id='+response.data.order_id
-                                        +'&payment_amount='+this.payment_amount
-                                        +'&pay_method='+this.pay_method;
+                            if (response.data.queued) {
+                                // 排队下单, 轮询订单状态
+                                this.poll_order_status(response.data.order_id, 0);
+                            } else {
+                                this.to_order_success(response.data.order_id);
+                            }
                         } else if (response.data.code == '4101') {
                             location.href = '/login/?next=/orders/settlement/';
                         } else {
+                            this.order_submitting = false;
                             alert(response.data.errmsg);
                         }
                     })
@@ -54,6 +58,43 @@ var vm = new Vue({
                         console.log(error.response);
                     })
             }
+        },
+        // 跳转到提交订单成功页面
+        to_order_success(order_id){
+            location.href = '/orders/success/?order_id='+order_id
+                        +'&payment_amount='+this.payment_amount
+                        +'&pay_method='+this.pay_method;
+        },
+        // 查询排队下单的订单状态, 最多查询60次
+        poll_order_status(order_id, times){
+            if (times >= 60) {
+                this.order_submitting = false;
+                alert('订单处理超时, 请到我的订单中查看');
+                return;
+            }
+            var url = this.host + '/orders/status/' + order_id + '/';
+            axios.get(url, {
+                    responseType: 'json'
+                })
+                .then(response => {
+                    if (response.data.status == 'success') {
+                        this.to_order_success(order_id);
+                    } else if (response.data.status == 'queued') {
+                        setTimeout(() => {
+                            this.poll_order_status(order_id, times + 1);
+                        }, 1000);
+                    } else {
+                        this.order_submitting = false;
+                        alert(response.data.errmsg);
+                    }
+                })
+                .catch(error => {
+                    // 网络错误, 稍后重试
+                    setTimeout(() => {
+                        this.poll_order_status(order_id, times + 1);
+                    }, 1000);
+                    console.log(error.response);
+                })
         }
     }
 });
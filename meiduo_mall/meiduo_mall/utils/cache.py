@@ -0,0 +1,55 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """
+    进程内的 LRU 缓存, 放在 Redis 缓存前面, 减少反序列化和网络往返
+    maxsize: 最多保存的条目数, 超出后淘汰最久未使用的条目
+    timeout: 条目的有效期(秒), None 表示不过期
+    """
+
+    def __init__(self, maxsize=128, timeout=None):
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """获取缓存, 不存在或者已过期时返回 default"""
+        with self._lock:
+            try:
+                expires, value = self._data[key]
+            except KeyError:
+                return default
+
+            # 过期的条目直接删除
+            if expires is not None and expires < time.monotonic():
+                del self._data[key]
+                return default
+
+            # 标记为最近使用
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout=None):
+        """保存缓存, timeout 不传时使用默认有效期"""
+        timeout = self.timeout if timeout is None else timeout
+        expires = None if timeout is None else time.monotonic() + timeout
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            # 超出容量, 淘汰最久未使用的条目
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        """删除缓存"""
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._data.clear()
@@ -0,0 +1,143 @@
+"""
+接口限流: 令牌桶保存在 Redis 哈希中, 一次 Lua 脚本检查并扣减一个接口的所有限流维度, 被拒绝的请求只访问一次 Redis
+
+限流策略配置在 settings.RATE_LIMITS 中: {策略名称: [(维度, 令牌桶容量, 补满所需秒数)]}
+维度: ip 按客户端 IP, mobile/username 按路由参数或者请求参数中的手机号/用户名, 请求中没有这个参数时不限制
+令牌桶: 容量为允许的突发次数, 令牌按照 容量/秒数 的速度连续补充, 每次请求消耗一个令牌
+"""
+import logging
+import math
+import time
+from functools import wraps
+
+from django import http
+from django.conf import settings
+from django_redis import get_redis_connection
+
+from meiduo_mall.utils.redis_script import RedisScript
+from meiduo_mall.utils.response_code import RETCODE
+
+logger = logging.getLogger('django')
+
+# 检查并扣减令牌: 所有维度都有令牌时才一起扣减, 任何一个维度没有令牌时都不扣减
+# KEYS: 每个维度的令牌桶  ARGV[1]: 当前时间  ARGV[2i], ARGV[2i+1]: 第 i 个令牌桶的容量和每秒补充的令牌数
+# 返回: 需要等待的秒数, '0' 表示允许访问
+TOKEN_BUCKET_SCRIPT = RedisScript("""
+local now = tonumber(ARGV[1])
+local tokens = {}
+local wait = 0
+for i = 1, #KEYS do
+    local capacity = tonumber(ARGV[i * 2])
+    local rate = tonumber(ARGV[i * 2 + 1])
+    local bucket = redis.call('HMGET', KEYS[i], 'tokens', 'ts')
+    local count = capacity
+    if bucket[1] then
+        count = math.min(capacity, tonumber(bucket[1]) + math.max(0, now - tonumber(bucket[2])) * rate)
+    end
+    if count < 1 then
+        wait = math.max(wait, (1 - count) / rate)
+    end
+    tokens[i] = count
+end
+if wait > 0 then
+    return tostring(wait)
+end
+for i = 1, #KEYS do
+    local capacity = tonumber(ARGV[i * 2])
+    local rate = tonumber(ARGV[i * 2 + 1])
+    redis.call('HMSET', KEYS[i], 'tokens', tostring(tokens[i] - 1), 'ts', ARGV[1])
+    redis.call('EXPIRE', KEYS[i], math.ceil(capacity / rate) + 1)
+end
+return '0'
+""")
+
+# 维度的值最多保留的长度, 避免用户提交的超长参数写入键名
+MAX_IDENTITY_LENGTH = 64
+
+
+def _get_redis_conn():
+    """限流使用的 Redis 连接"""
+    return get_redis_connection('default')
+
+
+def _get_identity(dimension, request, view_kwargs):
+    """
+    获取请求在一个维度上的值
+    :return: 字符串, 请求中没有时返回 None
+    """
+    if dimension == 'ip':
+        return request.META.get(getattr(settings, 'RATE_LIMIT_IP_HEADER', 'REMOTE_ADDR'))
+    value = view_kwargs.get(dimension) or request.POST.get(dimension) or request.GET.get(dimension)
+    return value[:MAX_IDENTITY_LENGTH] if value else None
+
+
+def check(name, request, view_kwargs=None):
+    """
+    检查请求是否超过限流策略, 没有超过时扣减令牌
+    Redis 出错时不限制, 避免 Redis 故障导致接口不可用
+    :param name: settings.RATE_LIMITS 中的策略名称
+    :param request: 请求对象
+    :param view_kwargs: 视图的路由参数
+    :return: 需要等待的秒数, 0 表示允许访问
+    """
+    rules = getattr(settings, 'RATE_LIMITS', {}).get(name)
+    if not rules:
+        return 0
+
+    keys = []
+    args = [repr(time.time())]
+    for dimension, capacity, period in rules:
+        value = _get_identity(dimension, request, view_kwargs or {})
+        if not value:
+            continue
+        keys.append('ratelimit_%s_%s_%s' % (name, dimension, value))
+        args.extend([capacity, repr(capacity / period)])
+    if not keys:
+        return 0
+
+    try:
+        redis_conn = _get_redis_conn()
+        wait = float(TOKEN_BUCKET_SCRIPT(redis_conn, keys=keys, args=args))
+    except Exception as e:
+        logger.error(e)
+        return 0
+    return wait
+
+
+def throttled_response(request, retry_after):
+    """默认的拒绝响应: 和其他接口一样返回 json, 前端根据 code 提示"""
+    response = http.JsonResponse({'code': RETCODE.THROTTLINGERR,
+                                  'errmsg': '访问过于频繁'})
+    response['Retry-After'] = int(math.ceil(retry_after))
+    return response
+
+
+def ratelimit(name, response=None):
+    """
+    限流装饰器, 类视图的方法使用 method_decorator(ratelimit(...))
+    :param name: settings.RATE_LIMITS 中的策略名称
+    :param response: 生成拒绝响应的函数 response(request, retry_after), 默认返回 json
+    """
+
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            retry_after = check(name, request, kwargs)
+            if retry_after:
+                return (response or throttled_response)(request, retry_after)
+            return view_func(request, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+class RateLimitMixin(object):
+    """限流的 Mixin 扩展类, 对视图的所有请求方法限流, rate_limit 设置为策略名称"""
+
+    rate_limit = None
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        view = super().as_view(**initkwargs)
+        return ratelimit(cls.rate_limit)(view)
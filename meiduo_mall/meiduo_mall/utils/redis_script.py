@@ -0,0 +1,16 @@
+from redis.client import Script
+
+
+class RedisScript(Script):
+    """
+    模块级别的 Lua 脚本, 导入时计算一次 sha1, 不需要每次执行都调用 register_script
+    执行时传入 Redis 连接: SCRIPT(redis_conn, keys=[...], args=[...])
+    服务器上没有缓存这个脚本时自动 SCRIPT LOAD 后再执行
+    """
+
+    def __init__(self, script):
+        # 传入 bytes, 不需要绑定连接获取编码
+        super().__init__(None, script.encode())
+
+    def __call__(self, redis_conn, keys=(), args=()):
+        return super().__call__(keys=keys, args=args, client=redis_conn)
@@ -74,6 +74,7 @@ class RETCODE:
     OPENIDERR           = "5005"
     PARAMERR            = "5006"
     STOCKERR            = "5007"
+    CARTSFULLERR        = "5008"
 
 
 err_msg = {
@@ -96,4 +97,5 @@ err_msg = {
     RETCODE.OPENIDERR          : u"无效的openid",
     RETCODE.PARAMERR           : u"参数错误",
     RETCODE.STOCKERR           : u"库存不足",
+    RETCODE.CARTSFULLERR       : u"购物车已满",
 }
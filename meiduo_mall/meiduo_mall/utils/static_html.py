@@ -0,0 +1,70 @@
+import os
+import tempfile
+import time
+
+from django.conf import settings
+
+
+def get_static_html_path(*paths):
+    """
+    获取静态化页面的保存路径
+    :param paths: 相对于静态化目录的路径
+    :return: 绝对路径
+    """
+    return os.path.join(settings.STATIC_HTML_DIR, *paths)
+
+
+def write_static_html(path, html):
+    """
+    写入静态化页面
+    先写入同目录下的临时文件, 再原子地重命名, 读取方不会读到写了一半的文件
+    :param path: 静态文件路径
+    :param html: 页面内容
+    """
+    dir_name = os.path.dirname(path)
+    os.makedirs(dir_name, exist_ok=True)
+
+    fd, tmp_path = tempfile.mkstemp(dir=dir_name, prefix='.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(html)
+        # 临时文件默认权限是 0600, 改为 web 服务器可读
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+
+
+def delete_static_html(path):
+    """
+    删除静态化页面, 文件不存在时忽略
+    :param path: 静态文件路径
+    """
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def open_static_html(path, expires):
+    """
+    打开没有过期的静态化页面
+    直接打开文件再检查打开的文件是否过期, 不会出现判断之后文件被删除或者替换的情况
+    :param path: 静态文件路径
+    :param expires: 有效期, 单位: 秒
+    :return: 二进制读取的文件对象, 不存在或者已过期时返回 None
+    """
+    try:
+        f = open(path, 'rb')
+    except OSError:
+        return None
+    try:
+        mtime = os.fstat(f.fileno()).st_mtime
+    except OSError:
+        f.close()
+        return None
+    if time.time() - mtime >= expires:
+        f.close()
+        return None
+    return f
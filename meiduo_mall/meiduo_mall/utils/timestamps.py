@@ -0,0 +1,26 @@
+import datetime
+
+from django.utils import timezone
+
+# 微秒数的起始时间
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def to_microseconds(value):
+    """
+    时间转为微秒数, 只使用整数运算, 没有浮点误差
+    商品列表的 create_time 游标和分类排行的上架时间分数都使用这个换算, 两者必须一致才能互相衔接
+    :param value: 带时区的时间
+    :return: 从 1970-01-01 UTC 开始的微秒数
+    """
+    delta = value - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 10 ** 6 + delta.microseconds
+
+
+def from_microseconds(value):
+    """
+    微秒数转为时间, to_microseconds 的逆运算
+    :param value: 从 1970-01-01 UTC 开始的微秒数
+    :return: UTC 时间
+    """
+    return EPOCH + datetime.timedelta(microseconds=value)
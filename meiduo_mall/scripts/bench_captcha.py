@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+"""
+图形验证码生成速度的基准测试: 每个步骤的耗时、单核每秒生成数量、多进程的总吞吐量
+
+用法: 在 meiduo_mall 目录下执行 python scripts/bench_captcha.py [--number 次数] [--processes 进程数...]
+      [--reference 另一个版本的 captcha.py]
+和旧版本比较时, 先导出旧版本的文件, 例如:
+    git show <提交>:meiduo_mall/meiduo_mall/libs/captcha/captcha.py > /tmp/captcha_old.py
+    python scripts/bench_captcha.py --reference /tmp/captcha_old.py
+"""
+import argparse
+import importlib.util
+import multiprocessing
+import os
+import random
+import sys
+import time
+import timeit
+from io import BytesIO
+
+from PIL import Image
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+from meiduo_mall.libs.captcha import captcha as captcha_module  # noqa: E402
+
+
+def load_reference(path):
+    """加载另一个版本的 captcha.py, 使用当前版本的字体目录"""
+    spec = importlib.util.spec_from_file_location('captcha_reference', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    module.captcha._dir = os.path.dirname(captcha_module.__file__)
+    return module.captcha
+
+
+def bench_steps(captcha, number):
+    """每个绘制步骤的平均耗时(us)"""
+    captcha.initialize()
+    if hasattr(captcha, 'compose'):
+        # 在灰度的覆盖度图层上绘制, 最后填充颜色
+        layer = Image.new('L', (captcha.width, captcha.height), 0)
+        image = captcha.compose(layer)
+        steps = [
+            ('text', lambda: captcha.text(layer.copy(), captcha.fonts, drawings=['distort'])),
+            ('curve', lambda: captcha.curve(layer.copy(), color=255)),
+            ('noise', lambda: captcha.noise(layer.copy(), color=255)),
+            ('smooth', lambda: captcha.smooth(layer)),
+            ('compose', lambda: captcha.compose(layer)),
+        ]
+    else:
+        image = Image.new('RGB', (captcha.width, captcha.height), (255, 255, 255))
+        steps = [
+            ('text', lambda: captcha.text(image.copy(), captcha.fonts, drawings=['warp', 'rotate', 'offset'])),
+            ('curve', lambda: captcha.curve(image.copy())),
+            ('noise', lambda: captcha.noise(image.copy())),
+            ('smooth', lambda: captcha.smooth(image)),
+        ]
+    steps.append(('jpeg', lambda: image.save(BytesIO(), format='JPEG')))
+    return [(name, timeit.timeit(func, number=number) / number * 1e6) for name, func in steps]
+
+
+def _generate(_):
+    return captcha_module.captcha.generate_captcha()
+
+
+def bench_processes(processes, number):
+    """多进程每秒生成的数量"""
+    captcha_module.captcha.preload()
+    pool = multiprocessing.Pool(processes, initializer=random.seed)
+    try:
+        start = time.time()
+        for _ in pool.imap_unordered(_generate, range(number), chunksize=10):
+            pass
+        return number / (time.time() - start)
+    finally:
+        pool.terminate()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--number', type=int, default=500)
+    parser.add_argument('--processes', type=int, nargs='*', default=[])
+    parser.add_argument('--reference', help='作为对照的 captcha.py')
+    args = parser.parse_args()
+
+    random.seed(0)
+    renderers = [('当前版本%s' % ('' if captcha_module.np is not None else '(无 numpy)'), captcha_module.captcha)]
+    if args.reference:
+        renderers.append(('对照版本', load_reference(args.reference)))
+
+    rates = []
+    for name, captcha in renderers:
+        # 第一次生成会加载字体, 不计入耗时
+        captcha.generate_captcha()
+        seconds = timeit.timeit(captcha.generate_captcha, number=args.number)
+        rates.append(args.number / seconds)
+        print('%s: %.0f 个/秒/核, 每个 %.2f ms' % (name, rates[-1], seconds / args.number * 1e3))
+        for step, us in bench_steps(captcha, args.number):
+            print('  %-8s %10.1f us' % (step, us))
+
+    if len(rates) > 1:
+        print('单核提升: %.2f 倍' % (rates[0] / rates[1]))
+
+    for processes in args.processes:
+        print('%d 个进程: %.0f 个/秒' % (processes, bench_processes(processes, args.number)))
+
+
+if __name__ == '__main__':
+    main()
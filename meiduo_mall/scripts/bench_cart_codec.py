@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+"""
+比较 cookie 购物车新旧编码的大小和编解码耗时
+
+用法: 在 meiduo_mall 目录下执行 python scripts/bench_cart_codec.py [--items 商品数量...] [--number 次数]
+"""
+import argparse
+import base64
+import os
+import pickle
+import random
+import sys
+import timeit
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+sys.path.insert(0, os.path.join(BASE_DIR, 'meiduo_mall', 'apps'))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'meiduo_mall.settings.dev')
+
+import django  # noqa: E402
+
+django.setup()
+
+from carts import codec  # noqa: E402
+
+
+def make_cart(items):
+    """生成测试用的购物车"""
+    return {
+        random.randint(1, 100000): {'count': random.randint(1, 20), 'selected': random.random() < 0.8}
+        for _ in range(items)
+    }
+
+
+def pickle_dumps(cart_dict):
+    return base64.b64encode(pickle.dumps(cart_dict)).decode()
+
+
+def pickle_loads(cookie_cart):
+    return pickle.loads(base64.b64decode(cookie_cart))
+
+
+def bench(items, number):
+    cart_dict = make_cart(items)
+    old_cookie = pickle_dumps(cart_dict)
+    new_cookie = codec.dumps(cart_dict)
+    assert codec.loads(new_cookie) == cart_dict
+    assert codec.loads(old_cookie) == cart_dict
+
+    rows = [
+        ('pickle+base64', len(old_cookie),
+         timeit.timeit(lambda: pickle_dumps(cart_dict), number=number),
+         timeit.timeit(lambda: pickle_loads(old_cookie), number=number)),
+        ('codec v%s' % codec.CART_CODEC_VERSION, len(new_cookie),
+         timeit.timeit(lambda: codec.dumps(cart_dict), number=number),
+         timeit.timeit(lambda: codec.loads(new_cookie), number=number)),
+        ('codec 读取旧格式', len(old_cookie), 0,
+         timeit.timeit(lambda: codec.loads(old_cookie), number=number)),
+    ]
+
+    print('商品数量: %d' % items)
+    print('  %-16s %8s %12s %12s' % ('格式', '字节', '编码(us)', '解码(us)'))
+    for name, size, encode_time, decode_time in rows:
+        print('  %-16s %8d %12.2f %12.2f' % (name, size, encode_time / number * 1e6, decode_time / number * 1e6))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--items', type=int, nargs='+', default=[1, 5, 20, 50])
+    parser.add_argument('--number', type=int, default=10000)
+    args = parser.parse_args()
+
+    random.seed(0)
+    for items in args.items:
+        bench(items, args.number)
+
+
+if __name__ == '__main__':
+    main()
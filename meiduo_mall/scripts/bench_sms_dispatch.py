@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+"""
+短信批量发送的压力测试: 向队列放入一批短信, 用多个线程模拟 worker 发送到本地模拟服务, 统计每秒发送数量
+
+用法: 先启动 python scripts/fake_sms_provider.py, 再在 meiduo_mall 目录下执行
+      python scripts/bench_sms_dispatch.py [--messages 短信数量] [--workers 线程数]
+--baseline 同时测试每条短信新建一个连接(原来的发送方式)的速度
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+sys.path.insert(0, os.path.join(BASE_DIR, 'meiduo_mall', 'apps'))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'meiduo_mall.settings.dev')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.conf import settings  # noqa: E402
+
+from celery_tasks.sms import dispatch  # noqa: E402
+
+PROVIDER = 'fake'
+
+
+def fill_queue(messages):
+    """直接放入队列, 不提交 celery 任务"""
+    redis_conn = dispatch._get_redis_conn()
+    redis_conn.delete(dispatch.SMS_QUEUE_KEY)
+    items = [json.dumps({'mobile': '138%08d' % i, 'datas': ['%06d' % i, 5], 'template_id': 1, 'attempts': 0})
+             for i in range(messages)]
+    for i in range(0, len(items), 1000):
+        redis_conn.rpush(dispatch.SMS_QUEUE_KEY, *items[i:i + 1000])
+
+
+def bench_dispatch(messages, workers):
+    fill_queue(messages)
+    results = []
+
+    def worker():
+        results.append(dispatch.dispatch(PROVIDER))
+
+    threads = [threading.Thread(target=worker) for _ in range(workers)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.time() - start
+
+    sent = sum(result or 0 for result in results)
+    print('批量发送: %d 个线程, 发送 %d 条, %.0f 条/秒, 没有名额的线程 %d 个' % (
+        workers, sent, sent / seconds, results.count(None)))
+
+
+def bench_baseline(messages):
+    """每条短信新建一个客户端和连接"""
+    start = time.time()
+    sent = 0
+    for i in range(messages):
+        client = dispatch.CCPClient(settings.SMS_PROVIDERS[PROVIDER])
+        success, _ = client.send('138%08d' % i, ['%06d' % i, 5], 1)
+        client.close()
+        sent += success
+    seconds = time.time() - start
+    print('逐条新建连接: 发送 %d 条, %.0f 条/秒' % (sent, sent / seconds))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4, 8])
+    parser.add_argument('--baseline', action='store_true')
+    args = parser.parse_args()
+
+    if args.baseline:
+        bench_baseline(args.messages)
+    for workers in args.workers:
+        bench_dispatch(args.messages, workers)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+"""
+本地模拟的云通讯短信接口, 用于短信批量发送的压力测试, 支持 keep-alive, 返回 json
+
+用法: python scripts/fake_sms_provider.py [--port 8900] [--latency 毫秒] [--fail-rate 失败比例] [--fail-code 失败时的状态码]
+然后把 settings.SMS_PROVIDER 改为 fake, 或者执行 python scripts/bench_sms_dispatch.py
+"""
+import argparse
+import json
+import random
+import re
+import socket
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+PATH_RE = re.compile(r'^/[^/]+/Accounts/[^/]+/SMS/TemplateSMS\?sig=[0-9A-F]{32}$')
+
+
+class Stats(object):
+    """请求数和连接数的统计"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.connections = 0
+
+    def add(self, requests=0, connections=0):
+        with self.lock:
+            self.requests += requests
+            self.connections += connections
+
+
+class Handler(BaseHTTPRequestHandler):
+    # 使用 HTTP/1.1 才能保持连接
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        # 响应头和包体分两次写入, 关闭 Nagle 算法, 避免和客户端的延迟确认叠加
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.server.stats.add(connections=1)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.server.stats.add(requests=1)
+
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        try:
+            data = json.loads(body.decode())
+        except ValueError:
+            data = None
+
+        if not PATH_RE.match(self.path) or not self.headers.get('Authorization') or not data:
+            result = {'statusCode': '172002', 'statusMsg': '请求格式错误'}
+        elif random.random() < self.server.fail_rate:
+            result = {'statusCode': self.server.fail_code, 'statusMsg': '发送失败'}
+        else:
+            result = {
+                'statusCode': '000000',
+                'templateSMS': {
+                    'smsMessageSid': uuid.uuid4().hex,
+                    'dateCreated': time.strftime('%Y%m%d%H%M%S'),
+                },
+            }
+
+        content = json.dumps(result).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json;charset=utf-8')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def report(stats, interval):
+    """定时打印每秒请求数"""
+    last = 0
+    while True:
+        time.sleep(interval)
+        requests = stats.requests
+        print('请求: %d (%.0f 次/秒), 连接: %d' % (requests, (requests - last) / interval, stats.connections))
+        last = requests
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--latency', type=float, default=0, help='每个请求的延迟, 单位: 毫秒')
+    parser.add_argument('--fail-rate', type=float, default=0, help='返回发送失败的比例')
+    parser.add_argument('--fail-code', default='172001',
+                        help='发送失败时返回的状态码, 默认 172001 网络错误(会重试), 160038 等为不重试的错误')
+    parser.add_argument('--interval', type=float, default=5, help='打印统计的间隔, 单位: 秒')
+    args = parser.parse_args()
+
+    server = Server((args.host, args.port), Handler)
+    server.stats = Stats()
+    server.latency = args.latency / 1000
+    server.fail_rate = args.fail_rate
+    server.fail_code = args.fail_code
+
+    reporter = threading.Thread(target=report, args=(server.stats, args.interval))
+    reporter.daemon = True
+    reporter.start()
+
+    print('模拟短信服务: http://%s:%d' % (args.host, args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()